@@ -0,0 +1,91 @@
+import gc
+import sys
+import tracemalloc
+import plavka_xlsx
+from plavka_storage import EXCEL_FILENAME, HEADERS, normalize_row
+from plavka_schema import CASTING_COLUMN, EXPERIMENT_COLUMN, PARTICIPANT_COLUMNS, category_key
+from plavka_records import MeltRecord
+from plavka_analytics import RecordColumns
+
+# Память на хранение истории плавок в разных представлениях.
+# Записи plavka.xlsx размножаются до нужного числа с уникальными ID,
+# учетными номерами и номерами плавок, как в настоящем журнале.
+# Последняя строка - то, что приложение держит поверх строк кэша для
+# анализа и поиска: столбцы RecordColumns (TypedRecords и коды CodeTable).
+# Запуск: python bench_records_memory.py [файл.xlsx] [записей]
+
+RECORD_COUNT = 100000
+
+
+def make_rows(source_rows, count):
+    rows = []
+    for position in range(count):
+        row = list(source_rows[position % len(source_rows)])
+        copy = position // len(source_rows)
+        if copy:
+            row[0] = f"{row[0]}.{copy}"
+            row[1] = f"{row[1]}.{copy}"
+            row[3] = f"{row[3]}.{copy}"
+        rows.append(row)
+    return rows
+
+
+def measure(build):
+    """Память, занятая результатом build(), и сам результат"""
+    gc.collect()
+    tracemalloc.start()
+    result = build()
+    gc.collect()
+    size = tracemalloc.get_traced_memory()[0]
+    tracemalloc.stop()
+    return size, result
+
+
+def columns_match(columns, rows):
+    """Коды категорий столбцов раскодируются в значения строк (по category_key)"""
+    decoded = [
+        (columns.castings, columns.casting_names, [CASTING_COLUMN]),
+        (columns.experiments, columns.experiment_names, [EXPERIMENT_COLUMN]),
+        (columns.participants, columns.participant_names, PARTICIPANT_COLUMNS),
+    ]
+    for codes, names, row_columns in decoded:
+        codes = codes.reshape(len(rows), len(row_columns))
+        for row, row_codes in zip(rows, codes):
+            for column, code in zip(row_columns, row_codes):
+                if category_key(names[code]) != category_key(row[column]):
+                    return False
+    return True
+
+
+def main(argv=None):
+    argv = sys.argv[1:] if argv is None else argv
+    file_name = argv[0] if argv else EXCEL_FILENAME
+    count = int(argv[1]) if len(argv) > 1 else RECORD_COUNT
+    source_rows = [normalize_row(row) for row in
+                   plavka_xlsx.read_rows(file_name, min_row=2, width=len(HEADERS))]
+    rows = make_rows(source_rows, count)
+
+    # Уникальные столбцы у всех представлений общие - считаем только контейнеры
+    results = [
+        ("Списки строк", measure(lambda: [list(row) for row in rows])),
+        ("Словари dict(zip(...))", measure(lambda: [dict(zip(HEADERS, row)) for row in rows])),
+        ("MeltRecord (__slots__)", measure(lambda: [MeltRecord.from_row(row) for row in rows])),
+        # Столбцы ссылаются на те же строки - считаются только массивы и таблица кодов
+        ("Столбцы RecordColumns", measure(lambda: RecordColumns(rows))),
+    ]
+
+    if [record.to_row() for record in results[2][1][1]] != rows:
+        print("Строки MeltRecord не совпадают с исходными")
+        return 1
+    if not columns_match(results[3][1][1], rows):
+        print("Коды столбцов не совпадают с исходными строками")
+        return 1
+
+    print(f"Записей: {count}")
+    for name, (size, _) in results:
+        print(f"{name:<26} {size / 1024 / 1024:8.1f} МБ {size / count:8.0f} байт на запись")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,73 @@
+import io
+import sys
+import time
+from openpyxl import load_workbook
+import plavka_xlsx
+from plavka_storage import EXCEL_FILENAME, HEADERS, normalize_row
+
+# Сравнение потокового читателя plavka_xlsx с openpyxl в режиме read_only.
+# Запуск: python bench_xlsx_reader.py [файл.xlsx] [повторов]
+
+
+def read_openpyxl(data):
+    wb = load_workbook(io.BytesIO(data), read_only=True)
+    rows = [normalize_row(row) for row in wb.active.iter_rows(min_row=2, values_only=True)]
+    wb.close()
+    return rows
+
+
+def read_streaming(data):
+    return [normalize_row(row) for row in
+            plavka_xlsx.read_rows(io.BytesIO(data), min_row=2, width=len(HEADERS))]
+
+
+def read_row_openpyxl(data, row_number):
+    wb = load_workbook(io.BytesIO(data), read_only=True)
+    rows = list(wb.active.iter_rows(min_row=row_number, max_row=row_number, values_only=True))
+    wb.close()
+    return normalize_row(rows[0])
+
+
+def read_row_streaming(data, row_number):
+    return normalize_row(plavka_xlsx.read_row(io.BytesIO(data), row_number, width=len(HEADERS)))
+
+
+def measure(function, *args, repeat=3):
+    """Лучшее время из repeat запусков и результат"""
+    best = None
+    for _ in range(repeat):
+        start = time.perf_counter()
+        result = function(*args)
+        elapsed = time.perf_counter() - start
+        best = elapsed if best is None else min(best, elapsed)
+    return best, result
+
+
+def main(argv=None):
+    argv = sys.argv[1:] if argv is None else argv
+    file_name = argv[0] if argv else EXCEL_FILENAME
+    repeat = int(argv[1]) if len(argv) > 1 else 3
+    with open(file_name, 'rb') as workbook_file:
+        data = workbook_file.read()
+
+    slow, expected = measure(read_openpyxl, data, repeat=repeat)
+    fast, rows = measure(read_streaming, data, repeat=repeat)
+    if rows != expected:
+        print("Результаты читателей не совпадают")
+        return 1
+    print(f"Записей: {len(rows)}")
+    print(f"Весь лист: openpyxl {slow:.3f} с, потоковый {fast:.3f} с, ускорение {slow / fast:.1f}x")
+
+    # Строка из середины листа - как при открытии записи на редактирование
+    row_number = len(rows) // 2 + 2
+    slow, expected = measure(read_row_openpyxl, data, row_number, repeat=repeat)
+    fast, row = measure(read_row_streaming, data, row_number, repeat=repeat)
+    if row != expected:
+        print("Результаты чтения строки не совпадают")
+        return 1
+    print(f"Строка {row_number}: openpyxl {slow:.3f} с, потоковый {fast:.3f} с, ускорение {slow / fast:.1f}x")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -2,21 +2,34 @@ import sys
 import os
 import re
 import logging
-import shutil
 from PySide6.QtWidgets import (
     QApplication, QWidget, QVBoxLayout, QLineEdit,
     QPushButton, QMessageBox, QLabel, QScrollArea, QFrame,
     QDateEdit, QComboBox, QTableWidget, QTableWidgetItem,
     QHBoxLayout, QDialog, QFileDialog, QGroupBox, QGridLayout,
-    QTabWidget, QTextEdit
+    QTabWidget, QTextEdit, QTableView, QCheckBox, QAbstractItemView
+)
+from PySide6.QtCore import (
+    Qt, QDate, QTimer, QObject, QRunnable, QThreadPool, Signal,
+    QAbstractTableModel, QModelIndex
 )
-from PySide6.QtCore import Qt, QDate
 from PySide6 import QtGui
-from openpyxl import Workbook, load_workbook
 from datetime import datetime, timedelta
+import threading
 import pandas as pd
+import numpy as np
 from PySide6.QtGui import QColor
 from PySide6.QtWidgets import QGraphicsDropShadowEffect
+from plavka_storage import (HEADERS, WRITE_BATCH_SIZE, get_store, get_record_cache, get_write_coalescer,
+                            compact_storage)
+from plavka_schema import SECTORS, TIME_METRICS, SECTOR_FIELDS, parse_time, field_errors
+from plavka_records import MeltRecord
+from plavka_index import (get_plavka_number_index, get_id_index, get_row_index, get_trigram_index,
+                          get_participant_index)
+from plavka_analytics import (get_record_columns, compute_statistics, get_running_aggregates,
+                              get_result_cache, result_key, data_version, sort_key_function, mask_bitmap,
+                              sector_group_statistics, sector_spread_statistics, TEMPERATURE_METRIC)
+from plavka_query import QuerySyntaxError, PAGE_SIZE, plan_query, explain_query, is_plain_text
 
 # В начале файла добавить настройку логирования
 logging.basicConfig(
@@ -25,8 +38,10 @@ logging.basicConfig(
     format='%(asctime)s - %(levelname)s - %(message)s'
 )
 
+# Поля замеров секторов A-D в порядке тензора секторов
+SECTOR_FIELD_NAMES = [field for fields in SECTOR_FIELDS for field in fields]
+
 # Вынести настройки в отдельные константы
-EXCEL_FILENAME = 'plavka.xlsx'
 TEMPERATURE_RANGE = (500, 2000)
 TIME_FORMAT = "HH:mm"
 
@@ -41,80 +56,252 @@ EXPORT_FORMATS = {
 # Добавляем новые константы
 BACKUP_DIR = 'backups'
 MAX_BACKUPS = 5  # Максимальное количество резервных копий
+JOURNAL_COMPACT_INTERVAL = 5 * 60 * 1000  # Период сжатия журнала, мс
+SEARCH_DEBOUNCE_INTERVAL = 250  # Пауза после ввода перед поиском, мс
+
+def field_text(value):
+    """Текст ячейки для поля формы; пустая ячейка - пустая строка"""
+    return str(value) if value is not None else ""
+
+def set_combo_text(combo, value):
+    """Выбирает значение ячейки в списке; значение не из списка добавляется, пустое - снимает выбор"""
+    text = field_text(value)
+    if text and combo.findText(text) < 0:
+        combo.addItem(text)
+    combo.setCurrentIndex(combo.findText(text) if text else -1)
+
+def input_value(text):
+    """Значение поля формы; пустая маска времени ':' и одни пробелы - пустая строка"""
+    return "" if text.strip() in ("", ":") else text
+
+class SaveSignals(QObject):
+    # ID записи, признак успеха, текст ошибки
+    finished = Signal(str, bool, str)
+
+class SaveWorker(QRunnable):
+    """Ожидание фонового сохранения записи плавки"""
+    def __init__(self, record_id, future):
+        super().__init__()
+        self.record_id = record_id
+        self.future = future
+        self.signals = SaveSignals()
 
-# Функция для сохранения данных в Excel
-def save_to_excel(ID, Учетный_номер, Плавка_дата, Номер_плавки, Номер_кластера,
-                  Старший_смены_плавки, Первый_участник_смены_плавки,
-                  Второй_участник_смены_плавки, Третий_участник_смены_плавки,
-                  Четвертый_участник_смены_плавки, Наименование_отливки,
-                  Тип_эксперемента, Сектор_A_опоки, Сектор_B_опоки,
-                  Сектор_C_опоки, Сектор_D_опоки, 
-                  Плавка_время_прогрева_ковша_A, Плавка_время_перемещения_A, Плавка_время_заливки_A, Плавка_температура_заливки_A,
-                  Плавка_время_прогрева_ковша_B, Плавка_время_перемещения_B, Плавка_время_заливки_B, Плавка_температура_заливки_B,
-                  Плавка_время_прогрева_ковша_C, Плавка_время_перемещения_C, Плавка_время_заливки_C, Плавка_температура_заливки_C,
-                  Плавка_время_прогрева_ковша_D, Плавка_время_перемещения_D, Плавка_время_заливки_D, Плавка_температура_заливки_D,
-                  Комментарий
-                  ):
-    file_name = 'plavka.xlsx'
-
-    if not os.path.exists(file_name):
-        workbook = Workbook()
-        sheet = workbook.active
-        sheet.title = "Records"
-        headers = ["ID", "Учетный_номер", "Плавка_дата", "Номер_плавки", "Номер_кластера",
-                  "Старший_смены_плавки", "Первый_участник_смены_плавки",
-                  "Второй_участник_смены_плавки", "Третий_участник_смены_плавки",
-                  "Четвертый_участник_смены_плавки", "Наименование_отливки",
-                  "Тип_эксперемента", "Сектор_A_опоки", "Сектор_B_опоки",
-                  "Сектор_C_опоки", "Сектор_D_опоки",
-                  "Плавка_время_прогрева_ковша_A", "Плавка_время_перемещения_A", "Плавка_время_заливки_A", "Плавка_температура_заливки_A",
-                  "Плавка_время_прогрева_ковша_B", "Плавка_время_перемещения_B", "Плавка_время_заливки_B", "Плавка_температура_заливки_B",
-                  "Плавка_время_прогрева_ковша_C", "Плавка_время_перемещения_C", "Плавка_время_заливки_C", "Плавка_температура_заливки_C",
-                  "Плавка_время_прогрева_ковша_D", "Плавка_время_перемещения_D", "Плавка_время_заливки_D", "Плавка_температура_заливки_D",
-                  "Комментарий"]
-        sheet.append(headers)
-    else:
-        workbook = load_workbook(file_name)
-        sheet = workbook.active
-
-    # Создаем список данных в том же порядке, что и заголовки
-    data = [
-        ID, Учетный_номер, Плавка_дата, Номер_плавки, Номер_кластера,
-        Старший_смены_плавки, Первый_участник_смены_плавки,
-        Второй_участник_смены_плавки, Третий_участник_смены_плавки,
-        Четвертый_участник_смены_плавки, Наименование_отливки,
-        Тип_эксперемента, Сектор_A_опоки, Сектор_B_опоки,
-        Сектор_C_опоки, Сектор_D_опоки,
-        Плавка_время_прогрева_ковша_A, Плавка_время_перемещения_A, Плавка_время_заливки_A, Плавка_температура_заливки_A,
-        Плавка_время_прогрева_ковша_B, Плавка_время_перемещения_B, Плавка_время_заливки_B, Плавка_температура_заливки_B,
-        Плавка_время_прогрева_ковша_C, Плавка_время_перемещения_C, Плавка_время_заливки_C, Плавка_температура_заливки_C,
-        Плавка_время_прогрева_ковша_D, Плавка_время_перемещения_D, Плавка_время_заливки_D, Плавка_температура_заливки_D,
-        Комментарий
-    ]
-
-    # Добавляем данные в таблицу
-    sheet.append(data)
-
-    # Автоматически регулируем ширину столбцов
-    for column in sheet.columns:
-        max_length = 0
-        column_letter = column[0].column_letter
-        for cell in column:
-            try:
-                if len(str(cell.value)) > max_length:
-                    max_length = len(str(cell.value))
-            except:
-                pass
-        adjusted_width = (max_length + 2)
-        sheet.column_dimensions[column_letter].width = adjusted_width
-
-    # Сохраняем файл
-    try:
-        workbook.save(file_name)
-        return True
-    except Exception as e:
-        logging.error(f"Ошибка при сохранении в Excel: {str(e)}")
-        return False
+    def run(self):
+        try:
+            if self.future.result():
+                self.signals.finished.emit(self.record_id, True, "")
+            else:
+                self.signals.finished.emit(self.record_id, False, "Не удалось сохранить данные")
+        except Exception as e:
+            logging.error(f"Ошибка при фоновом сохранении {self.record_id}: {str(e)}")
+            self.signals.finished.emit(self.record_id, False, str(e))
+
+class BackupSignals(QObject):
+    # Файл резервной копии и текст ошибки (пустой при успехе)
+    finished = Signal(str, str)
+
+class BackupWorker(QRunnable):
+    """Выгрузка резервной копии и удаление старых копий в фоне"""
+    def __init__(self, backup_file):
+        super().__init__()
+        self.backup_file = backup_file
+        self.signals = BackupSignals()
+
+    def run(self):
+        try:
+            # Выгружаем записи из хранилища вместе с журналом в файл резервной копии
+            get_store().export_excel(self.backup_file)
+
+            # Удаляем старые резервные копии если их больше MAX_BACKUPS
+            backups = sorted([os.path.join(BACKUP_DIR, f) for f in os.listdir(BACKUP_DIR)])
+            while len(backups) > MAX_BACKUPS:
+                os.remove(backups[0])
+                backups.pop(0)
+            self.signals.finished.emit(self.backup_file, "")
+        except Exception as e:
+            logging.error(f"Ошибка при создании резервной копии: {str(e)}")
+            self.signals.finished.emit(self.backup_file, str(e))
+
+class SearchSignals(QObject):
+    # Номер запроса и оценка числа совпадений по плану
+    planned = Signal(int, int)
+    # Номер запроса и очередная порция найденных строк
+    page = Signal(int, object)
+    # Номер запроса и итог: текст, фильтры, столбцы и позиции найденных записей
+    finished = Signal(int, object)
+    # Номер запроса, текст ошибки и признак ошибки в самом запросе
+    failed = Signal(int, str, bool)
+
+class SearchWorker(QRunnable):
+    """Поиск в фоне: план запроса, проверка текста и выдача найденных строк.
+
+    Строки уходят в таблицу порциями: первая - PAGE_SIZE записей, каждая
+    следующая вдвое больше, поэтому первые совпадения видны сразу, а
+    таблица обновляется лишь несколько раз. Новый запрос отменяет
+    текущий через событие cancelled.
+    """
+    def __init__(self, generation, text, filters, previous=None):
+        super().__init__()
+        self.generation = generation
+        self.text = text
+        self.filters = filters
+        # Итог предыдущего поиска для сужения результатов
+        self.previous = previous
+        self.cancelled = threading.Event()
+        self.signals = SearchSignals()
+
+    def plan(self, columns):
+        """Курсор по запросу: из кэша результатов, по предыдущим результатам или заново"""
+        index = get_trigram_index()
+        crew_index = get_participant_index()
+        key = result_key('search', self.text, self.filters, columns.version)
+        cached = get_result_cache().get(key)
+        previous = self.previous
+        if cached is not None:
+            # Тот же запрос по тем же данным - результаты из кэша
+            return key, plan_query(self.text, columns, index, self.filters, base=cached,
+                                   participant_index=crew_index).cursor(verified=True)
+        if previous is not None and previous['text'] in self.text and \
+           is_plain_text(previous['text']) and is_plain_text(self.text) and \
+           previous['filters'] == self.filters and previous['columns'] is columns:
+            # Текст дополняет предыдущий - проверяем только его результаты
+            return key, plan_query(self.text, columns, index, self.filters, base=previous['matched'],
+                                   participant_index=crew_index).cursor()
+        return key, plan_query(self.text, columns, index, self.filters,
+                               participant_index=crew_index).cursor()
+
+    def run(self):
+        try:
+            columns = get_record_columns()
+            key, cursor = self.plan(columns)
+            if self.cancelled.is_set():
+                return
+            self.signals.planned.emit(self.generation, cursor.estimate())
+
+            limit = PAGE_SIZE
+            while not cursor.exhausted:
+                page = cursor.fetch(limit, self.cancelled)
+                if self.cancelled.is_set():
+                    return
+                if page:
+                    self.signals.page.emit(self.generation, [columns.rows[position] for position in page])
+                limit *= 2
+
+            get_result_cache().put(key, cursor.matched)
+            self.signals.finished.emit(self.generation, {
+                'text': self.text, 'filters': self.filters,
+                'columns': columns, 'matched': cursor.matched})
+        except QuerySyntaxError as e:
+            self.signals.failed.emit(self.generation, str(e), True)
+        except Exception as e:
+            logging.error(f"Ошибка при поиске: {str(e)}")
+            self.signals.failed.emit(self.generation, str(e), False)
+
+class SearchResultsModel(QAbstractTableModel):
+    """Найденные записи для QTableView без копирования в элементы таблицы.
+
+    Модель хранит ссылки на строки кэша и порядок их показа; текст ячейки
+    создается только при отрисовке видимых строк.
+    """
+    def __init__(self, parent=None):
+        super().__init__(parent)
+        self.rows = []
+        self.order = []
+        self.columns = [HEADERS.index(field) for field in SEARCH_FIELDS]
+        self.sort_column = None
+        self.sort_order = Qt.AscendingOrder
+        # Столбец листа -> ключи сортировки по строкам self.rows
+        self.sort_keys = {}
+
+    def rowCount(self, parent=QModelIndex()):
+        return 0 if parent.isValid() else len(self.order)
+
+    def columnCount(self, parent=QModelIndex()):
+        return 0 if parent.isValid() else len(self.columns)
+
+    def data(self, index, role=Qt.DisplayRole):
+        if role != Qt.DisplayRole or not index.isValid():
+            return None
+        value = self.rows[self.order[index.row()]][self.columns[index.column()]]
+        return str(value) if value is not None else ""
+
+    def headerData(self, section, orientation, role=Qt.DisplayRole):
+        if role != Qt.DisplayRole:
+            return None
+        if orientation == Qt.Horizontal:
+            return HEADERS[self.columns[section]]
+        return str(section + 1)
+
+    def clear(self):
+        self.beginResetModel()
+        self.rows = []
+        self.order = []
+        self.sort_keys = {}
+        self.endResetModel()
+
+    def append_rows(self, rows):
+        """Добавляет очередную порцию найденных записей в конец списка"""
+        if not rows:
+            return
+        start = len(self.rows)
+        self.beginInsertRows(QModelIndex(), start, start + len(rows) - 1)
+        self.rows.extend(rows)
+        self.order.extend(range(start, start + len(rows)))
+        self.endInsertRows()
+
+    def set_all_columns(self, enabled):
+        """Показывает все столбцы листа или только SEARCH_FIELDS"""
+        self.beginResetModel()
+        fields = HEADERS if enabled else SEARCH_FIELDS
+        self.columns = [HEADERS.index(field) for field in fields]
+        self.sort_column = None
+        self.order = list(range(len(self.rows)))
+        self.endResetModel()
+
+    def sort(self, column, order=Qt.AscendingOrder):
+        if column < 0 or column >= len(self.columns):
+            # Сортировка снята - исходный порядок курсора
+            self.layoutAboutToBeChanged.emit()
+            self.order = list(range(len(self.rows)))
+            self.sort_column = None
+            self.layoutChanged.emit()
+            return
+        # Строки приходят из потока поиска; порции, пришедшие позже, досортировывает resort
+        self.layoutAboutToBeChanged.emit()
+        self.order = self.ordered(range(len(self.rows)), self.columns[column], order)
+        self.sort_column = column
+        self.sort_order = order
+        self.layoutChanged.emit()
+
+    def resort(self):
+        """Повторяет последнюю сортировку после добавления порции записей"""
+        if self.sort_column is None:
+            return
+        # Текущий порядок уже отсортирован, кроме новой порции в конце:
+        # сортировка сливает их, а не упорядочивает все строки заново
+        self.layoutAboutToBeChanged.emit()
+        self.order = self.ordered(self.order, self.columns[self.sort_column], self.sort_order)
+        self.layoutChanged.emit()
+
+    def ordered(self, rows, sheet_column, order):
+        """Строки модели в порядке значений столбца листа"""
+        keys = self.sort_keys.setdefault(sheet_column, [])
+        if len(keys) < len(self.rows):
+            # Ключи считаются один раз для каждой строки, в том числе новых порций
+            key = sort_key_function(sheet_column)
+            keys.extend(key(row[sheet_column]) for row in self.rows[len(keys):])
+        # Пустые значения остаются последними при любом направлении сортировки
+        filled = [row for row in rows if keys[row][0] == 0]
+        empty = [row for row in rows if keys[row][0] != 0]
+        return sorted(filled, key=keys.__getitem__, reverse=order == Qt.DescendingOrder) + empty
+
+    def row_values(self, row):
+        """Значения видимых столбцов строки модели"""
+        record = self.rows[self.order[row]]
+        return [record[column] for column in self.columns]
+
+    def record_id(self, row):
+        return self.rows[self.order[row]][0]
 
 # Основное окно приложения
 class MainWindow(QWidget):
@@ -385,6 +572,7 @@ class MainWindow(QWidget):
         buttons_layout = QHBoxLayout()
         buttons_layout.addWidget(self.save_button)
         buttons_layout.addWidget(self.search_button)
+        buttons_layout.addWidget(self.save_status)
         
         # Добавляем группы в колонки
         left_column.addWidget(basic_info_group)
@@ -409,6 +597,25 @@ class MainWindow(QWidget):
         
         # Устанавливаем размер окна
         self.setMinimumSize(1600, 850)
+        
+        # Потоки ожидания фонового сохранения; порядок записей задает очередь групповой записи
+        self.save_pool = QThreadPool(self)
+        self.save_pool.setMaxThreadCount(WRITE_BATCH_SIZE)
+        
+        # Периодически переносим журнал записей в plavka.xlsx и записываем снимки индексов
+        self.compact_timer = QTimer(self)
+        self.compact_timer.timeout.connect(self.compact_journal)
+        self.compact_timer.start(JOURNAL_COMPACT_INTERVAL)
+
+    def compact_journal(self):
+        """Запускает сжатие журнала записей в фоновом потоке"""
+        threading.Thread(target=compact_storage, daemon=True).start()
+
+    def closeEvent(self, event):
+        # Дописываем очередь групповой записи и дожидаемся итогов сохранения перед выходом
+        get_write_coalescer().flush()
+        self.save_pool.waitForDone()
+        super().closeEvent(event)
 
     def create_widgets(self):
         """Создание всех виджетов формы"""
@@ -526,6 +733,10 @@ class MainWindow(QWidget):
         self.search_button = QPushButton("Поиск", self)
         self.search_button.clicked.connect(self.show_search_dialog)
         
+        # Индикатор фонового сохранения
+        self.pending_saves = {}  # ID -> (год, месяц, номер) для плавок в очереди
+        self.save_status = QLabel("", self)
+        
         # Добавляем обработчик изменения даты
         self.Плавка_дата.dateChanged.connect(self.generate_plavka_number)
         
@@ -535,35 +746,15 @@ class MainWindow(QWidget):
     def generate_plavka_number(self):
         try:
             current_month = self.Плавка_дата.date().month()
+            current_year = self.Плавка_дата.date().year()
             
-            if os.path.exists('plavka.xlsx'):
-                df = pd.read_excel('plavka.xlsx')
-                if not df.empty:
-                    # Конвертируем даты в datetime
-                    df['Плавка_дата'] = pd.to_datetime(df['Плавка_дата'], format='%d.%m.%Y')
-                    
-                    # Фильтруем записи только текущего месяца и года
-                    current_year = self.Плавка_дата.date().year()
-                    current_month_records = df[
-                        (df['Плавка_дата'].dt.month == current_month) & 
-                        (df['Плавка_дата'].dt.year == current_year)
-                    ]
-                    
-                    if not current_month_records.empty:
-                        # Ищем последний номер для текущего месяца
-                        last_numbers = []
-                        for num in current_month_records['Номер_плавки']:
-                            try:
-                                if isinstance(num, str) and '-' in num:
-                                    month, number = num.split('-')
-                                    if month == str(current_month):
-                                        last_numbers.append(int(number))
-                            except (ValueError, TypeError):
-                                continue
-                        
-                        next_number = max(last_numbers) + 1 if last_numbers else 1
-            else:
-                next_number = 1
+            # Следующий номер берем из индекса счетчиков по месяцам
+            next_number = get_plavka_number_index().next_number(current_year, current_month)
+            
+            # Учитываем плавки, которые еще сохраняются в фоне
+            for year, month, number in self.pending_saves.values():
+                if (year, month) == (current_year, current_month):
+                    next_number = max(next_number, number + 1)
             
             # Форматируем номер плавки: месяц-номер(с ведущими нулями)
             new_plavka_number = f"{current_month}-{str(next_number).zfill(3)}"
@@ -622,33 +813,14 @@ class MainWindow(QWidget):
     def validate_time(self, time_str):
         """Проверка корректности ввода времени в формате ЧЧ:ММ"""
         try:
-            hours, minutes = map(int, time_str.split(':'))
-            if 0 <= hours < 24 and 0 <= minutes < 60:
-                return True
+            return parse_time(time_str) is not None
         except ValueError:
             return False
-        return False
 
     def check_duplicate_id(self, id_number):
-        """Проверка существования ID в plavka.xlsx"""
+        """Проверка существования ID по индексу записей"""
         try:
-            if not os.path.exists('plavka.xlsx'):
-                return False
-            
-            wb = load_workbook('plavka.xlsx', read_only=True)
-            ws = wb.active
-            
-            # Преобразуем проверяемый ID в строку для сравнения
-            id_to_check = str(id_number).strip()
-            
-            # Проверяем первый столбец (ID)
-            for row in ws.iter_rows(min_row=2, values_only=True):
-                if row[0] and str(row[0]).strip() == id_to_check:
-                    wb.close()
-                    return True
-            
-            wb.close()
-            return False
+            return get_id_index().contains(id_number)
         except Exception as e:
             logging.error(f"Ошибка при проверке дубликата ID: {str(e)}")
             return False
@@ -694,7 +866,7 @@ class MainWindow(QWidget):
                 return
             
             # Проверяем на дубликат
-            if self.check_duplicate_id(id_number):
+            if id_number in self.pending_saves or self.check_duplicate_id(id_number):
                 QMessageBox.warning(self, "Ошибка", 
                     f"Плавка с ID {id_number} уже существует в базе данных!")
                 return
@@ -721,62 +893,77 @@ class MainWindow(QWidget):
             Сектор_C_опоки = self.Сектор_C_опоки.text()
             Сектор_D_опоки = self.Сектор_D_опоки.text()
 
-            Плавка_время_прогрева_ковша_A = self.Плавка_время_прогрева_ковша_A.text()
-            Плавка_время_перемещения_A = self.Плавка_время_перемещения_A.text()
-            Плавка_время_заливки_A = self.Плавка_время_заливки_A.text()
-
-            Плавка_время_прогрева_ковша_B = self.Плавка_время_прогрева_ковша_B.text()
-            Плавка_время_перемещения_B = self.Плавка_время_перемещения_B.text()
-            Плавка_время_заливки_B = self.Плавка_время_заливки_B.text()
-
-            Плавка_время_прогрева_ковша_C = self.Плавка_время_прогрева_ковша_C.text()
-            Плавка_время_перемещения_C = self.Плавка_время_перемещения_C.text()
-            Плавка_время_заливки_C = self.Плавка_время_заливки_C.text()
-
-            Плавка_время_прогрева_ковша_D = self.Плавка_время_прогрева_ковша_D.text()
-            Плавка_время_перемещения_D = self.Плавка_время_перемещения_D.text()
-            Плавка_время_заливки_D = self.Плавка_время_заливки_D.text()
-
-            Плавка_температура_заливки_A = self.Плавка_температура_заливки_A.text()
-            Плавка_температура_заливки_B = self.Плавка_температура_заливки_B.text()
-            Плавка_температура_заливки_C = self.Плавка_температура_заливки_C.text()
-            Плавка_температура_заливки_D = self.Плавка_температура_заливки_D.text()
+            # Замеры секторов A-D: три времени и температура заливки в каждом
+            sector_values = {field: getattr(self, field).text() for field in SECTOR_FIELD_NAMES}
 
             # Валидация времени
-            if not (self.validate_time(Плавка_время_заливки_A) and self.validate_time(Плавка_время_прогрева_ковша_A) and self.validate_time(Плавка_время_перемещения_A) and
-                    self.validate_time(Плавка_время_заливки_B) and self.validate_time(Плавка_время_прогрева_ковша_B) and self.validate_time(Плавка_время_перемещения_B) and
-                    self.validate_time(Плавка_время_заливки_C) and self.validate_time(Плавка_время_прогрева_ковша_C) and self.validate_time(Плавка_время_перемещения_C) and
-                    self.validate_time(Плавка_время_заливки_D) and self.validate_time(Плавка_время_прогрева_ковша_D) and self.validate_time(Плавка_время_перемещения_D)):
+            if not all(self.validate_time(sector_values[field])
+                       for fields in SECTOR_FIELDS for field in fields[:len(TIME_METRICS)]):
                 QMessageBox.warning(self, "Ошибка", "Некорректный ввод времени. Используйте формат ЧЧ:ММ.")
                 return
 
-            Комментарий = self.Комментарий.toPlainText()
+            # Температура может быть пустой, но не произвольным текстом
+            if field_errors(sector_values):
+                QMessageBox.warning(self, "Ошибка", "Температура должна быть числом")
+                return
 
-            save_to_excel(id_number, Учетный_номер, formatted_date, Номер_плавки, Номер_кластера,
-                           Старший_смены_плавки, Первый_участник_смены_плавки,
-                           Второй_участник_смены_плавки, Третий_участник_смены_плавки,
-                           Четвертый_участник_смены_плавки, Наименование_отливки,
-                           Тип_эксперемента, Сектор_A_опоки, Сектор_B_опоки,
-                           Сектор_C_опоки, Сектор_D_опоки, 
-                           Плавка_время_прогрева_ковша_A, Плавка_время_перемещения_A, Плавка_время_заливки_A, Плавка_температура_заливки_A,
-                           Плавка_время_прогрева_ковша_B, Плавка_время_перемещения_B, Плавка_время_заливки_B, Плавка_температура_заливки_B,
-                           Плавка_время_прогрева_ковша_C, Плавка_время_перемещения_C, Плавка_время_заливки_C, Плавка_температура_заливки_C,
-                           Плавка_время_прогрева_ковша_D, Плавка_время_перемещения_D, Плавка_время_заливки_D, Плавка_температура_заливки_D,
-                           Комментарий)
+            Комментарий = self.Комментарий.toPlainText()
 
-            QMessageBox.information(self, "Успех", "Данные сохранены в Excel!")
+            data = MeltRecord(
+                ID=id_number, Учетный_номер=Учетный_номер, Плавка_дата=formatted_date,
+                Номер_плавки=Номер_плавки, Номер_кластера=Номер_кластера,
+                Старший_смены_плавки=Старший_смены_плавки,
+                Первый_участник_смены_плавки=Первый_участник_смены_плавки,
+                Второй_участник_смены_плавки=Второй_участник_смены_плавки,
+                Третий_участник_смены_плавки=Третий_участник_смены_плавки,
+                Четвертый_участник_смены_плавки=Четвертый_участник_смены_плавки,
+                Наименование_отливки=Наименование_отливки, Тип_эксперемента=Тип_эксперемента,
+                Сектор_A_опоки=Сектор_A_опоки, Сектор_B_опоки=Сектор_B_опоки,
+                Сектор_C_опоки=Сектор_C_опоки, Сектор_D_опоки=Сектор_D_опоки,
+                Комментарий=Комментарий, **sector_values)
+
+            # Запись сохраняется в фоне, форма сразу готова к следующей плавке
+            number = int(re.search(r'-(\d+)', Номер_плавки).group(1))
+            self.pending_saves[id_number] = (Плавка_дата.year(), Плавка_дата.month(), number)
+            future = get_write_coalescer().submit_insert(data.to_row())
+            worker = SaveWorker(id_number, future)
+            worker.signals.finished.connect(self.on_save_finished)
+            self.save_pool.start(worker)
+            self.update_save_status()
 
             # Очистка полей ввода
             self.clear_fields()
-            logging.info("Данные успешно сохранены")
             
-            # После успешного сохранения генерируем новый номер
+            # Генерируем номер следующей плавки с учетом очереди
             self.generate_plavka_number()
             
         except Exception as e:
             logging.error(f"Ошибка при сохранении данных: {str(e)}")
             QMessageBox.critical(self, "Ошибка", str(e))
 
+    def on_save_finished(self, record_id, success, error):
+        """Результат фонового сохранения плавки"""
+        self.pending_saves.pop(record_id, None)
+        if success:
+            logging.info(f"Данные плавки {record_id} успешно сохранены")
+        else:
+            logging.error(f"Ошибка при сохранении плавки {record_id}: {error}")
+        self.update_save_status(record_id if not success else None)
+        if not success:
+            QMessageBox.critical(self, "Ошибка",
+                f"Плавка {record_id} не сохранена: {error}")
+            # Номер неудавшейся плавки освободился - пересчитываем
+            self.generate_plavka_number()
+
+    def update_save_status(self, failed_id=None):
+        """Обновляет индикатор очереди сохранения"""
+        if failed_id:
+            self.save_status.setText(f"Ошибка сохранения {failed_id}")
+        elif self.pending_saves:
+            self.save_status.setText(f"Сохраняется записей: {len(self.pending_saves)}")
+        else:
+            self.save_status.setText("Все записи сохранены")
+
     def clear_fields(self):
         self.Плавка_дата.setDate(QDate.currentDate().addDays(-1))
         self.Номер_плавки.clear()
@@ -792,22 +979,8 @@ class MainWindow(QWidget):
         self.Сектор_B_опоки.clear()
         self.Сектор_C_опоки.clear()
         self.Сектор_D_опоки.clear()
-        self.Плавка_время_прогрева_ковша_A.clear()
-        self.Плавка_время_перемещения_A.clear()
-        self.Плавка_время_заливки_A.clear()
-        self.Плавка_температура_заливки_A.clear()
-        self.Плавка_время_прогрева_ковша_B.clear()
-        self.Плавка_время_перемещения_B.clear()
-        self.Плавка_время_заливки_B.clear()
-        self.Плавка_температура_заливки_B.clear()
-        self.Плавка_время_прогрева_ковша_C.clear()
-        self.Плавка_время_перемещения_C.clear()
-        self.Плавка_время_заливки_C.clear()
-        self.Плавка_температура_заливки_C.clear()
-        self.Плавка_время_прогрева_ковша_D.clear()
-        self.Плавка_время_перемещения_D.clear()
-        self.Плавка_время_заливки_D.clear()
-        self.Плавка_температура_заливки_D.clear()
+        for field in SECTOR_FIELD_NAMES:
+            getattr(self, field).clear()
         self.Комментарий.clear()
 
     def show_search_dialog(self):
@@ -840,9 +1013,13 @@ class StatisticsWidget(QWidget):
         time_button = QPushButton("Временной анализ")
         time_button.clicked.connect(lambda: self.show_data('time'))
         
+        sectors_button = QPushButton("Сравнение секторов")
+        sectors_button.clicked.connect(lambda: self.show_data('sectors'))
+        
         buttons_layout.addWidget(temp_button)
         buttons_layout.addWidget(casting_button)
         buttons_layout.addWidget(time_button)
+        buttons_layout.addWidget(sectors_button)
         
         layout.addLayout(buttons_layout)
     
@@ -850,63 +1027,78 @@ class StatisticsWidget(QWidget):
         self.data_table.setRowCount(0)
         
         try:
-            wb = load_workbook(EXCEL_FILENAME, read_only=True)
-            ws = wb.active
-            headers = [cell.value for cell in ws[1]]
+            if data_type == 'sectors':
+                self._show_sectors(get_record_columns())
+                return
+            
+            cube = get_running_aggregates()
             
             if data_type == 'temperature':
-                self._show_temperature(ws, headers)
+                self._show_temperature(cube)
             elif data_type == 'castings':
-                self._show_castings(ws, headers)
+                self._show_castings(cube)
             elif data_type == 'time':
-                self._show_time_analysis(ws, headers)
-                
-            wb.close()
+                self._show_time_analysis(cube)
             
         except Exception as e:
             logging.error(f"Ошибка при отображении данных: {str(e)}")
             QMessageBox.critical(self, "Ошибка", f"Ошибка при отображении данных: {str(e)}")
     
-    def _show_temperature(self, ws, headers):
-        self.data_table.setHorizontalHeaderLabels(["Дата", "Температура"])
-        
-        for row in ws.iter_rows(min_row=2, values_only=True):
-            data = dict(zip(headers, row))
-            try:
-                temp_A = float(data['Плавка_температура_заливки_A'])
-                temp_B = float(data['Плавка_температура_заливки_B'])
-                temp_C = float(data['Плавка_температура_заливки_C'])
-                temp_D = float(data['Плавка_температура_заливки_D'])
-                date = data['Плавка_дата']
-                
-                row_position = self.data_table.rowCount()
-                self.data_table.insertRow(row_position)
-                
-                self.data_table.setItem(row_position, 0, QTableWidgetItem(date))
-                self.data_table.setItem(row_position, 1, QTableWidgetItem(f"{temp_A}°C"))
-                
-                row_position = self.data_table.rowCount()
-                self.data_table.insertRow(row_position)
-                
-                self.data_table.setItem(row_position, 0, QTableWidgetItem(date))
-                self.data_table.setItem(row_position, 1, QTableWidgetItem(f"{temp_B}°C"))
-                
-                row_position = self.data_table.rowCount()
-                self.data_table.insertRow(row_position)
-                
-                self.data_table.setItem(row_position, 0, QTableWidgetItem(date))
-                self.data_table.setItem(row_position, 1, QTableWidgetItem(f"{temp_C}°C"))
-                
-                row_position = self.data_table.rowCount()
-                self.data_table.insertRow(row_position)
-                
-                self.data_table.setItem(row_position, 0, QTableWidgetItem(date))
-                self.data_table.setItem(row_position, 1, QTableWidgetItem(f"{temp_D}°C"))
-                
-            except (ValueError, TypeError):
-                continue
-        
+    def _fill_table(self, labels, rows):
+        self.data_table.setColumnCount(len(labels))
+        self.data_table.setHorizontalHeaderLabels(labels)
+        self.data_table.setRowCount(len(rows))
+        for row_position, values in enumerate(rows):
+            for col, value in enumerate(values):
+                self.data_table.setItem(row_position, col, QTableWidgetItem(str(value)))
         self.data_table.resizeColumnsToContents()
+    
+    @staticmethod
+    def _temperature_cells(summary):
+        return [summary['count'], f"{summary['mean']:.1f}°C",
+                f"{summary['min']:.0f}°C", f"{summary['max']:.0f}°C"]
+    
+    def _show_temperature(self, cube):
+        # Средняя температура заливки по месяцам и секторам
+        rows = [[month or "Без даты", sector] + self._temperature_cells(summary)
+                for (month, sector), summary in sorted(cube.rollup(('month', 'sector')).items())]
+        self._fill_table(["Месяц", "Сектор", "Замеров", "Средняя", "Мин.", "Макс."], rows)
+    
+    def _show_castings(self, cube):
+        # Температура по отливкам, типам эксперимента и секторам
+        rows = [[casting, experiment, sector] + self._temperature_cells(summary)
+                for (casting, experiment, sector), summary
+                in sorted(cube.rollup(('casting', 'experiment', 'sector')).items())]
+        self._fill_table(["Отливка", "Тип эксперимента", "Сектор",
+                          "Замеров", "Средняя", "Мин.", "Макс."], rows)
+    
+    def _show_time_analysis(self, cube):
+        # Число плавок и средняя температура по месяцам
+        temperatures = cube.rollup(('month',))
+        rows = []
+        for (month,), records in sorted(cube.record_counts(('month',)).items()):
+            summary = temperatures.get((month,))
+            rows.append([month or "Без даты", records] +
+                        (self._temperature_cells(summary) if summary else ["0", "", "", ""]))
+        self._fill_table(["Месяц", "Плавок", "Замеров", "Средняя", "Мин.", "Макс."], rows)
+    
+    def _show_sectors(self, columns):
+        # Температура заливки по отливкам и секторам: среднее ± ст. откл. и разброс между секторами
+        names, counts, means, variances = sector_group_statistics(columns)
+        _, spread_counts, spread_means, spread_max = sector_spread_statistics(columns)
+        counts, means = counts[:, :, TEMPERATURE_METRIC], means[:, :, TEMPERATURE_METRIC]
+        deviations = np.sqrt(variances[:, :, TEMPERATURE_METRIC])
+        rows = []
+        for code in sorted(range(len(names)), key=lambda code: names[code]):
+            if not counts[code].any():
+                continue
+            cells = [f"{means[code, sector]:.1f} ± {deviations[code, sector]:.1f}°C ({counts[code, sector]})"
+                     if counts[code, sector] else "" for sector in range(len(SECTORS))]
+            spread = ([spread_counts[code], f"{spread_means[code]:.1f}°C", f"{spread_max[code]:.0f}°C"]
+                      if spread_counts[code] else [0, "", ""])
+            rows.append([names[code] or "Без отливки"] + cells + spread)
+        self._fill_table(["Отливка"] + [f"Сектор {sector}" for sector in SECTORS] +
+                         ["Плавок с 2+ секторами", "Средний разброс", "Макс. разброс"], rows)
 
 class SearchDialog(QDialog):
     def __init__(self, parent=None):
@@ -971,12 +1163,26 @@ class SearchDialog(QDialog):
         
         # Существующие виджеты поиска
         self.search_input = QLineEdit()
-        self.search_input.setPlaceholderText("Введите текст для поиска...")
+        self.search_input.setPlaceholderText(
+            "Введите текст или запрос, например: отливка:Ригель дата:2025-01..2025-02 темп.A>1550")
         search_layout.addWidget(self.search_input)
         
-        self.results_table = QTableWidget()
-        self.results_table.setColumnCount(len(SEARCH_FIELDS))
-        self.results_table.setHorizontalHeaderLabels(SEARCH_FIELDS)
+        results_header = QHBoxLayout()
+        self.results_count = QLabel("")
+        self.all_columns_check = QCheckBox("Все столбцы")
+        results_header.addWidget(self.results_count)
+        results_header.addStretch()
+        results_header.addWidget(self.all_columns_check)
+        search_layout.addLayout(results_header)
+        
+        self.results_model = SearchResultsModel(self)
+        self.results_table = QTableView()
+        self.results_table.setModel(self.results_model)
+        self.results_table.setSelectionBehavior(QAbstractItemView.SelectRows)
+        # Без сортировки по столбцу записи идут в порядке дат
+        self.results_table.horizontalHeader().setSortIndicator(-1, Qt.AscendingOrder)
+        self.results_table.setSortingEnabled(True)
+        self.all_columns_check.toggled.connect(self.results_model.set_all_columns)
         search_layout.addWidget(self.results_table)
         
         self.tab_widget.addTab(search_tab, "Результаты поиска")
@@ -1000,12 +1206,14 @@ class SearchDialog(QDialog):
         # Кнопки
         button_layout = QHBoxLayout()
         self.search_button = QPushButton("Поиск")
+        self.explain_button = QPushButton("План запроса")
         self.edit_button = QPushButton("Редактировать")
         self.export_button = QPushButton("Экспорт")
         self.stats_button = QPushButton("Обновить статистику")
         self.backup_button = QPushButton("Создать резервную копию")
         
         button_layout.addWidget(self.search_button)
+        button_layout.addWidget(self.explain_button)
         button_layout.addWidget(self.edit_button)
         button_layout.addWidget(self.export_button)
         button_layout.addWidget(self.stats_button)
@@ -1014,161 +1222,194 @@ class SearchDialog(QDialog):
         
         # Подключаем обработчики
         self.search_button.clicked.connect(self.search_records)
+        self.explain_button.clicked.connect(self.explain_search)
         self.edit_button.clicked.connect(self.edit_selected)
+        
+        # Поиск по мере ввода: запрос запускается после паузы в наборе
+        self.search_pool = QThreadPool(self)
+        self.search_worker = None
+        self.search_generation = 0
+        self.last_search = None
+        self.search_timer = QTimer(self)
+        self.search_timer.setSingleShot(True)
+        self.search_timer.setInterval(SEARCH_DEBOUNCE_INTERVAL)
+        self.search_timer.timeout.connect(self.search_records)
+        self.search_input.textChanged.connect(self.search_timer.start)
         self.export_button.clicked.connect(self.export_results)
         self.stats_button.clicked.connect(self.update_statistics)
         self.backup_button.clicked.connect(self.create_backup)
-
-    def apply_filters(self, row, headers):
-        """Применяет фильтры к записи"""
-        try:
-            data = dict(zip(headers, row))
-            
-            # Фильтр по дате
-            record_date = QDate.fromString(data['Плавка_дата'], "dd.MM.yyyy")
-            if not (self.date_from.date() <= record_date <= self.date_to.date()):
-                return False
-            
-            # Фильтр по типу отливки
-            if self.filter_casting.currentText() != "Все" and \
-               data['Наименование_отливки'] != self.filter_casting.currentText():
-                return False
-            
-            # Фильтр по температуре
-            if self.temp_from.text() and self.temp_to.text():
-                try:
-                    temp_A = float(data['Плавка_температура_заливки_A'])
-                    temp_B = float(data['Плавка_температура_заливки_B'])
-                    temp_C = float(data['Плавка_температура_заливки_C'])
-                    temp_D = float(data['Плавка_температура_заливки_D'])
-                    temp_from = float(self.temp_from.text())
-                    temp_to = float(self.temp_to.text())
-                    if not (temp_from <= temp_A <= temp_to) and not (temp_from <= temp_B <= temp_to) and not (temp_from <= temp_C <= temp_to) and not (temp_from <= temp_D <= temp_to):
-                        return False
-                except ValueError:
-                    pass
-            
-            return True
-        except Exception as e:
-            logging.error(f"Ошибка при применении фильтров: {str(e)}")
-            return False
+        self.backup_pool = QThreadPool(self)
+        self.backup_pool.setMaxThreadCount(1)
+
+    def filter_values(self):
+        """Значения фильтров диалога в виде аргументов RecordColumns.filter_mask"""
+        casting = self.filter_casting.currentText()
+        temp_from = temp_to = None
+        if self.temp_from.text() and self.temp_to.text():
+            try:
+                temp_from = float(self.temp_from.text())
+                temp_to = float(self.temp_to.text())
+            except ValueError:
+                temp_from = temp_to = None
+        return {
+            'date_from': self.date_from.date().toPython().toordinal(),
+            'date_to': self.date_to.date().toPython().toordinal(),
+            'casting': None if casting == "Все" else casting,
+            'temp_from': temp_from,
+            'temp_to': temp_to,
+        }
 
     def update_statistics(self):
         """Обновляет статистику по данным"""
         try:
-            wb = load_workbook(EXCEL_FILENAME, read_only=True)
-            ws = wb.active
-            headers = [cell.value for cell in ws[1]]
+            filters = self.filter_values()
+            key = result_key('statistics', '', filters, data_version())
+            report = get_result_cache().get(key)
+            if report is not None:
+                self.stats_text.setText(report)
+                return
             
-            stats = {
-                'total_records': 0,
-                'avg_temp': [],
-                'casting_types': {},
-                'participants': set(),
-                'min_temp': float('inf'),
-                'max_temp': float('-inf')
-            }
+            aggregates = get_running_aggregates()
+            if filters['temp_from'] is None and aggregates.covers(filters['date_from'], filters['date_to']):
+                # Границы по месяцам и без фильтра температуры - ответ по накопленным агрегатам
+                stats = aggregates.statistics(filters['date_from'], filters['date_to'], filters['casting'])
+                crew_counts = stats['participant_counts']
+            else:
+                columns = get_record_columns()
+                mask = columns.filter_mask(**filters)
+                stats = compute_statistics(columns, mask)
+                # Плавки каждого участника в любой роли - по индексу участников
+                crew_counts = get_participant_index().counts(within=mask_bitmap(mask))
             
-            for row in ws.iter_rows(min_row=2, values_only=True):
-                # Проверяем фильтры
-                if not self.apply_filters(row, headers):
-                    continue
-                    
-                # Ищем совпадения
-                data = dict(zip(headers, row))
-                stats['total_records'] += 1
-                
-                # Температура
-                try:
-                    temp_A = float(data['Плавка_температура_заливки_A'])
-                    temp_B = float(data['Плавка_температура_заливки_B'])
-                    temp_C = float(data['Плавка_температура_заливки_C'])
-                    temp_D = float(data['Плавка_температура_заливки_D'])
-                    stats['avg_temp'].append(temp_A)
-                    stats['avg_temp'].append(temp_B)
-                    stats['avg_temp'].append(temp_C)
-                    stats['avg_temp'].append(temp_D)
-                    stats['min_temp'] = min(stats['min_temp'], temp_A, temp_B, temp_C, temp_D)
-                    stats['max_temp'] = max(stats['max_temp'], temp_A, temp_B, temp_C, temp_D)
-                except (ValueError, TypeError):
-                    pass
-                
-                # Типы отливок
-                casting = data['Наименование_отливки']
-                stats['casting_types'][casting] = stats['casting_types'].get(casting, 0) + 1
-                
-                # Участники
-                stats['participants'].add(data['Старший_смены_плавки'])
-                stats['participants'].add(data['Первый_участник_смены_плавки'])
-                stats['participants'].add(data['Второй_участник_смены_плавки'])
-                stats['participants'].add(data['Третий_участник_смены_плавки'])
-                stats['participants'].add(data['Четвертый_участник_смены_плавки'])
+            def temperature_lines(summary):
+                if not summary['count']:
+                    return ["Нет данных"]
+                percentiles = ", ".join(f"P{p}: {value:.0f}" for p, value in summary['percentiles'].items())
+                return [
+                    f"Замеров: {summary['count']}",
+                    f"Средняя: {summary['mean']:.1f}°C",
+                    f"Минимальная: {summary['min']:.0f}°C",
+                    f"Максимальная: {summary['max']:.0f}°C",
+                    f"Стандартное отклонение: {summary['std']:.1f}°C",
+                    f"Процентили: {percentiles}",
+                ]
             
             # Формируем отчет
             report = [
                 "=== Общая статистика ===",
                 f"Всего записей: {stats['total_records']}",
-                f"Количество участников: {len(stats['participants'])}",
+                f"Количество участников: {stats['participant_count']}",
                 "",
                 "=== Температура заливки ===",
-                f"Средняя: {sum(stats['avg_temp'])/len(stats['avg_temp']):.1f}°C" if stats['avg_temp'] else "Нет данных",
-                f"Минимальная: {stats['min_temp']}°C" if stats['min_temp'] != float('inf') else "Нет данных",
-                f"Максимальная: {stats['max_temp']}°C" if stats['max_temp'] != float('-inf') else "Нет данных",
-                "",
-                "=== Распределение по типам отливок ===",
             ]
+            report.extend(temperature_lines(stats['overall']))
+            for sector, summary in stats['sectors'].items():
+                report.append("")
+                report.append(f"--- Сектор {sector} ---")
+                report.extend(temperature_lines(summary))
+            report.extend(["", "=== Распределение по типам отливок ==="])
             
             for casting, count in sorted(stats['casting_types'].items()):
                 report.append(f"{casting}: {count} ({count/stats['total_records']*100:.1f}%)")
+
+            report.extend(["", "=== Плавки по участникам смены ==="])
+            for name, count in crew_counts.items():
+                report.append(f"{name}: {count}")
             
-            self.stats_text.setText("\n".join(report))
-            wb.close()
+            report = "\n".join(report)
+            get_result_cache().put(key, report)
+            self.stats_text.setText(report)
             
         except Exception as e:
             logging.error(f"Ошибка при обновлении статистики: {str(e)}")
             QMessageBox.critical(self, "Ошибка", f"Ошибка при обновлении статистики: {str(e)}")
 
     def search_records(self):
-        search_text = self.search_input.text().lower()
+        """Запускает поиск в фоне; предыдущий запрос отменяется"""
+        self.search_timer.stop()
+        self.cancel_search()
+        self.search_generation += 1
+        # Итог предыдущего поиска нужен потоку для сужения результатов
+        previous, self.last_search = self.last_search, None
+        worker = SearchWorker(self.search_generation, self.search_input.text().lower(),
+                              self.filter_values(), previous)
+        worker.signals.planned.connect(self.on_search_planned)
+        worker.signals.page.connect(self.on_search_page)
+        worker.signals.finished.connect(self.on_search_finished)
+        worker.signals.failed.connect(self.on_search_failed)
+        self.search_worker = worker
+        self.search_pool.start(worker)
+
+    def on_search_planned(self, generation, estimate):
+        if generation != self.search_generation:
+            return
+        # Таблица очищается, когда готов план нового запроса, а не на каждое нажатие
+        self.results_model.clear()
+        self.results_count.setText(f"Найдено: до {estimate}")
+
+    def on_search_page(self, generation, rows):
+        if generation != self.search_generation:
+            return
+        self.results_model.append_rows(rows)
+        self.results_model.resort()
+
+    def on_search_failed(self, generation, message, syntax):
+        if generation != self.search_generation:
+            return
+        self.search_worker = None
+        if syntax:
+            # Запрос еще набирается - ошибку показываем без окна
+            self.results_model.clear()
+            self.results_count.setText(f"Ошибка в запросе: {message}")
+        else:
+            QMessageBox.critical(self, "Ошибка", f"Ошибка при поиске: {message}")
+
+    def explain_search(self):
+        """Показывает план выполнения запроса из поля поиска"""
         try:
-            wb = load_workbook(EXCEL_FILENAME, read_only=True)
-            ws = wb.active
-            headers = [cell.value for cell in ws[1]]
-            
-            self.results_table.setRowCount(0)
-            
-            for row in ws.iter_rows(min_row=2, values_only=True):
-                # Проверяем фильтры
-                if not self.apply_filters(row, headers):
-                    continue
-                    
-                # Ищем совпадения
-                for cell in row:
-                    if cell and str(cell).lower().find(search_text) != -1:
-                        row_position = self.results_table.rowCount()
-                        self.results_table.insertRow(row_position)
-                        
-                        for col, field in enumerate(SEARCH_FIELDS):
-                            field_index = headers.index(field)
-                            self.results_table.setItem(
-                                row_position, col, 
-                                QTableWidgetItem(str(row[field_index])))
-                        break
-            
-            wb.close()
-            
+            text = explain_query(self.search_input.text().lower(), get_record_columns(),
+                                 get_trigram_index(), self.filter_values(),
+                                 participant_index=get_participant_index())
+            QMessageBox.information(self, "План запроса", text)
+        except QuerySyntaxError as e:
+            QMessageBox.warning(self, "Предупреждение", f"Ошибка в запросе: {str(e)}")
         except Exception as e:
-            logging.error(f"Ошибка при поиске: {str(e)}")
-            QMessageBox.critical(self, "Ошибка", f"Ошибка при поиске: {str(e)}")
+            logging.error(f"Ошибка при построении плана запроса: {str(e)}")
+            QMessageBox.critical(self, "Ошибка", f"Ошибка при построении плана запроса: {str(e)}")
+
+    def cancel_search(self):
+        """Останавливает выполняющийся поиск"""
+        if self.search_worker is not None:
+            self.search_worker.cancelled.set()
+            self.search_worker = None
+
+    def on_search_finished(self, generation, result):
+        if generation != self.search_generation:
+            return
+        self.search_worker = None
+        self.last_search = result
+        self.results_count.setText(f"Найдено: {len(result['matched'])}")
+
+    def wait_search(self):
+        """Дожидается окончания поиска и добавляет в таблицу все его порции"""
+        if self.search_worker is not None:
+            self.search_pool.waitForDone()
+            # Порции из потока поиска доставляются событиями - обрабатываем их сразу
+            QApplication.sendPostedEvents()
+
+    def done(self, result):
+        self.cancel_search()
+        self.search_pool.waitForDone()
+        super().done(result)
 
     def edit_selected(self):
-        current_row = self.results_table.currentRow()
+        current_row = self.results_table.currentIndex().row()
         if current_row < 0:
             QMessageBox.warning(self, "Предупреждение", "Выберите запись для редактирования")
             return
             
         # Получаем ID выбранной записи
-        record_id = self.results_table.item(current_row, 0).text()
+        record_id = str(self.results_model.record_id(current_row))
         
         # Создаем диалог редактирования
         edit_dialog = EditRecordDialog(record_id, self)
@@ -1184,16 +1425,16 @@ class SearchDialog(QDialog):
             )
             
             if file_name:
+                # Выгружается весь результат, а не только уже полученные порции
+                self.wait_search()
                 # Создаем DataFrame из данных таблицы
-                data = []
-                for row in range(self.results_table.rowCount()):
-                    row_data = []
-                    for col in range(self.results_table.columnCount()):
-                        item = self.results_table.item(row, col)
-                        row_data.append(item.text() if item else "")
-                    data.append(row_data)
+                data = [
+                    ["" if value is None else str(value) for value in self.results_model.row_values(row)]
+                    for row in range(self.results_model.rowCount())
+                ]
+                fields = [HEADERS[column] for column in self.results_model.columns]
                 
-                df = pd.DataFrame(data, columns=SEARCH_FIELDS)
+                df = pd.DataFrame(data, columns=fields)
                 
                 if "xlsx" in selected_format:
                     df.to_excel(file_name, index=False)
@@ -1220,23 +1461,26 @@ class SearchDialog(QDialog):
             timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
             backup_file = os.path.join(BACKUP_DIR, f'plavka_backup_{timestamp}.xlsx')
             
-            # Копируем файл
-            shutil.copy2(EXCEL_FILENAME, backup_file)
-            
-            # Удаляем старые резервные копии если их больше MAX_BACKUPS
-            backups = sorted([os.path.join(BACKUP_DIR, f) for f in os.listdir(BACKUP_DIR)])
-            while len(backups) > MAX_BACKUPS:
-                os.remove(backups[0])
-                backups.pop(0)
-            
-            QMessageBox.information(self, "Успех", 
-                f"Резервная копия создана:\n{backup_file}")
+            # Выгрузка идет в фоне, кнопка недоступна до её окончания
+            worker = BackupWorker(backup_file)
+            worker.signals.finished.connect(self.backup_finished)
+            self.backup_button.setEnabled(False)
+            self.backup_pool.start(worker)
             
         except Exception as e:
             logging.error(f"Ошибка при создании резервной копии: {str(e)}")
             QMessageBox.critical(self, "Ошибка", 
                 f"Ошибка при создании резервной копии: {str(e)}")
 
+    def backup_finished(self, backup_file, error):
+        self.backup_button.setEnabled(True)
+        if error:
+            QMessageBox.critical(self, "Ошибка", 
+                f"Ошибка при создании резервной копии: {error}")
+        else:
+            QMessageBox.information(self, "Успех", 
+                f"Резервная копия создана:\n{backup_file}")
+
 class EditRecordDialog(QDialog):
     def __init__(self, record_id, parent=None):
         super().__init__(parent)
@@ -1462,18 +1706,12 @@ class EditRecordDialog(QDialog):
 
     def load_record_data(self):
         try:
-            wb = load_workbook(EXCEL_FILENAME)
-            ws = wb.active
-            
-            headers = [cell.value for cell in ws[1]]
-            
-            for row in ws.iter_rows(min_row=2, values_only=True):
-                if str(row[0]) == self.record_id:
-                    # Заполняем поля данными
-                    self.fill_fields(row, headers)
-                    break
-                    
-            wb.close()
+            # Запись ищется по индексу строк, без просмотра всего листа
+            get_row_index()
+            row = get_record_cache().get(self.record_id)
+            if row is not None:
+                # Заполняем поля данными
+                self.fill_fields(row, HEADERS)
             
         except Exception as e:
             logging.error(f"Ошибка при загрузке записи: {str(e)}")
@@ -1482,107 +1720,75 @@ class EditRecordDialog(QDialog):
     def fill_fields(self, row, headers):
         """Заполняет поля формы данными из записи"""
         try:
-            # Создаем словарь с данными
-            data = dict(zip(headers, row))
+            # Поля записи по заголовкам листа
+            data = MeltRecord.from_row(row)
             
             # Заполняем поля
-            self.Плавка_дата.setDate(QDate.fromString(data['Плавка_дата'], "dd.MM.yyyy"))
-            self.Номер_плавки.setText(str(data['Номер_плавки']))
-            self.Номер_кластера.setText(str(data['Номер_кластера']))
+            self.Плавка_дата.setDate(QDate.fromString(field_text(data['Плавка_дата']), "dd.MM.yyyy"))
+            self.Номер_плавки.setText(field_text(data['Номер_плавки']))
+            self.Номер_кластера.setText(field_text(data['Номер_кластера']))
             
             # Устанавливаем значения комбобоксов
-            self.Старший_смены_плавки.setCurrentText(str(data['Старший_смены_плавки']))
-            self.Первый_участник_смены_плавки.setCurrentText(str(data['Первый_участник_смены_плавки']))
-            self.Второй_участник_смены_плавки.setCurrentText(str(data['Второй_участник_смены_плавки']))
-            self.Третий_участник_смены_плавки.setCurrentText(str(data['Третий_участник_смены_плавки']))
-            self.Четвертый_участник_смены_плавки.setCurrentText(str(data['Четвертый_участник_смены_плавки']))
+            set_combo_text(self.Старший_смены_плавки, data['Старший_смены_плавки'])
+            set_combo_text(self.Первый_участник_смены_плавки, data['Первый_участник_смены_плавки'])
+            set_combo_text(self.Второй_участник_смены_плавки, data['Второй_участник_смены_плавки'])
+            set_combo_text(self.Третий_участник_смены_плавки, data['Третий_участник_смены_плавки'])
+            set_combo_text(self.Четвертый_участник_смены_плавки, data['Четвертый_участник_смены_плавки'])
             
-            self.Наименование_отливки.setCurrentText(str(data['Наименование_отливки']))
-            self.Тип_эксперемента.setCurrentText(str(data['Тип_эксперемента']))
+            set_combo_text(self.Наименование_отливки, data['Наименование_отливки'])
+            set_combo_text(self.Тип_эксперемента, data['Тип_эксперемента'])
             
             # Заполняем секторы опоки
-            self.Сектор_A_опоки.setText(str(data['Сектор_A_опоки']))
-            self.Сектор_B_опоки.setText(str(data['Сектор_B_опоки']))
-            self.Сектор_C_опоки.setText(str(data['Сектор_C_опоки']))
-            self.Сектор_D_опоки.setText(str(data['Сектор_D_опоки']))
+            self.Сектор_A_опоки.setText(field_text(data['Сектор_A_опоки']))
+            self.Сектор_B_опоки.setText(field_text(data['Сектор_B_опоки']))
+            self.Сектор_C_опоки.setText(field_text(data['Сектор_C_опоки']))
+            self.Сектор_D_опоки.setText(field_text(data['Сектор_D_опоки']))
             
-            # Заполняем время и температуру
-            self.Плавка_время_прогрева_ковша_A.setText(str(data['Плавка_время_прогрева_ковша_A']))
-            self.Плавка_время_перемещения_A.setText(str(data['Плавка_время_перемещения_A']))
-            self.Плавка_время_заливки_A.setText(str(data['Плавка_время_заливки_A']))
-            self.Плавка_температура_заливки_A.setText(str(data['Плавка_температура_заливки_A']))
-
-            self.Плавка_время_прогрева_ковша_B.setText(str(data['Плавка_время_прогрева_ковша_B']))
-            self.Плавка_время_перемещения_B.setText(str(data['Плавка_время_перемещения_B']))
-            self.Плавка_время_заливки_B.setText(str(data['Плавка_время_заливки_B']))
-            self.Плавка_температура_заливки_B.setText(str(data['Плавка_температура_заливки_B']))
-
-            self.Плавка_время_прогрева_ковша_C.setText(str(data['Плавка_время_прогрева_ковша_C']))
-            self.Плавка_время_перемещения_C.setText(str(data['Плавка_время_перемещения_C']))
-            self.Плавка_время_заливки_C.setText(str(data['Плавка_время_заливки_C']))
-            self.Плавка_температура_заливки_C.setText(str(data['Плавка_температура_заливки_C']))
-
-            self.Плавка_время_прогрева_ковша_D.setText(str(data['Плавка_время_прогрева_ковша_D']))
-            self.Плавка_время_перемещения_D.setText(str(data['Плавка_время_перемещения_D']))
-            self.Плавка_время_заливки_D.setText(str(data['Плавка_время_заливки_D']))
-            self.Плавка_температура_заливки_D.setText(str(data['Плавка_температура_заливки_D']))
-
-            self.Комментарий.setText(str(data['Комментарий']))
+            # Заполняем время и температуру; пустые ячейки - пустые поля
+            for field in SECTOR_FIELD_NAMES:
+                getattr(self, field).setText(field_text(data[field]))
+
+            self.Комментарий.setText(field_text(data['Комментарий']))
             
         except Exception as e:
             logging.error(f"Ошибка при заполнении полей: {str(e)}")
             raise
 
     def save_changes(self):
-        """Сохраняет изменения в Excel файл"""
+        """Сохраняет изменения в журнал записей"""
         try:
-            wb = load_workbook(EXCEL_FILENAME)
-            ws = wb.active
-            
-            # Находим строку с нужным ID
-            row_index = None
-            for idx, row in enumerate(ws.iter_rows(min_row=2, values_only=True)):
-                if str(row[0]) == self.record_id:
-                    row_index = idx + 2
-                    break
+            values = {
+                "Плавка_дата": self.Плавка_дата.date().toString("dd.MM.yyyy"),
+                "Номер_плавки": self.Номер_плавки.text(),
+                "Номер_кластера": self.Номер_кластера.text(),
+                "Старший_смены_плавки": self.Старший_смены_плавки.currentText(),
+                "Первый_участник_смены_плавки": self.Первый_участник_смены_плавки.currentText(),
+                "Второй_участник_смены_плавки": self.Второй_участник_смены_плавки.currentText(),
+                "Третий_участник_смены_плавки": self.Третий_участник_смены_плавки.currentText(),
+                "Четвертый_участник_смены_плавки": self.Четвертый_участник_смены_плавки.currentText(),
+                "Наименование_отливки": self.Наименование_отливки.currentText(),
+                "Тип_эксперемента": self.Тип_эксперемента.currentText(),
+                "Сектор_A_опоки": self.Сектор_A_опоки.text(),
+                "Сектор_B_опоки": self.Сектор_B_опоки.text(),
+                "Сектор_C_опоки": self.Сектор_C_опоки.text(),
+                "Сектор_D_опоки": self.Сектор_D_опоки.text(),
+                "Комментарий": self.Комментарий.toPlainText(),
+            }
+            values.update({field: getattr(self, field).text() for field in SECTOR_FIELD_NAMES})
+            # Пустая маска времени и поля из одних пробелов сохраняются пустыми
+            values = {field: input_value(value) for field, value in values.items()}
+
+            # Дата, время и температура проверяются по схеме записи
+            invalid = field_errors(values)
+            if invalid:
+                QMessageBox.warning(self, "Ошибка", f"Неверные значения полей: {', '.join(invalid)}")
+                return
             
-            if row_index:
-                # Обновляем данные в строке
-                ws.cell(row=row_index, column=3).value = self.Плавка_дата.date().toString("dd.MM.yyyy")
-                ws.cell(row=row_index, column=4).value = self.Номер_плавки.text()
-                ws.cell(row=row_index, column=5).value = self.Номер_кластера.text()
-                ws.cell(row=row_index, column=6).value = self.Старший_смены_плавки.currentText()
-                ws.cell(row=row_index, column=7).value = self.Первый_участник_смены_плавки.currentText()
-                ws.cell(row=row_index, column=8).value = self.Второй_участник_смены_плавки.currentText()
-                ws.cell(row=row_index, column=9).value = self.Третий_участник_смены_плавки.currentText()
-                ws.cell(row=row_index, column=10).value = self.Четвертый_участник_смены_плавки.currentText()
-                ws.cell(row=row_index, column=11).value = self.Наименование_отливки.currentText()
-                ws.cell(row=row_index, column=12).value = self.Тип_эксперемента.currentText()
-                ws.cell(row=row_index, column=13).value = self.Сектор_A_опоки.text()
-                ws.cell(row=row_index, column=14).value = self.Сектор_B_опоки.text()
-                ws.cell(row=row_index, column=15).value = self.Сектор_C_опоки.text()
-                ws.cell(row=row_index, column=16).value = self.Сектор_D_опоки.text()
-                ws.cell(row=row_index, column=17).value = self.Плавка_время_прогрева_ковша_A.text()
-                ws.cell(row=row_index, column=18).value = self.Плавка_время_перемещения_A.text()
-                ws.cell(row=row_index, column=19).value = self.Плавка_время_заливки_A.text()
-                ws.cell(row=row_index, column=20).value = self.Плавка_температура_заливки_A.text()
-                ws.cell(row=row_index, column=21).value = self.Плавка_время_прогрева_ковша_B.text()
-                ws.cell(row=row_index, column=22).value = self.Плавка_время_перемещения_B.text()
-                ws.cell(row=row_index, column=23).value = self.Плавка_время_заливки_B.text()
-                ws.cell(row=row_index, column=24).value = self.Плавка_температура_заливки_B.text()
-                ws.cell(row=row_index, column=25).value = self.Плавка_время_прогрева_ковша_C.text()
-                ws.cell(row=row_index, column=26).value = self.Плавка_время_перемещения_C.text()
-                ws.cell(row=row_index, column=27).value = self.Плавка_время_заливки_C.text()
-                ws.cell(row=row_index, column=28).value = self.Плавка_температура_заливки_C.text()
-                ws.cell(row=row_index, column=29).value = self.Плавка_время_прогрева_ковша_D.text()
-                ws.cell(row=row_index, column=30).value = self.Плавка_время_перемещения_D.text()
-                ws.cell(row=row_index, column=31).value = self.Плавка_время_заливки_D.text()
-                ws.cell(row=row_index, column=32).value = self.Плавка_температура_заливки_D.text()
-                ws.cell(row=row_index, column=33).value = self.Комментарий.toPlainText()
-                
-                wb.save(EXCEL_FILENAME)
+            if get_write_coalescer().submit_update(self.record_id, values).result():
                 QMessageBox.information(self, "Успех", "Изменения сохранены")
                 self.accept()
+            else:
+                QMessageBox.critical(self, "Ошибка", "Не удалось сохранить изменения")
             
         except Exception as e:
             logging.error(f"Ошибка при сохранении изменений: {str(e)}")
@@ -1590,6 +1796,8 @@ class EditRecordDialog(QDialog):
 
 if __name__ == "__main__":
     app = QApplication(sys.argv)
+    # При выходе переносим оставшиеся записи журнала в plavka.xlsx и записываем снимки индексов
+    app.aboutToQuit.connect(compact_storage)
     window = MainWindow()
     window.show()
     sys.exit(app.exec())
@@ -0,0 +1,701 @@
+import logging
+import threading
+from collections import OrderedDict
+from datetime import date
+import numpy as np
+from plavka_storage import get_record_cache
+from plavka_schema import (CASTING_COLUMN, EXPERIMENT_COLUMN, PARTICIPANT_COLUMNS, SECTORS, MISSING_DATE,
+                           MISSING_TIME, TIME_METRICS, SECTOR_METRICS, COLUMN_TYPES, TEXT, TypedRecords,
+                           category_key, parse_row, parse_value)
+from plavka_index import PersistentIndex, get_index
+from plavka_records import CodeTable, get_code_table
+
+# Номер замера температуры в последней оси тензора секторов
+TEMPERATURE_METRIC = SECTOR_METRICS.index("температура_заливки")
+
+# Процентили температуры в статистике
+PERCENTILES = [10, 25, 50, 75, 90]
+
+# Файл накопленных агрегатов рядом с файлом данных
+AGGREGATES_SUFFIX = '.aggregates.json'
+
+# Сколько результатов запросов хранить в кэше
+RESULT_CACHE_SIZE = 64
+
+# Измерения куба агрегатов: месяц 'ГГГГ-ММ', отливка, тип эксперимента, сектор
+CUBE_DIMENSIONS = ('month', 'casting', 'experiment', 'sector')
+# Категориальные измерения куба и их категории в таблице кодов
+CATEGORY_DIMENSIONS = {'casting': 'castings', 'experiment': 'experiments'}
+
+
+def _text(value):
+    return str(value) if value is not None else ''
+
+
+def _little_endian_bytes(words):
+    return np.ascontiguousarray(words, dtype='<u8').view(np.uint8)
+
+
+def popcount(words):
+    """Число установленных битов в массиве слов uint64"""
+    return int(np.unpackbits(_little_endian_bytes(words)).sum())
+
+
+def set_bits(words):
+    """Номера установленных битов в массиве слов uint64 по возрастанию"""
+    return np.flatnonzero(np.unpackbits(_little_endian_bytes(words), bitorder='little'))
+
+
+def mask_bitmap(mask):
+    """Битовая карта (целое число) записей булевой маски"""
+    return int.from_bytes(np.packbits(mask, bitorder='little').tobytes(), 'little')
+
+
+def bitmap_mask(bitmap, size):
+    """Булева маска длины size по битовой карте; биты за её концом отбрасываются"""
+    bitmap &= (1 << size) - 1
+    data = np.frombuffer(bitmap.to_bytes((size + 7) // 8, 'little'), dtype=np.uint8)
+    return np.unpackbits(data, bitorder='little', count=size).astype(bool)
+
+
+def sort_key_function(column):
+    """Функция типизированного ключа сортировки для столбца листа.
+
+    Даты сортируются по дню, температуры как числа, время по минутам,
+    остальное - как текст без учета регистра. Пустые значения идут
+    последними.
+    """
+    if COLUMN_TYPES[column] != TEXT:
+        def convert(value):
+            # Значения, не прошедшие разбор по схеме, сортируются как пустые
+            try:
+                return parse_value(column, value)
+            except ValueError:
+                return None
+    else:
+        def convert(value):
+            return str(value).lower() if value not in (None, '') else None
+
+    # Значения в столбцах часто повторяются - разбираем каждое один раз
+    keys = {}
+
+    def key(value):
+        result = keys.get(value)
+        if result is None:
+            converted = convert(value)
+            result = keys[value] = (1, '') if converted is None else (0, converted)
+        return result
+    return key
+
+
+class RecordColumns:
+    """Записи кэша в виде массивов по столбцам.
+
+    dates, times и temperatures берутся из типизированных столбцов
+    typed (TypedRecords), разобранных при загрузке и записи: порядковые
+    номера дней (MISSING_DATE, если даты нет), минуты от полуночи (N, 12)
+    и температуры заливки (N, 4) по секторам A-D с NaN на месте пустых и
+    неразобранных значений. castings, experiments и participants (N, 5) -
+    коды отливок, типов эксперимента и участников смены из постоянной
+    таблицы кодов code_table; casting_names и другие списки имен
+    расположены в порядке кодов. participant_bits - битовые множества
+    участников каждой записи. version - версия кэша записей, по которой
+    построены столбцы.
+    """
+
+    def __init__(self, rows, version=None, typed=None, code_table=None):
+        self.rows = rows
+        self.version = version
+        if typed is None:
+            typed = TypedRecords(rows)
+        self.dates = typed.dates
+        self.times = typed.times
+        self.temperatures = typed.temperatures
+        self.parse_errors = typed.errors
+        if code_table is None:
+            code_table = CodeTable()
+        self.code_table = code_table
+        self.castings = code_table.encode_rows('castings', rows)
+        self.experiments = code_table.encode_rows('experiments', rows)
+        self.participants = code_table.encode_rows('participants', rows)
+        # Имена берем после кодирования, чтобы в списки попали и новые
+        self.casting_names = code_table.names('castings')
+        self.experiment_names = code_table.names('experiments')
+        self.participant_names = code_table.names('participants')
+        self._participant_bits = None
+        self._sectors = None
+        self._date_order = None
+        self._sorted_dates = None
+        self._code_positions = {}
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self.rows)
+
+    @property
+    def date_order(self):
+        """Позиции записей по возрастанию даты; записи без даты - в конце"""
+        if self._date_order is None:
+            self._date_order = np.argsort(self._date_keys(), kind='stable')
+        return self._date_order
+
+    def _date_keys(self):
+        # Записи без даты получают наибольший ключ
+        return np.where(self.dates == MISSING_DATE, np.iinfo(np.int64).max, self.dates)
+
+    @property
+    def sorted_dates(self):
+        """Ключи дат в порядке date_order для двоичного поиска диапазона"""
+        if self._sorted_dates is None:
+            self._sorted_dates = self._date_keys()[self.date_order]
+        return self._sorted_dates
+
+    def date_range_positions(self, date_from=None, date_to=None):
+        """Позиции записей с датой в диапазоне, найденные двоичным поиском"""
+        dates = self.sorted_dates
+        start = np.searchsorted(dates, date_from, side='left') if date_from is not None else 0
+        if date_to is not None:
+            end = np.searchsorted(dates, date_to, side='right')
+        else:
+            end = np.searchsorted(dates, np.iinfo(np.int64).max, side='left')
+        return np.sort(self.date_order[start:max(start, end)])
+
+    def code_positions(self, kind, codes):
+        """Позиции записей с любым из кодов в массиве kind ('castings', 'experiments',
+        'participants' или 'participants:N' - только N-й участник)"""
+        key = (kind, tuple(sorted(codes)))
+        with self._lock:
+            positions = self._code_positions.get(key)
+        if positions is None:
+            if kind.startswith('participants:'):
+                values = self.participants[:, int(kind.split(':')[1])]
+            else:
+                values = getattr(self, kind)
+            selected = np.isin(values, list(codes))
+            if selected.ndim > 1:
+                selected = selected.any(axis=1)
+            positions = np.flatnonzero(selected)
+            with self._lock:
+                self._code_positions[key] = positions
+        return positions
+
+    def casting_code(self, name):
+        """Код отливки или None, если такой отливки нет в данных"""
+        return self.code_table.code('castings', name)
+
+    @property
+    def sectors(self):
+        """Тензор (N, 4, 4): записи x сектора A-D x замеры SECTOR_METRICS.
+
+        Замеры - минуты от полуночи прогрева ковша, перемещения и заливки
+        и температура заливки; пустые значения - NaN.
+        """
+        if self._sectors is None:
+            times = self.times.reshape(len(self.rows), len(SECTORS), len(TIME_METRICS)).astype(np.float64)
+            times[times == MISSING_TIME] = np.nan
+            self._sectors = np.concatenate([times, self.temperatures[:, :, np.newaxis]], axis=2)
+        return self._sectors
+
+    @property
+    def participant_bits(self):
+        """Матрица (N, слов) битовых множеств участников смены по кодам.
+
+        Бит кода участника установлен, если он был в смене в любой роли;
+        пустые значения ролей в множество не входят.
+        """
+        if self._participant_bits is None:
+            words = max(1, (len(self.participant_names) + 63) // 64)
+            bits = np.zeros((len(self.rows), words), dtype=np.uint64)
+            codes = self.participants.ravel()
+            positions = np.repeat(np.arange(len(self.rows)), self.participants.shape[1])
+            empty = self.code_table.code('participants', '')
+            filled = codes != empty if empty is not None else np.ones(codes.shape, dtype=bool)
+            codes, positions = codes[filled], positions[filled]
+            np.bitwise_or.at(bits, (positions, codes // 64),
+                             np.left_shift(np.uint64(1), (codes % 64).astype(np.uint64)))
+            self._participant_bits = bits
+        return self._participant_bits
+
+    def participant_set(self, mask):
+        """Битовое множество участников записей маски (объединение по OR)"""
+        bits = self.participant_bits[mask]
+        if not len(bits):
+            return np.zeros(self.participant_bits.shape[1], dtype=np.uint64)
+        return np.bitwise_or.reduce(bits, axis=0)
+
+    def filter_mask(self, date_from=None, date_to=None, casting=None,
+                    temp_from=None, temp_to=None):
+        """Булева маска записей, подходящих под все фильтры.
+
+        date_from и date_to - порядковые номера дней включительно;
+        casting - наименование отливки (по category_key) или None для всех; температурный
+        фильтр пропускает запись, если хотя бы один сектор попадает в
+        диапазон [temp_from, temp_to].
+        """
+        mask = np.ones(len(self.rows), dtype=bool)
+        if date_from is not None or date_to is not None:
+            mask &= self.dates != MISSING_DATE
+            if date_from is not None:
+                mask &= self.dates >= date_from
+            if date_to is not None:
+                mask &= self.dates <= date_to
+        if casting is not None:
+            code = self.casting_code(casting)
+            if code is None:
+                return np.zeros(len(self.rows), dtype=bool)
+            mask &= self.castings == code
+        if temp_from is not None and temp_to is not None:
+            # Сравнение с NaN дает False - пустые сектора в диапазон не попадают
+            in_range = (self.temperatures >= temp_from) & (self.temperatures <= temp_to)
+            mask &= in_range.any(axis=1)
+        return mask
+
+
+def describe(values):
+    """Сводка по массиву температур без NaN"""
+    if not values.size:
+        return {'count': 0}
+    return {
+        'count': int(values.size),
+        'mean': float(values.mean()),
+        'min': float(values.min()),
+        'max': float(values.max()),
+        'std': float(values.std()),
+        'percentiles': dict(zip(PERCENTILES, (float(value) for value in np.percentile(values, PERCENTILES)))),
+    }
+
+
+def compute_statistics(columns, mask):
+    """Статистика по записям маски.
+
+    Температуры считаются по каждому сектору и по всем секторам вместе,
+    пустые сектора пропускаются. Возвращает словарь с общим числом
+    записей, сводками по секторам, распределением отливок и числом
+    участников смены.
+    """
+    temperatures = columns.temperatures[mask]
+    valid = ~np.isnan(temperatures)
+    sectors = {sector: describe(temperatures[valid[:, index], index])
+               for index, sector in enumerate(SECTORS)}
+
+    casting_counts = np.bincount(columns.castings[mask], minlength=len(columns.casting_names))
+    castings = {name: int(count) for name, count in zip(columns.casting_names, casting_counts) if count}
+
+    # Число разных участников - popcount объединения битовых множеств записей
+    present = columns.participant_set(mask)
+    participants = sorted(columns.participant_names[code] for code in set_bits(present))
+
+    return {
+        'total_records': int(mask.sum()),
+        'sectors': sectors,
+        'overall': describe(temperatures[valid]),
+        'casting_types': castings,
+        'participants': participants,
+        'participant_count': popcount(present),
+    }
+
+
+def sector_spread(sectors, metric=TEMPERATURE_METRIC):
+    """Разброс замера между секторами каждой записи: максимум минус минимум.
+
+    sectors - тензор (N, 4, 4) или его часть; для записей, где замер есть
+    меньше чем в двух секторах, результат - NaN.
+    """
+    values = sectors[:, :, metric]
+    valid = ~np.isnan(values)
+    highest = np.where(valid, values, -np.inf).max(axis=1)
+    lowest = np.where(valid, values, np.inf).min(axis=1)
+    return np.where(valid.sum(axis=1) >= 2, highest - lowest, np.nan)
+
+
+def sector_group_statistics(columns, mask=None, by='castings'):
+    """Число замеров, среднее и дисперсия по группам, секторам и замерам.
+
+    by - 'castings' или 'experiments'. Возвращает (имена групп, counts,
+    means, variances), где массивы имеют форму (групп, 4, 4) в порядке
+    кодов; для пустых ячеек среднее и дисперсия - NaN.
+    """
+    names = {'castings': columns.casting_names, 'experiments': columns.experiment_names}[by]
+    codes = getattr(columns, by)
+    values = columns.sectors
+    if mask is not None:
+        codes, values = codes[mask], values[mask]
+    valid = ~np.isnan(values)
+    filled = np.where(valid, values, 0.0)
+    shape = (len(names),) + values.shape[1:]
+    counts, sums, squares = np.zeros(shape), np.zeros(shape), np.zeros(shape)
+    np.add.at(counts, codes, valid)
+    np.add.at(sums, codes, filled)
+    np.add.at(squares, codes, filled * filled)
+    with np.errstate(invalid='ignore', divide='ignore'):
+        means = sums / counts
+        variances = np.maximum(squares / counts - means * means, 0.0)
+    return names, counts.astype(np.int64), means, variances
+
+
+def sector_spread_statistics(columns, mask=None, by='castings', metric=TEMPERATURE_METRIC):
+    """Разброс замера между секторами по группам.
+
+    Возвращает (имена групп, число записей с замером хотя бы в двух
+    секторах, средний разброс, наибольший разброс) в порядке кодов.
+    """
+    names = {'castings': columns.casting_names, 'experiments': columns.experiment_names}[by]
+    codes = getattr(columns, by)
+    spread = sector_spread(columns.sectors, metric)
+    if mask is not None:
+        codes, spread = codes[mask], spread[mask]
+    valid = ~np.isnan(spread)
+    codes, spread = codes[valid], spread[valid]
+    counts = np.bincount(codes, minlength=len(names))
+    sums = np.bincount(codes, weights=spread, minlength=len(names))
+    highest = np.full(len(names), np.nan)
+    np.fmax.at(highest, codes, spread)
+    with np.errstate(invalid='ignore', divide='ignore'):
+        means = sums / counts
+    return names, counts, means, highest
+
+
+def _add_count(counts, key, delta):
+    counts[key] = counts.get(key, 0) + delta
+    if counts[key] <= 0:
+        del counts[key]
+
+
+def _percentile(items, total, percent):
+    # Линейная интерполяция по отсортированным (значение, количество), как в np.percentile
+    rank = percent / 100 * (total - 1)
+    lower, upper = int(np.floor(rank)), int(np.ceil(rank))
+    low_value = high_value = None
+    seen = 0
+    for value, count in items:
+        if low_value is None and lower < seen + count:
+            low_value = value
+        if upper < seen + count:
+            high_value = value
+            break
+        seen += count
+    return low_value + (high_value - low_value) * (rank - lower)
+
+
+class RunningAggregates(PersistentIndex):
+    """Куб накопленных агрегатов по месяцам, отливкам, типам эксперимента и секторам.
+
+    Для каждой ячейки (месяц, отливка, тип эксперимента, сектор) хранятся
+    количество, сумма и сумма квадратов температур, а также число замеров
+    каждого значения - по ним находятся минимум, максимум и процентили
+    даже после правок. Для тройки (месяц, отливка, тип эксперимента)
+    хранятся число записей и число записей каждого участника смены.
+    Отливки, типы и участники различаются по category_key, как в таблице
+    кодов и ParticipantIndex, и показываются так, как встретились впервые.
+    Правка записи сначала вычитает старые значения, затем добавляет новые.
+    """
+
+    suffix = AGGREGATES_SUFFIX
+    format_version = 6
+
+    def __init__(self, file_name):
+        super().__init__(file_name)
+        self.clear()
+
+    def clear(self):
+        # (месяц, отливка, эксперимент) -> {'records': n, 'participants': {ключ: записей}}
+        self.groups = {}
+        # категория -> {ключ: имя, как оно встретилось впервые}
+        self.names = {'castings': {}, 'experiments': {}, 'participants': {}}
+        # (месяц, отливка, эксперимент, сектор) -> {'count', 'sum', 'sumsq', 'values': {t: n}}
+        self.cells = {}
+        # порядковый номер дня -> число записей
+        self.dates = {}
+
+    def _apply(self, row, sign):
+        ordinal, _, temperatures, _ = parse_row(row)
+        month = date.fromordinal(ordinal).strftime("%Y-%m") if ordinal is not None else ''
+        group_key = (month, self._name('castings', _text(row[CASTING_COLUMN])),
+                     self._name('experiments', _text(row[EXPERIMENT_COLUMN])))
+        if ordinal is not None:
+            _add_count(self.dates, ordinal, sign)
+
+        group = self.groups.setdefault(group_key, {'records': 0, 'participants': {}})
+        group['records'] += sign
+        # Участник в двух ролях одной смены считается один раз
+        keys = set()
+        for column in PARTICIPANT_COLUMNS:
+            key = category_key(row[column])
+            if key and key not in keys:
+                keys.add(key)
+                self._name('participants', str(row[column]).strip())
+                _add_count(group['participants'], key, sign)
+        if group['records'] <= 0:
+            del self.groups[group_key]
+
+        for sector, value in zip(SECTORS, temperatures):
+            if value is None:
+                continue
+            key = group_key + (sector,)
+            cell = self.cells.setdefault(key, {'count': 0, 'sum': 0.0, 'sumsq': 0.0, 'values': {}})
+            cell['count'] += sign
+            cell['sum'] += sign * value
+            cell['sumsq'] += sign * value * value
+            _add_count(cell['values'], value, sign)
+            if cell['count'] <= 0:
+                del self.cells[key]
+
+    def _name(self, kind, name):
+        return self.names[kind].setdefault(category_key(name), name)
+
+    def on_insert(self, position, row):
+        self._apply(row, 1)
+
+    def on_update(self, position, old_row, new_row):
+        self._apply(old_row, -1)
+        self._apply(new_row, 1)
+
+    def covers(self, date_from=None, date_to=None):
+        """Можно ли ответить по агрегатам для диапазона дат.
+
+        Границы должны совпадать с границами месяцев либо лежать за
+        пределами дат, встречающихся в записях.
+        """
+        with self.lock:
+            if not self.dates:
+                return True
+            first, last = min(self.dates), max(self.dates)
+        if date_from is not None and date_from > first:
+            if date.fromordinal(date_from).day != 1:
+                return False
+        if date_to is not None and date_to < last:
+            if (date.fromordinal(date_to + 1)).day != 1:
+                return False
+        return True
+
+    def _selector(self, date_from=None, date_to=None, **filters):
+        # Проверка ключа куба: диапазон месяцев по датам и значения измерений;
+        # отливка и тип сравниваются по category_key через имя в ключах куба
+        month_from = date.fromordinal(date_from).strftime("%Y-%m") if date_from is not None else None
+        month_to = date.fromordinal(date_to).strftime("%Y-%m") if date_to is not None else None
+        with self.lock:
+            checks = [(CUBE_DIMENSIONS.index(name),
+                       self.names[CATEGORY_DIMENSIONS[name]].get(category_key(value), value)
+                       if name in CATEGORY_DIMENSIONS else value)
+                      for name, value in filters.items() if value is not None]
+
+        def selected(key):
+            month = key[0]
+            if month_from is not None or month_to is not None:
+                # Записи без даты в диапазон дат не попадают
+                if not month or (month_from is not None and month < month_from) or \
+                   (month_to is not None and month > month_to):
+                    return False
+            return all(key[index] == value for index, value in checks)
+        return selected
+
+    def _describe(self, cells):
+        count = sum(cell['count'] for cell in cells)
+        if not count:
+            return {'count': 0}
+        total = sum(cell['sum'] for cell in cells)
+        squares = sum(cell['sumsq'] for cell in cells)
+        values = {}
+        for cell in cells:
+            for value, number in cell['values'].items():
+                values[value] = values.get(value, 0) + number
+        items = sorted(values.items())
+        mean = total / count
+        return {
+            'count': count,
+            'mean': mean,
+            'min': items[0][0],
+            'max': items[-1][0],
+            'std': float(np.sqrt(max(squares / count - mean * mean, 0.0))),
+            'percentiles': {percent: _percentile(items, count, percent) for percent in PERCENTILES},
+        }
+
+    def rollup(self, dimensions=(), date_from=None, date_to=None, **filters):
+        """Сворачивает куб до заданных измерений.
+
+        dimensions - имена из CUBE_DIMENSIONS, по которым остаются строки
+        результата; остальные измерения суммируются. Фильтры: диапазон
+        дат date_from/date_to (порядковые номера дней, по месяцам) и
+        точные значения измерений, например casting='Вороток'. Возвращает
+        {кортеж значений измерений: {'count', 'sum', 'mean', 'min', 'max'}}.
+        """
+        selected = self._selector(date_from, date_to, **filters)
+        positions = [CUBE_DIMENSIONS.index(name) for name in dimensions]
+        result = {}
+        # Ячейки куба меняет поток фонового сохранения - читаем под его блокировкой
+        with self.lock:
+            for key, cell in self.cells.items():
+                if not selected(key):
+                    continue
+                # Минимум и максимум ячейки - по ключам счетчиков значений
+                cell_min, cell_max = min(cell['values']), max(cell['values'])
+                target = tuple(key[position] for position in positions)
+                summary = result.get(target)
+                if summary is None:
+                    result[target] = {'count': cell['count'], 'sum': cell['sum'],
+                                      'min': cell_min, 'max': cell_max}
+                else:
+                    summary['count'] += cell['count']
+                    summary['sum'] += cell['sum']
+                    summary['min'] = min(summary['min'], cell_min)
+                    summary['max'] = max(summary['max'], cell_max)
+        for summary in result.values():
+            summary['mean'] = summary['sum'] / summary['count']
+        return result
+
+    def record_counts(self, dimensions=(), date_from=None, date_to=None, **filters):
+        """Число записей по измерениям куба без сектора"""
+        if 'sector' in dimensions or filters.get('sector') is not None:
+            raise ValueError("Число записей не делится по секторам")
+        selected = self._selector(date_from, date_to, **filters)
+        positions = [CUBE_DIMENSIONS.index(name) for name in dimensions]
+        result = {}
+        with self.lock:
+            for key, group in self.groups.items():
+                if selected(key):
+                    target = tuple(key[position] for position in positions)
+                    result[target] = result.get(target, 0) + group['records']
+        return result
+
+    def statistics(self, date_from=None, date_to=None, casting=None):
+        """Статистика в формате compute_statistics для месяцев диапазона.
+
+        participant_counts - число записей каждого участника, как
+        ParticipantIndex.counts: {имя: количество} по убыванию.
+        """
+        selected = self._selector(date_from, date_to, casting=casting)
+        total = 0
+        castings = {}
+        participants = {}
+        with self.lock:
+            for key, group in self.groups.items():
+                if not selected(key):
+                    continue
+                total += group['records']
+                castings[key[1]] = castings.get(key[1], 0) + group['records']
+                for participant, count in group['participants'].items():
+                    participants[participant] = participants.get(participant, 0) + count
+
+            cells = {sector: [] for sector in SECTORS}
+            for key, cell in self.cells.items():
+                if selected(key):
+                    cells[key[3]].append(cell)
+            return {
+                'total_records': total,
+                'sectors': {sector: self._describe(cells[sector]) for sector in SECTORS},
+                'overall': self._describe([cell for sector in SECTORS for cell in cells[sector]]),
+                'casting_types': castings,
+                'participants': sorted(self.names['participants'][key] for key in participants),
+                'participant_count': len(participants),
+                'participant_counts': dict(sorted(
+                    ((self.names['participants'][key], count) for key, count in participants.items()),
+                    key=lambda item: (-item[1], item[0]))),
+            }
+
+    def to_state(self):
+        return {
+            'groups': [list(key) + [group['records'], dict(group['participants'])]
+                       for key, group in self.groups.items()],
+            'cells': [list(key) + [cell['count'], cell['sum'], cell['sumsq'],
+                                   [[value, number] for value, number in cell['values'].items()]]
+                      for key, cell in self.cells.items()],
+            'dates': [[ordinal, number] for ordinal, number in self.dates.items()],
+            'names': {kind: dict(names) for kind, names in self.names.items()},
+        }
+
+    def from_state(self, state):
+        self.groups = {(month, casting, experiment): {'records': records, 'participants': dict(participants)}
+                       for month, casting, experiment, records, participants in state['groups']}
+        self.cells = {(month, casting, experiment, sector): {
+                          'count': count, 'sum': total, 'sumsq': squares,
+                          'values': {value: number for value, number in values}}
+                      for month, casting, experiment, sector, count, total, squares, values in state['cells']}
+        self.dates = {ordinal: number for ordinal, number in state['dates']}
+        self.names = {kind: dict(names) for kind, names in state['names'].items()}
+
+
+def get_running_aggregates():
+    return get_index(RunningAggregates)
+
+
+_columns = None
+_columns_version = None
+_columns_lock = threading.Lock()
+
+
+def get_record_columns():
+    """Столбцы для текущей версии кэша записей; перестраиваются после изменений"""
+    global _columns, _columns_version
+    cache = get_record_cache()
+    with _columns_lock:
+        # Версию берем до снимка записей: при гонке с записью столбцы
+        # лишь перестроятся лишний раз при следующем вызове
+        cache.refresh()
+        version = cache.version
+        if _columns is None or _columns_version != version:
+            rows, typed = cache.load_typed()
+            code_table = get_code_table()
+            _columns = RecordColumns(rows, version, typed, code_table)
+            _columns_version = version
+            logging.info(f"Столбцы записей построены: {len(rows)} записей")
+        return _columns
+
+
+def data_version():
+    """Версия данных: растет при каждом сохранении, правке и перечитывании файла"""
+    cache = get_record_cache()
+    cache.refresh()
+    return cache.version
+
+
+class ResultCache:
+    """Ограниченный LRU-кэш результатов поиска и отчетов статистики.
+
+    В ключ входит версия данных, поэтому после записи старые результаты
+    больше не находятся и со временем вытесняются.
+    """
+
+    def __init__(self, max_size=RESULT_CACHE_SIZE):
+        self.max_size = max_size
+        self.entries = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        """Результат по ключу или None"""
+        with self._lock:
+            if key in self.entries:
+                self.entries.move_to_end(key)
+                self.hits += 1
+                result = self.entries[key]
+            else:
+                self.misses += 1
+                result = None
+            logging.info(f"Кэш результатов: {'попадание' if result is not None else 'промах'} "
+                         f"{key[0]} (попаданий {self.hits}, промахов {self.misses})")
+            return result
+
+    def put(self, key, result):
+        with self._lock:
+            self.entries[key] = result
+            self.entries.move_to_end(key)
+            while len(self.entries) > self.max_size:
+                self.entries.popitem(last=False)
+
+    def clear(self):
+        with self._lock:
+            self.entries.clear()
+
+
+_result_cache = ResultCache()
+
+
+def get_result_cache():
+    return _result_cache
+
+
+def result_key(kind, search_text, filters, version):
+    """Ключ кэша результатов: вид запроса, текст, фильтры и версия данных"""
+    return (kind, search_text.lower(), filters.get('date_from'), filters.get('date_to'),
+            filters.get('casting'), filters.get('temp_from'), filters.get('temp_to'), version)
@@ -0,0 +1,569 @@
+import os
+import json
+import math
+import base64
+import hashlib
+import logging
+import threading
+from datetime import date
+from plavka_storage import (EXCEL_FILENAME, sidecar_path, date_ordinal, record_key, get_record_cache,
+                            tuple_signature)
+from plavka_schema import PARTICIPANT_COLUMNS, category_key
+
+# Служебные файлы индексов рядом с файлом данных
+PLAVKA_NUMBERS_SUFFIX = '.numbers.json'
+ID_INDEX_SUFFIX = '.ids.json'
+ROW_INDEX_SUFFIX = '.rows.json'
+TRIGRAM_INDEX_SUFFIX = '.trigrams.json'
+PARTICIPANT_INDEX_SUFFIX = '.participants.json'
+
+# Фильтр Блума перед множеством ID и его доля ложных срабатываний
+ID_BLOOM_FILTER = True
+BLOOM_FALSE_POSITIVE_RATE = 0.01
+BLOOM_MIN_CAPACITY = 1024
+
+
+class PersistentIndex:
+    """Индекс по записям, сохраняемый в файл рядом с данными.
+
+    В файле вместе с индексом хранится отпечаток хранилища, по которому он
+    построен. Снимок пишется целиком только при обслуживании хранилища и
+    при выходе; изменения после снимка кэш записей дописывает в общий
+    журнал индексов и применяет при загрузке. Если снимок не удается
+    довести до текущего отпечатка или файла нет, индекс перестраивается
+    по записям кэша.
+
+    lock - блокировка, под которой индекс изменяется; кэш записей
+    подставляет свою, поэтому чтение под lock не пересекается с фоновой
+    записью.
+    """
+
+    suffix = None
+    format_version = 1
+
+    def __init__(self, file_name=EXCEL_FILENAME):
+        self.path = sidecar_path(file_name, self.suffix)
+        self.signature = None
+        # Отпечаток, с которым индекс последний раз записан в файл
+        self.saved_signature = None
+        self.lock = threading.RLock()
+
+    def clear(self):
+        raise NotImplementedError
+
+    def rebuild(self, rows):
+        """Строит индекс заново по всем записям"""
+        self.clear()
+        for position, row in enumerate(rows):
+            self.on_insert(position, row)
+
+    def on_insert(self, position, row):
+        raise NotImplementedError
+
+    def on_update(self, position, old_row, new_row):
+        raise NotImplementedError
+
+    def to_state(self):
+        raise NotImplementedError
+
+    def from_state(self, state):
+        raise NotImplementedError
+
+    def load(self):
+        """Загружает снимок индекса из файла вместе с его отпечатком"""
+        try:
+            if not os.path.exists(self.path):
+                return False
+            with open(self.path, 'r', encoding='utf-8') as index_file:
+                data = json.load(index_file)
+            if data.get('version') != self.format_version:
+                return False
+            self.from_state(data['state'])
+            self.signature = self.saved_signature = tuple_signature(data.get('signature'))
+            return True
+        except Exception as e:
+            logging.error(f"Ошибка при чтении индекса {self.path}: {str(e)}")
+            return False
+
+    def snapshot(self):
+        """Снимок состояния для записи в файл; вызывается под self.lock"""
+        return {
+            'version': self.format_version,
+            'signature': self.signature,
+            'state': self.to_state(),
+        }
+
+    def write(self, data):
+        """Записывает снимок в файл, возвращает True при успехе"""
+        try:
+            tmp_path = self.path + '.tmp'
+            with open(tmp_path, 'w', encoding='utf-8') as index_file:
+                json.dump(data, index_file, ensure_ascii=False)
+            os.replace(tmp_path, self.path)
+            return True
+        except Exception as e:
+            logging.error(f"Ошибка при сохранении индекса {self.path}: {str(e)}")
+            return False
+
+    def save(self, signature):
+        """Сохраняет индекс вместе с отпечатком хранилища"""
+        with self.lock:
+            self.signature = signature
+            data = self.snapshot()
+        if self.write(data):
+            self.saved_signature = signature
+
+
+def parse_plavka_number(value):
+    """Разбирает номер плавки 'M-NNN' на (месяц, номер) или None"""
+    try:
+        if isinstance(value, str) and '-' in value:
+            month, number = value.split('-')
+            return int(month), int(number)
+    except (ValueError, TypeError):
+        pass
+    return None
+
+
+class PlavkaNumberIndex(PersistentIndex):
+    """Счетчики номеров плавок по (год, месяц) для выдачи следующего номера"""
+
+    suffix = PLAVKA_NUMBERS_SUFFIX
+
+    def __init__(self, file_name=EXCEL_FILENAME):
+        super().__init__(file_name)
+        # 'ГГГГ-ММ' -> {номер: количество записей с этим номером}
+        self.numbers = {}
+
+    def clear(self):
+        self.numbers = {}
+
+    def _entry(self, row):
+        ordinal = date_ordinal(row[2])
+        parsed = parse_plavka_number(row[3])
+        if ordinal is None or parsed is None:
+            return None
+        day = date.fromordinal(ordinal)
+        month, number = parsed
+        # Учитываются только номера, месяц которых совпадает с датой плавки
+        if month != day.month:
+            return None
+        return f"{day.year}-{day.month:02d}", number
+
+    def _add(self, entry, delta):
+        if entry is None:
+            return
+        key, number = entry
+        counts = self.numbers.setdefault(key, {})
+        counts[number] = counts.get(number, 0) + delta
+        if counts[number] <= 0:
+            del counts[number]
+        if not counts:
+            del self.numbers[key]
+
+    def on_insert(self, position, row):
+        self._add(self._entry(row), 1)
+
+    def on_update(self, position, old_row, new_row):
+        self._add(self._entry(old_row), -1)
+        self._add(self._entry(new_row), 1)
+
+    def next_number(self, year, month):
+        """Следующий свободный номер плавки в месяце"""
+        # Счетчики может менять поток фонового сохранения
+        with self.lock:
+            counts = list(self.numbers.get(f"{year}-{month:02d}", ()))
+        return max(counts) + 1 if counts else 1
+
+    def to_state(self):
+        return {key: {str(number): count for number, count in counts.items()}
+                for key, counts in self.numbers.items()}
+
+    def from_state(self, state):
+        self.numbers = {key: {int(number): count for number, count in counts.items()}
+                        for key, counts in state.items()}
+
+
+class BloomFilter:
+    """Фильтр Блума: отвечает "точно нет" или "возможно есть" """
+
+    def __init__(self, capacity, error_rate=BLOOM_FALSE_POSITIVE_RATE):
+        self.capacity = max(int(capacity), 1)
+        self.error_rate = error_rate
+        self.size = max(8, int(-self.capacity * math.log(error_rate) / (math.log(2) ** 2)))
+        self.hashes = max(1, round(self.size / self.capacity * math.log(2)))
+        self.bits = bytearray((self.size + 7) // 8)
+        self.count = 0
+
+    def _positions(self, key):
+        # Двойное хеширование; blake2b дает одинаковый результат во всех процессах
+        digest = hashlib.blake2b(key.encode('utf-8'), digest_size=16).digest()
+        first = int.from_bytes(digest[:8], 'little')
+        second = int.from_bytes(digest[8:], 'little') | 1
+        return [(first + i * second) % self.size for i in range(self.hashes)]
+
+    def add(self, key):
+        for position in self._positions(key):
+            self.bits[position >> 3] |= 1 << (position & 7)
+        self.count += 1
+
+    def __contains__(self, key):
+        return all(self.bits[position >> 3] & (1 << (position & 7))
+                   for position in self._positions(key))
+
+    def to_state(self):
+        return {
+            'capacity': self.capacity,
+            'error_rate': self.error_rate,
+            'count': self.count,
+            'bits': base64.b64encode(bytes(self.bits)).decode('ascii'),
+        }
+
+    @classmethod
+    def from_state(cls, state):
+        bloom = cls(state['capacity'], state['error_rate'])
+        bloom.bits = bytearray(base64.b64decode(state['bits']))
+        bloom.count = state['count']
+        return bloom
+
+
+class IdIndex(PersistentIndex):
+    """Множество ID записей для проверки дубликатов за O(1)"""
+
+    suffix = ID_INDEX_SUFFIX
+
+    def __init__(self, file_name=EXCEL_FILENAME):
+        super().__init__(file_name)
+        self.ids = set()
+        self.bloom = None
+
+    def clear(self):
+        self.ids = set()
+        self.bloom = None
+
+    def rebuild(self, rows):
+        super().rebuild(rows)
+        self._rebuild_bloom()
+
+    def _rebuild_bloom(self):
+        if not ID_BLOOM_FILTER:
+            self.bloom = None
+            return
+        self.bloom = BloomFilter(max(BLOOM_MIN_CAPACITY, len(self.ids) * 2))
+        for key in self.ids:
+            self.bloom.add(key)
+
+    def _add(self, key):
+        if not key or key in self.ids:
+            return
+        self.ids.add(key)
+        if self.bloom is not None:
+            if self.bloom.count >= self.bloom.capacity:
+                # Фильтр заполнен - ложных срабатываний станет слишком много
+                self._rebuild_bloom()
+            else:
+                self.bloom.add(key)
+
+    def on_insert(self, position, row):
+        self._add(record_key(row[0]))
+
+    def on_update(self, position, old_row, new_row):
+        old_key, new_key = record_key(old_row[0]), record_key(new_row[0])
+        if old_key != new_key:
+            # Из фильтра Блума удалить нельзя - он лишь пропустит запрос к множеству
+            self.ids.discard(old_key)
+            self._add(new_key)
+
+    def contains(self, record_id):
+        key = record_key(record_id)
+        if self.bloom is not None and key not in self.bloom:
+            return False
+        return key in self.ids
+
+    def contains_many(self, ids):
+        """Проверка списка ID, например при пакетном импорте"""
+        return [self.contains(record_id) for record_id in ids]
+
+    def to_state(self):
+        return {
+            'ids': list(self.ids),
+            'bloom': self.bloom.to_state() if self.bloom is not None else None,
+        }
+
+    def from_state(self, state):
+        self.ids = set(state['ids'])
+        if ID_BLOOM_FILTER and state.get('bloom'):
+            self.bloom = BloomFilter.from_state(state['bloom'])
+        else:
+            self._rebuild_bloom()
+
+
+class RowIndex(PersistentIndex):
+    """Номер строки листа Records для каждого ID"""
+
+    suffix = ROW_INDEX_SUFFIX
+
+    def __init__(self, file_name=EXCEL_FILENAME):
+        super().__init__(file_name)
+        self.rows = {}
+
+    def clear(self):
+        self.rows = {}
+
+    def on_insert(self, position, row):
+        # Первая строка листа - заголовки
+        self.rows.setdefault(record_key(row[0]), position + 2)
+
+    def on_update(self, position, old_row, new_row):
+        old_key, new_key = record_key(old_row[0]), record_key(new_row[0])
+        if old_key != new_key:
+            self.rows.pop(old_key, None)
+            self.rows[new_key] = position + 2
+
+    def row_number(self, record_id):
+        return self.rows.get(record_key(record_id))
+
+    def to_state(self):
+        # Снимок пишется в файл уже без блокировки - отдаем копию
+        return dict(self.rows)
+
+    def from_state(self, state):
+        self.rows = dict(state)
+
+
+def row_text_values(row):
+    """Текст ячеек записи в нижнем регистре, как его ищет поле поиска"""
+    return [str(cell).lower() for cell in row if cell]
+
+
+def trigrams(text):
+    return {text[i:i + 3] for i in range(len(text) - 2)}
+
+
+class TrigramIndex(PersistentIndex):
+    """Инвертированный индекс триграмм текста всех ячеек записи.
+
+    Для подстроки из трех и более символов кандидаты - пересечение списков
+    записей по её триграммам; совпадение затем проверяется только у них.
+    """
+
+    suffix = TRIGRAM_INDEX_SUFFIX
+
+    def __init__(self, file_name=EXCEL_FILENAME):
+        super().__init__(file_name)
+        # триграмма -> множество позиций записей в кэше
+        self.postings = {}
+
+    def clear(self):
+        self.postings = {}
+
+    @staticmethod
+    def _row_trigrams(row):
+        result = set()
+        for text in row_text_values(row):
+            result |= trigrams(text)
+        return result
+
+    def on_insert(self, position, row):
+        for trigram in self._row_trigrams(row):
+            self.postings.setdefault(trigram, set()).add(position)
+
+    def on_update(self, position, old_row, new_row):
+        old, new = self._row_trigrams(old_row), self._row_trigrams(new_row)
+        for trigram in old - new:
+            positions = self.postings.get(trigram)
+            if positions is not None:
+                positions.discard(position)
+                if not positions:
+                    del self.postings[trigram]
+        for trigram in new - old:
+            self.postings.setdefault(trigram, set()).add(position)
+
+    def candidates(self, text):
+        """Позиции записей, которые могут содержать text, или None для коротких строк"""
+        query = trigrams(text.lower())
+        if not query:
+            return None
+        with self.lock:
+            # Начинаем с самого короткого списка
+            lists = sorted((self.postings.get(trigram, set()) for trigram in query), key=len)
+            result = set(lists[0])
+            for positions in lists[1:]:
+                result &= positions
+                if not result:
+                    break
+            return result
+
+    def to_state(self):
+        return {trigram: list(positions) for trigram, positions in self.postings.items()}
+
+    def from_state(self, state):
+        self.postings = {trigram: set(positions) for trigram, positions in state.items()}
+
+
+def bitmap_from_positions(positions):
+    """Битовая карта (целое число) с установленными битами позиций"""
+    positions = list(positions)
+    if not positions:
+        return 0
+    bits = bytearray(max(positions) // 8 + 1)
+    for position in positions:
+        bits[position >> 3] |= 1 << (position & 7)
+    return int.from_bytes(bits, 'little')
+
+
+def _encode_bitmap(bitmap):
+    return base64.b64encode(bitmap.to_bytes((bitmap.bit_length() + 7) // 8, 'little')).decode('ascii')
+
+
+def _decode_bitmap(text):
+    return int.from_bytes(base64.b64decode(text), 'little')
+
+
+class ParticipantIndex(PersistentIndex):
+    """Инвертированный индекс участников смены по всем пяти ролям.
+
+    Для каждого участника хранится битовая карта позиций записей, в
+    которых он был в смене в любой роли; имена сравниваются без учета
+    регистра. Составы смен ищутся пересечением (AND) и объединением
+    (OR) карт, число записей - подсчетом битов.
+    """
+
+    suffix = PARTICIPANT_INDEX_SUFFIX
+
+    def __init__(self, file_name=EXCEL_FILENAME):
+        super().__init__(file_name)
+        # ключ участника -> битовая карта позиций записей
+        self.bitmaps = {}
+        # ключ участника -> имя в том виде, как оно встретилось первым
+        self.names = {}
+
+    def clear(self):
+        self.bitmaps = {}
+        self.names = {}
+
+    def _row_keys(self, row):
+        keys = set()
+        for column in PARTICIPANT_COLUMNS:
+            key = category_key(row[column])
+            if key:
+                keys.add(key)
+                self.names.setdefault(key, str(row[column]).strip())
+        return keys
+
+    def rebuild(self, rows):
+        # Карты собираются из списков позиций за один проход, а не по биту на запись
+        self.clear()
+        positions = {}
+        for position, row in enumerate(rows):
+            for key in self._row_keys(row):
+                positions.setdefault(key, []).append(position)
+        self.bitmaps = {key: bitmap_from_positions(items) for key, items in positions.items()}
+
+    def on_insert(self, position, row):
+        for key in self._row_keys(row):
+            self.bitmaps[key] = self.bitmaps.get(key, 0) | (1 << position)
+
+    def on_update(self, position, old_row, new_row):
+        old, new = self._row_keys(old_row), self._row_keys(new_row)
+        bit = 1 << position
+        for key in old - new:
+            bitmap = self.bitmaps.get(key, 0) & ~bit
+            if bitmap:
+                self.bitmaps[key] = bitmap
+            else:
+                self.bitmaps.pop(key, None)
+                self.names.pop(key, None)
+        for key in new - old:
+            self.bitmaps[key] = self.bitmaps.get(key, 0) | bit
+
+    def bitmap(self, name):
+        """Записи, где участник был в смене в любой роли"""
+        return self.bitmaps.get(category_key(name), 0)
+
+    def crew(self, all_of=(), any_of=(), within=None):
+        """Записи, где в смене были все из all_of и хотя бы один из any_of.
+
+        within - битовая карта, которой ограничивается результат, например
+        записи диапазона дат. Без условий возвращаются все записи с
+        участниками.
+        """
+        result = within
+        for name in all_of:
+            bitmap = self.bitmap(name)
+            result = bitmap if result is None else result & bitmap
+            if not result:
+                return 0
+        if any_of:
+            union = 0
+            for name in any_of:
+                union |= self.bitmap(name)
+            result = union if result is None else result & union
+        if result is None:
+            result = 0
+            with self.lock:
+                bitmaps = list(self.bitmaps.values())
+            for bitmap in bitmaps:
+                result |= bitmap
+        return result
+
+    def counts(self, within=None):
+        """Число записей каждого участника: {имя: количество}, по убыванию"""
+        # Снимок карт: их меняет поток фонового сохранения
+        with self.lock:
+            bitmaps = list(self.bitmaps.items())
+            names = dict(self.names)
+        result = {}
+        for key, bitmap in bitmaps:
+            count = (bitmap & within if within is not None else bitmap).bit_count()
+            if count:
+                result[names.get(key, key)] = count
+        return dict(sorted(result.items(), key=lambda item: (-item[1], item[0])))
+
+    def to_state(self):
+        return {key: [self.names.get(key, key), _encode_bitmap(bitmap)]
+                for key, bitmap in self.bitmaps.items()}
+
+    def from_state(self, state):
+        self.names = {key: name for key, (name, _) in state.items()}
+        self.bitmaps = {key: _decode_bitmap(bitmap) for key, (_, bitmap) in state.items()}
+
+
+def get_index(index_class):
+    """Актуальный индекс заданного класса, подключенный к общему кэшу"""
+    cache = get_record_cache()
+    index = cache.find_index(index_class)
+    if index is None:
+        index = cache.add_index(index_class(cache.store.file_name))
+    return cache.ensure_index(index)
+
+
+def get_plavka_number_index():
+    return get_index(PlavkaNumberIndex)
+
+
+def get_id_index():
+    return get_index(IdIndex)
+
+
+def get_trigram_index():
+    return get_index(TrigramIndex)
+
+
+def get_participant_index():
+    return get_index(ParticipantIndex)
+
+
+def get_row_index():
+    """Индекс строк, подключенный к хранилищу для чтения и правки по ID"""
+    index = get_index(RowIndex)
+    store = get_record_cache().store
+
+    def locate(record_id):
+        # Устаревшему индексу не доверяем - хранилище просмотрит лист целиком
+        if index.signature != store.signature():
+            return None
+        return index.row_number(record_id)
+
+    store.row_locator = locate
+    return index
@@ -0,0 +1,521 @@
+import re
+import time
+from datetime import date, datetime, timedelta
+import numpy as np
+from plavka_storage import HEADERS
+from plavka_schema import category_key
+from plavka_index import row_text_values, trigrams
+from plavka_analytics import SECTORS, MISSING_DATE, bitmap_mask
+
+# Сколько записей выдавать за одну страницу результатов
+PAGE_SIZE = 200
+
+# Текстовые поля запроса вида поле:текст -> столбец листа
+TEXT_FIELDS = {
+    'id': HEADERS.index("ID"),
+    'учетный': HEADERS.index("Учетный_номер"),
+    'номер': HEADERS.index("Номер_плавки"),
+    'кластер': HEADERS.index("Номер_кластера"),
+    'коммент': HEADERS.index("Комментарий"),
+    'комментарий': HEADERS.index("Комментарий"),
+}
+# Поля с точным совпадением по словарю значений
+CATEGORY_FIELDS = {
+    'отливка': 'castings',
+    'тип': 'experiments',
+}
+# Участники смены: поле -> номер столбца в матрице участников или None для любого.
+# Несколько имен через | - любой из них; поле можно повторить - все вместе
+PARTICIPANT_FIELDS = {
+    'старший': 0,
+    'участник': None,
+}
+# Русские буквы секторов, которые легко спутать с латинскими
+SECTOR_LETTERS = {'А': 'A', 'В': 'B', 'С': 'C', 'Д': 'D'}
+
+_TOKEN_RE = re.compile(r'(?:[^\s"]+:)?"[^"]*"|\S+')
+_TEMPERATURE_RE = re.compile(r'^темп(?:\.(\w))?(>=|<=|>|<|=|:)(.+)$', re.IGNORECASE)
+
+
+class QuerySyntaxError(ValueError):
+    """Ошибка в тексте запроса"""
+
+
+def _unquote(value):
+    if len(value) >= 2 and value.startswith('"') and value.endswith('"'):
+        return value[1:-1]
+    return value
+
+
+def parse_date_bound(text, end=False):
+    """Порядковый номер первого (или последнего при end) дня периода.
+
+    Поддерживаются ГГГГ, ГГГГ-ММ, ГГГГ-ММ-ДД, ММ.ГГГГ и ДД.ММ.ГГГГ.
+    """
+    text = text.strip()
+    for pattern, unit in (("%Y-%m-%d", 'day'), ("%d.%m.%Y", 'day'), ("%Y-%m", 'month'),
+                          ("%m.%Y", 'month'), ("%Y", 'year')):
+        try:
+            start = datetime.strptime(text, pattern).date()
+        except ValueError:
+            continue
+        if not end or unit == 'day':
+            return start.toordinal()
+        if unit == 'month':
+            following = date(start.year + start.month // 12, start.month % 12 + 1, 1)
+        else:
+            following = date(start.year + 1, 1, 1)
+        return (following - timedelta(days=1)).toordinal()
+    raise QuerySyntaxError(f"Неверная дата: {text}")
+
+
+class Predicate:
+    """Условие запроса.
+
+    Индексируемые условия умеют оценить число подходящих записей и
+    выдать их позиции; остальные применяются векторно к позициям,
+    выбранным планировщиком, или проверяются по тексту записи.
+    """
+
+    indexed = False
+    vectorized = True
+
+    def estimate(self, context):
+        return None
+
+    def positions(self, context):
+        raise NotImplementedError
+
+    def mask(self, context, positions):
+        raise NotImplementedError
+
+    def matches(self, row):
+        return True
+
+
+class DateRange(Predicate):
+    indexed = True
+
+    def __init__(self, date_from=None, date_to=None):
+        self.date_from = date_from
+        self.date_to = date_to
+
+    def __str__(self):
+        def text(ordinal):
+            return date.fromordinal(ordinal).strftime("%d.%m.%Y") if ordinal is not None else "…"
+        return f"дата {text(self.date_from)}..{text(self.date_to)}"
+
+    def estimate(self, context):
+        return len(self.positions(context))
+
+    def positions(self, context):
+        return context.columns.date_range_positions(self.date_from, self.date_to)
+
+    def mask(self, context, positions):
+        dates = context.columns.dates[positions]
+        result = dates != MISSING_DATE
+        if self.date_from is not None:
+            result &= dates >= self.date_from
+        if self.date_to is not None:
+            result &= dates <= self.date_to
+        return result
+
+
+class CategoryEquals(Predicate):
+    """Совпадение значения по category_key - без учета регистра и пробелов
+    по краям (отливка, тип, участник); значения через | - любое из них"""
+
+    indexed = True
+
+    def __init__(self, label, kind, value):
+        self.label = label
+        self.kind = kind
+        self.value = value
+        self.values = {category_key(item) for item in value.split('|') if item.strip()}
+
+    def __str__(self):
+        return f"{self.label} = {' или '.join(item.strip() for item in self.value.split('|') if item.strip())}"
+
+    def _names(self, columns):
+        kind = self.kind.split(':')[0]
+        return {'castings': columns.casting_names, 'experiments': columns.experiment_names,
+                'participants': columns.participant_names}[kind]
+
+    def codes(self, columns):
+        return [code for code, name in enumerate(self._names(columns)) if category_key(name) in self.values]
+
+    def estimate(self, context):
+        return len(self.positions(context))
+
+    def positions(self, context):
+        codes = self.codes(context.columns)
+        if not codes:
+            return np.zeros(0, dtype=np.int64)
+        return context.columns.code_positions(self.kind, codes)
+
+    def mask(self, context, positions):
+        return np.isin(positions, self.positions(context), assume_unique=True)
+
+
+class CrewMember(CategoryEquals):
+    """Участник смены в любой роли; записи берутся из индекса участников"""
+
+    def __init__(self, label, value):
+        super().__init__(label, 'participants', value)
+
+    def _bitmap(self, context):
+        if not self.values:
+            return 0
+        return context.participant_index.crew(any_of=self.values)
+
+    def estimate(self, context):
+        if context.participant_index is None:
+            return super().estimate(context)
+        return self._bitmap(context).bit_count()
+
+    def positions(self, context):
+        if context.participant_index is None:
+            return super().positions(context)
+        # Записи, добавленные после снимка столбцов, отбрасываются
+        return np.flatnonzero(bitmap_mask(self._bitmap(context), len(context.columns)))
+
+
+class TemperatureRange(Predicate):
+    """Температура сектора (или любого сектора) в диапазоне"""
+
+    def __init__(self, sector, low=None, high=None, low_inclusive=True, high_inclusive=True):
+        self.sector = sector
+        self.low = low
+        self.high = high
+        self.low_inclusive = low_inclusive
+        self.high_inclusive = high_inclusive
+
+    def __str__(self):
+        target = f"темп.{self.sector}" if self.sector else "темп.любой"
+        parts = []
+        if self.low is not None:
+            parts.append(f"{'>=' if self.low_inclusive else '>'} {self.low:g}")
+        if self.high is not None:
+            parts.append(f"{'<=' if self.high_inclusive else '<'} {self.high:g}")
+        return f"{target} {' и '.join(parts)}"
+
+    def mask(self, context, positions):
+        temperatures = context.columns.temperatures[positions]
+        if self.sector:
+            temperatures = temperatures[:, SECTORS.index(self.sector)]
+        # Сравнение с NaN дает False - пустые сектора не подходят
+        result = np.ones(temperatures.shape, dtype=bool)
+        if self.low is not None:
+            result &= temperatures >= self.low if self.low_inclusive else temperatures > self.low
+        if self.high is not None:
+            result &= temperatures <= self.high if self.high_inclusive else temperatures < self.high
+        return result if result.ndim == 1 else result.any(axis=1)
+
+
+class TextContains(Predicate):
+    """Подстрока в тексте столбца или любой ячейки записи"""
+
+    indexed = True
+    vectorized = False
+
+    def __init__(self, text, column=None, label=None):
+        self.text = text.lower()
+        self.column = column
+        self.label = label
+
+    def __str__(self):
+        target = self.label or "любое поле"
+        return f'{target} содержит "{self.text}"'
+
+    def estimate(self, context):
+        # Оценка - самый короткий список триграммы; без триграмм индекс не помогает
+        query = trigrams(self.text)
+        if not query or context.trigram_index is None:
+            return None
+        return min(len(context.trigram_index.postings.get(trigram, ())) for trigram in query)
+
+    def positions(self, context):
+        candidates = context.trigram_index.candidates(self.text)
+        return np.array(sorted(p for p in candidates if p < len(context.columns)), dtype=np.int64)
+
+    def matches(self, row):
+        if self.column is None:
+            return any(self.text in text for text in row_text_values(row))
+        value = row[self.column]
+        return bool(value) and self.text in str(value).lower()
+
+
+def parse_query(text):
+    """Разбирает строку запроса в список условий.
+
+    Слова без поля ищутся в любой ячейке записи, как раньше в поле поиска.
+    """
+    predicates = []
+    words = []
+    for token in _TOKEN_RE.findall(text):
+        temperature = _TEMPERATURE_RE.match(token)
+        if temperature:
+            predicates.append(_parse_temperature(*temperature.groups()))
+            continue
+        if ':' not in token or token.startswith('"'):
+            words.append(_unquote(token))
+            continue
+        field, value = token.split(':', 1)
+        field = field.lower()
+        value = _unquote(value)
+        if field != 'дата' and field not in CATEGORY_FIELDS and field not in PARTICIPANT_FIELDS \
+           and field not in TEXT_FIELDS:
+            # Неизвестное поле - обычный текст, например время 10:30
+            words.append(token)
+            continue
+        if not value:
+            raise QuerySyntaxError(f"Пустое значение поля {field}")
+        if field == 'дата':
+            if '..' in value:
+                low, high = value.split('..', 1)
+                predicates.append(DateRange(parse_date_bound(low) if low else None,
+                                            parse_date_bound(high, end=True) if high else None))
+            else:
+                predicates.append(DateRange(parse_date_bound(value), parse_date_bound(value, end=True)))
+        elif field in CATEGORY_FIELDS:
+            predicates.append(CategoryEquals(field, CATEGORY_FIELDS[field], value))
+        elif field in PARTICIPANT_FIELDS:
+            index = PARTICIPANT_FIELDS[field]
+            if index is None:
+                predicates.append(CrewMember(field, value))
+            else:
+                predicates.append(CategoryEquals(field, f'participants:{index}', value))
+        else:
+            predicates.append(TextContains(value, TEXT_FIELDS[field], field))
+    if words or not predicates:
+        predicates.append(TextContains(' '.join(words)))
+    return predicates
+
+
+def is_plain_text(text):
+    """Запрос без полей и условий - только текст для поиска в любой ячейке"""
+    try:
+        predicates = parse_query(text)
+    except QuerySyntaxError:
+        return False
+    return len(predicates) == 1 and isinstance(predicates[0], TextContains) and \
+        predicates[0].column is None
+
+
+def _parse_temperature(sector, operator, value):
+    if sector:
+        sector = SECTOR_LETTERS.get(sector.upper(), sector.upper())
+        if sector not in SECTORS:
+            raise QuerySyntaxError(f"Неизвестный сектор: {sector}")
+    try:
+        if operator == ':':
+            if '..' not in value:
+                number = float(value)
+                return TemperatureRange(sector, number, number)
+            low, high = value.split('..', 1)
+            return TemperatureRange(sector, float(low) if low else None, float(high) if high else None)
+        number = float(value)
+    except ValueError:
+        raise QuerySyntaxError(f"Неверная температура: {value}")
+    if operator == '=':
+        return TemperatureRange(sector, number, number)
+    if operator in ('>', '>='):
+        return TemperatureRange(sector, low=number, low_inclusive=operator == '>=')
+    return TemperatureRange(sector, high=number, high_inclusive=operator == '<=')
+
+
+def filter_predicates(date_from=None, date_to=None, casting=None, temp_from=None, temp_to=None):
+    """Условия для фильтров диалога поиска"""
+    predicates = []
+    if date_from is not None or date_to is not None:
+        predicates.append(DateRange(date_from, date_to))
+    if casting is not None:
+        predicates.append(CategoryEquals('отливка', 'castings', casting))
+    if temp_from is not None and temp_to is not None:
+        predicates.append(TemperatureRange(None, temp_from, temp_to))
+    return predicates
+
+
+class QueryContext:
+    def __init__(self, columns, trigram_index=None, participant_index=None):
+        self.columns = columns
+        self.trigram_index = trigram_index
+        self.participant_index = participant_index
+
+
+class QueryPlan:
+    """План выполнения: путь доступа, векторные условия и проверки текста"""
+
+    def __init__(self, context, predicates, base=None):
+        self.context = context
+        self.predicates = predicates
+        self.base = base
+        self.access = None
+        self.estimates = []
+        for predicate in predicates:
+            if predicate.indexed:
+                estimate = predicate.estimate(context)
+                if estimate is not None:
+                    self.estimates.append((estimate, predicate))
+        if self.estimates:
+            # Самый избирательный индекс; при равенстве - первый по порядку
+            best = min(self.estimates, key=lambda item: item[0])
+            if base is None or best[0] < len(base):
+                self.access = best[1]
+        self.vector = [p for p in predicates if p.vectorized and p is not self.access]
+        self.checks = [p for p in predicates if not p.vectorized]
+        self.examined = 0
+        self.selected = 0
+
+    def positions(self):
+        """Позиции кандидатов в порядке дат после индекса и векторных условий"""
+        columns = self.context.columns
+        if self.access is not None:
+            positions = self.access.positions(self.context)
+            if self.base is not None:
+                positions = positions[np.isin(positions, self.base)]
+        elif self.base is not None:
+            positions = np.sort(np.asarray(self.base, dtype=np.int64))
+        else:
+            positions = np.arange(len(columns), dtype=np.int64)
+        self.examined = len(positions)
+        for predicate in self.vector:
+            if not len(positions):
+                break
+            positions = positions[predicate.mask(self.context, positions)]
+        self.selected = len(positions)
+        # Устойчивая сортировка по дате сохраняет порядок date_order
+        keys = np.where(columns.dates[positions] == MISSING_DATE, np.iinfo(np.int64).max,
+                        columns.dates[positions])
+        return positions[np.argsort(keys, kind='stable')]
+
+    def cursor(self, page_size=PAGE_SIZE, verified=False):
+        return SearchCursor(self.context.columns, self.positions(),
+                            [] if verified else self.checks, page_size)
+
+    def explain(self, matched=None, elapsed=None):
+        """Текстовое описание плана для окна EXPLAIN"""
+        lines = []
+        if self.access is not None:
+            kind = "индекс триграмм" if isinstance(self.access, TextContains) else \
+                "индекс дат" if isinstance(self.access, DateRange) else \
+                "индекс участников" if isinstance(self.access, CrewMember) and \
+                self.context.participant_index is not None else "словарный индекс"
+            lines.append(f"Доступ: {kind} по условию «{self.access}»")
+        elif self.base is not None:
+            lines.append("Доступ: результаты предыдущего запроса")
+        else:
+            lines.append("Доступ: полный просмотр")
+        for estimate, predicate in self.estimates:
+            mark = " (выбран)" if predicate is self.access else ""
+            lines.append(f"  оценка «{predicate}»: {estimate} строк{mark}")
+        if self.vector:
+            lines.append("Векторные условия: " + "; ".join(str(p) for p in self.vector))
+        if self.checks:
+            lines.append("Проверка текста: " + "; ".join(str(p) for p in self.checks))
+        lines.append(f"Строк из пути доступа: {self.examined}")
+        lines.append(f"После векторных условий: {self.selected}")
+        if matched is not None:
+            lines.append(f"Найдено: {matched}")
+        if elapsed is not None:
+            lines.append(f"Время: {elapsed * 1000:.1f} мс")
+        return "\n".join(lines)
+
+
+def plan_query(text, columns, trigram_index=None, filters=None, base=None, participant_index=None):
+    """Разбирает запрос, добавляет фильтры диалога и строит план"""
+    predicates = filter_predicates(**(filters or {})) + parse_query(text)
+    return QueryPlan(QueryContext(columns, trigram_index, participant_index), predicates, base)
+
+
+def explain_query(text, columns, trigram_index=None, filters=None, participant_index=None):
+    """Выполняет запрос целиком и возвращает описание плана с замерами"""
+    start = time.perf_counter()
+    plan = plan_query(text, columns, trigram_index, filters, participant_index=participant_index)
+    matched = plan.cursor().count()
+    return plan.explain(len(matched), time.perf_counter() - start)
+
+
+class SearchCursor:
+    """Ленивый курсор по найденным записям в порядке дат.
+
+    Позиции кандидатов уже отобраны индексом и векторными условиями, а
+    проверка текста выполняется только для записей очередной страницы.
+    Поэтому первая страница готова за время, не зависящее от общего
+    числа совпадений.
+    """
+
+    def __init__(self, columns, positions, checks=(), page_size=PAGE_SIZE):
+        self.columns = columns
+        self.positions = positions
+        self.checks = list(checks)
+        self.page_size = page_size
+        self.offset = 0
+        self.matched = []
+
+    @property
+    def exhausted(self):
+        return self.offset >= len(self.positions)
+
+    def matches(self, position):
+        """Проверка текстовых условий для записи"""
+        row = self.columns.rows[position]
+        return all(check.matches(row) for check in self.checks)
+
+    def fetch(self, limit=None, cancelled=None):
+        """Следующая страница позиций найденных записей.
+
+        cancelled - событие отмены; при отмене возвращается уже найденная
+        часть страницы.
+        """
+        limit = limit or self.page_size
+        page = []
+        while len(page) < limit and self.offset < len(self.positions):
+            if cancelled is not None and cancelled.is_set():
+                break
+            position = int(self.positions[self.offset])
+            self.offset += 1
+            if self.matches(position):
+                page.append(position)
+        self.matched.extend(page)
+        return page
+
+    def fetch_all(self):
+        """Все оставшиеся найденные позиции"""
+        result = []
+        while not self.exhausted:
+            result.extend(self.fetch())
+        return result
+
+    def pages(self):
+        """Генератор страниц найденных записей"""
+        while not self.exhausted:
+            page = self.fetch()
+            if page:
+                yield [self.columns.rows[position] for position in page]
+
+    def id_pages(self):
+        """Генератор страниц ID найденных записей"""
+        for page in self.pages():
+            yield [row[0] for row in page]
+
+    def estimate(self):
+        """Верхняя оценка числа совпадений без проверки текста"""
+        return len(self.positions)
+
+    def count(self, cancelled=None):
+        """Все найденные позиции без сдвига курсора.
+
+        Проверяет весь список кандидатов независимо от выданных страниц,
+        поэтому может выполняться в фоновом потоке. cancelled - событие
+        отмены; при отмене возвращается None.
+        """
+        if not self.checks:
+            return [int(position) for position in self.positions]
+        matched = []
+        for position in self.positions:
+            if cancelled is not None and cancelled.is_set():
+                return None
+            if self.matches(position):
+                matched.append(int(position))
+        return matched
@@ -0,0 +1,185 @@
+import os
+import json
+import logging
+import threading
+import numpy as np
+from plavka_schema import HEADERS, CASTING_COLUMN, EXPERIMENT_COLUMN, PARTICIPANT_COLUMNS, category_key
+from plavka_storage import sidecar_path, get_record_cache
+
+# Таблица кодов категориальных столбцов рядом с файлом данных
+CODE_TABLE_SUFFIX = '.codes.json'
+CODE_TABLE_VERSION = 3
+
+# Категории таблицы кодов и их столбцы; пять ролей смены - одна категория
+CATEGORY_COLUMNS = {
+    'castings': [CASTING_COLUMN],
+    'experiments': [EXPERIMENT_COLUMN],
+    'participants': PARTICIPANT_COLUMNS,
+}
+
+
+class MeltRecord:
+    """Одна запись плавки с полями по заголовкам листа.
+
+    Поля доступны как атрибуты (record.Плавка_дата) и по имени столбца
+    (record['Плавка_дата']); незаполненные поля равны None.
+    """
+
+    __slots__ = tuple(HEADERS)
+
+    def __init__(self, **values):
+        for field in HEADERS:
+            setattr(self, field, values.pop(field, None))
+        if values:
+            raise TypeError(f"Неизвестные поля записи: {', '.join(values)}")
+
+    @classmethod
+    def from_row(cls, row):
+        """Запись из строки листа в порядке HEADERS"""
+        record = cls.__new__(cls)
+        for field, value in zip(HEADERS, row):
+            setattr(record, field, value)
+        for field in HEADERS[len(row):]:
+            setattr(record, field, None)
+        return record
+
+    def to_row(self):
+        """Строка листа в порядке HEADERS"""
+        return [getattr(self, field) for field in HEADERS]
+
+    def to_dict(self):
+        return {field: getattr(self, field) for field in HEADERS}
+
+    def __getitem__(self, field):
+        if field not in self.__slots__:
+            raise KeyError(field)
+        return getattr(self, field)
+
+    def __eq__(self, other):
+        if not isinstance(other, MeltRecord):
+            return NotImplemented
+        return self.to_row() == other.to_row()
+
+    def __repr__(self):
+        return f"MeltRecord(ID={self.ID!r}, Плавка_дата={self.Плавка_дата!r}, Номер_плавки={self.Номер_плавки!r})"
+
+
+def category_name(value):
+    """Имя категории из значения ячейки: текст без изменений, пустое - ''"""
+    return str(value) if value is not None else ''
+
+
+class CodeTable:
+    """Постоянная таблица кодов отливок, типов эксперимента и участников.
+
+    Код имени - его номер в порядке появления; коды не меняются между
+    запусками и перестроениями столбцов, новые имена получают следующие
+    номера. Написания с одинаковым ключом category_key получают один
+    код и показываются так, как встретились впервые.
+    Таблица хранится в файле рядом с данными и записывается вместе со
+    снимками индексов, если в ней появились новые имена.
+    """
+
+    def __init__(self, path=None):
+        self.path = path
+        self.changed = False
+        self._lock = threading.Lock()
+        self._reset({})
+
+    def _reset(self, names):
+        self._names = {kind: [] for kind in CATEGORY_COLUMNS}
+        self._codes = {kind: {} for kind in CATEGORY_COLUMNS}
+        # Коды встреченных написаний, чтобы не вычислять ключ для каждой ячейки
+        self._spellings = {kind: {} for kind in CATEGORY_COLUMNS}
+        for kind in CATEGORY_COLUMNS:
+            for name in names.get(kind, []):
+                self._encode(kind, name)
+
+    def _encode(self, kind, name):
+        code = self._spellings[kind].get(name)
+        if code is not None:
+            return code
+        codes = self._codes[kind]
+        key = category_key(name)
+        code = codes.get(key)
+        if code is None:
+            code = codes[key] = len(self._names[kind])
+            self._names[kind].append(name)
+            self.changed = True
+        self._spellings[kind][name] = code
+        return code
+
+    def load(self):
+        if self.path is None or not os.path.exists(self.path):
+            return False
+        try:
+            with open(self.path, 'r', encoding='utf-8') as codes_file:
+                data = json.load(codes_file)
+            if data.get('version') != CODE_TABLE_VERSION:
+                return False
+            with self._lock:
+                self._reset(data['names'])
+                self.changed = False
+            return True
+        except Exception as e:
+            logging.error(f"Ошибка при чтении таблицы кодов {self.path}: {str(e)}")
+            return False
+
+    def save(self):
+        """Сохраняет таблицу, если в ней появились новые имена"""
+        with self._lock:
+            if self.path is None or not self.changed:
+                return
+            data = {'version': CODE_TABLE_VERSION,
+                    'names': {kind: list(names) for kind, names in self._names.items()}}
+            self.changed = False
+        try:
+            tmp_path = self.path + '.tmp'
+            with open(tmp_path, 'w', encoding='utf-8') as codes_file:
+                json.dump(data, codes_file, ensure_ascii=False)
+            os.replace(tmp_path, self.path)
+        except Exception as e:
+            logging.error(f"Ошибка при сохранении таблицы кодов {self.path}: {str(e)}")
+
+    def names(self, kind):
+        """Имена категории в порядке кодов"""
+        with self._lock:
+            return list(self._names[kind])
+
+    def code(self, kind, name):
+        """Код имени или None, если имя еще не встречалось"""
+        with self._lock:
+            return self._codes[kind].get(category_key(name))
+
+    def encode(self, kind, names):
+        """Массив кодов int32 для списка имен; новые имена добавляются в таблицу"""
+        with self._lock:
+            get = self._spellings[kind].get
+            codes = []
+            for name in names:
+                code = get(name)
+                codes.append(code if code is not None else self._encode(kind, name))
+        return np.array(codes, dtype=np.int32)
+
+    def encode_rows(self, kind, rows):
+        """Коды категории для строк листа: вектор (N,) или матрица (N, 5) для участников"""
+        columns = CATEGORY_COLUMNS[kind]
+        codes = self.encode(kind, [category_name(row[column]) for row in rows for column in columns])
+        return codes if len(columns) == 1 else codes.reshape(len(rows), len(columns))
+
+
+_code_table = None
+_code_table_lock = threading.Lock()
+
+
+def get_code_table():
+    """Общая для процесса таблица кодов, загруженная из файла рядом с данными"""
+    global _code_table
+    cache = get_record_cache()
+    with _code_table_lock:
+        if _code_table is None:
+            _code_table = CodeTable(sidecar_path(cache.store.file_name, CODE_TABLE_SUFFIX))
+            _code_table.load()
+            # Новые имена записываются вместе со снимками индексов, а не при чтении
+            cache.checkpoint_listeners.append(_code_table.save)
+        return _code_table
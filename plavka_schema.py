@@ -0,0 +1,272 @@
+from datetime import datetime, date, time
+from functools import lru_cache
+import math
+import numpy as np
+
+# Порядок столбцов листа Records
+HEADERS = ["ID", "Учетный_номер", "Плавка_дата", "Номер_плавки", "Номер_кластера",
+           "Старший_смены_плавки", "Первый_участник_смены_плавки",
+           "Второй_участник_смены_плавки", "Третий_участник_смены_плавки",
+           "Четвертый_участник_смены_плавки", "Наименование_отливки",
+           "Тип_эксперемента", "Сектор_A_опоки", "Сектор_B_опоки",
+           "Сектор_C_опоки", "Сектор_D_опоки",
+           "Плавка_время_прогрева_ковша_A", "Плавка_время_перемещения_A", "Плавка_время_заливки_A", "Плавка_температура_заливки_A",
+           "Плавка_время_прогрева_ковша_B", "Плавка_время_перемещения_B", "Плавка_время_заливки_B", "Плавка_температура_заливки_B",
+           "Плавка_время_прогрева_ковша_C", "Плавка_время_перемещения_C", "Плавка_время_заливки_C", "Плавка_температура_заливки_C",
+           "Плавка_время_прогрева_ковша_D", "Плавка_время_перемещения_D", "Плавка_время_заливки_D", "Плавка_температура_заливки_D",
+           "Комментарий"]
+
+SECTORS = ["A", "B", "C", "D"]
+# Замеры времени в каждом секторе в порядке столбцов листа
+TIME_METRICS = ["прогрева_ковша", "перемещения", "заливки"]
+
+# Типизированные столбцы: дата, 12 времен (сектор за сектором) и 4 температуры
+DATE_COLUMN = HEADERS.index("Плавка_дата")
+TIME_COLUMNS = [HEADERS.index(f"Плавка_время_{metric}_{sector}")
+                for sector in SECTORS for metric in TIME_METRICS]
+TEMPERATURE_COLUMNS = [HEADERS.index(f"Плавка_температура_заливки_{sector}") for sector in SECTORS]
+
+# Замеры сектора в порядке тензора секторов: три времени и температура заливки.
+# SECTOR_FIELDS[сектор][замер] - имя столбца листа
+SECTOR_METRICS = TIME_METRICS + ["температура_заливки"]
+SECTOR_FIELDS = [[f"Плавка_время_{metric}_{sector}" for metric in TIME_METRICS] +
+                 [f"Плавка_температура_заливки_{sector}"] for sector in SECTORS]
+SECTOR_COLUMNS = [[HEADERS.index(field) for field in fields] for fields in SECTOR_FIELDS]
+
+# Категориальные столбцы: отливка, тип эксперимента и пять ролей смены
+CASTING_COLUMN = HEADERS.index("Наименование_отливки")
+EXPERIMENT_COLUMN = HEADERS.index("Тип_эксперемента")
+PARTICIPANT_COLUMNS = [HEADERS.index(name) for name in (
+    "Старший_смены_плавки", "Первый_участник_смены_плавки", "Второй_участник_смены_плавки",
+    "Третий_участник_смены_плавки", "Четвертый_участник_смены_плавки")]
+
+
+def category_key(value):
+    """Ключ значения категории (отливка, тип эксперимента, участник смены):
+    текст без пробелов по краям в нижнем регистре"""
+    return str(value).strip().lower() if value is not None else ''
+
+
+# Типы столбцов; остальные столбцы - текст
+DATE, TIME, TEMPERATURE, TEXT = 'date', 'time', 'temperature', 'text'
+COLUMN_TYPES = [TEXT] * len(HEADERS)
+COLUMN_TYPES[DATE_COLUMN] = DATE
+for _column in TIME_COLUMNS:
+    COLUMN_TYPES[_column] = TIME
+for _column in TEMPERATURE_COLUMNS:
+    COLUMN_TYPES[_column] = TEMPERATURE
+
+# Пустые значения в типизированных массивах
+MISSING_DATE = -1
+MISSING_TIME = -1
+
+
+def _is_empty(value):
+    return value is None or (isinstance(value, str) and not value.strip())
+
+
+@lru_cache(maxsize=4096)
+def _parse_date_text(text):
+    day, month, year = text.split('.')
+    return date(int(year), int(month), int(day)).toordinal()
+
+
+def parse_date(value):
+    """Порядковый номер дня для даты 'dd.MM.yyyy' или None для пустого значения.
+
+    Нераспознанное значение вызывает ValueError.
+    """
+    if _is_empty(value):
+        return None
+    if isinstance(value, (datetime, date)):
+        return value.toordinal()
+    try:
+        return _parse_date_text(str(value).strip())
+    except (ValueError, TypeError):
+        raise ValueError(f"Неверная дата: {value}")
+
+
+@lru_cache(maxsize=4096)
+def _parse_time_text(text):
+    hours, minutes = text.split(':')
+    hours, minutes = int(hours), int(minutes)
+    if not (0 <= hours < 24 and 0 <= minutes < 60):
+        raise ValueError(text)
+    return hours * 60 + minutes
+
+
+def parse_time(value):
+    """Минуты от полуночи для времени 'HH:MM' или None для пустого значения"""
+    if _is_empty(value):
+        return None
+    if isinstance(value, time):
+        return value.hour * 60 + value.minute
+    try:
+        return _parse_time_text(str(value).strip())
+    except (ValueError, TypeError):
+        raise ValueError(f"Неверное время: {value}")
+
+
+def parse_temperature(value):
+    """Температура числом или None для пустого значения; допускается десятичная запятая"""
+    if _is_empty(value):
+        return None
+    if isinstance(value, bool):
+        raise ValueError(f"Неверная температура: {value}")
+    try:
+        number = float(value) if isinstance(value, (int, float)) else float(str(value).strip().replace(',', '.'))
+    except (ValueError, TypeError):
+        raise ValueError(f"Неверная температура: {value}")
+    if not math.isfinite(number):
+        raise ValueError(f"Неверная температура: {value}")
+    return number
+
+
+PARSERS = {DATE: parse_date, TIME: parse_time, TEMPERATURE: parse_temperature}
+
+
+def parse_value(column, value):
+    """Типизированное значение ячейки столбца; текст возвращается как есть"""
+    parser = PARSERS.get(COLUMN_TYPES[column])
+    return parser(value) if parser is not None else value
+
+
+def _parse_columns(row, columns, parser, errors):
+    values = []
+    for column in columns:
+        value = row[column]
+        if value is None:
+            values.append(None)
+            continue
+        try:
+            values.append(parser(value))
+        except ValueError:
+            errors[HEADERS[column]] = value
+            values.append(None)
+    return values
+
+
+def parse_row(row):
+    """Разбирает типизированные столбцы строки листа.
+
+    Возвращает (дата, список 12 времен, список 4 температур, ошибки):
+    пустые значения - None, ошибки - словарь {столбец: исходное значение}
+    для значений, которые не удалось разобрать (они тоже становятся None).
+    """
+    errors = {}
+    ordinal, = _parse_columns(row, [DATE_COLUMN], parse_date, errors)
+    times = _parse_columns(row, TIME_COLUMNS, parse_time, errors)
+    temperatures = _parse_columns(row, TEMPERATURE_COLUMNS, parse_temperature, errors)
+    return ordinal, times, temperatures, errors
+
+
+def _filled(values, missing, dtype):
+    # None -> NaN при создании массива, затем NaN -> значение пустой ячейки
+    array = np.array(values, dtype=np.float64)
+    return np.where(np.isnan(array), missing, array).astype(dtype)
+
+
+def field_errors(values):
+    """Поля словаря {столбец: значение}, которые не проходят разбор по схеме"""
+    invalid = []
+    for field, value in values.items():
+        parser = PARSERS.get(COLUMN_TYPES[HEADERS.index(field)])
+        if parser is None:
+            continue
+        try:
+            parser(value)
+        except ValueError:
+            invalid.append(field)
+    return invalid
+
+
+class TypedRecords:
+    """Типизированные столбцы записей, разобранные один раз при загрузке.
+
+    dates - порядковые номера дней (MISSING_DATE для пустых), times -
+    матрица (N, 12) минут от полуночи в порядке TIME_COLUMNS
+    (MISSING_TIME для пустых), temperatures - матрица (N, 4) температур
+    по секторам A-D с NaN на месте пустых. errors - {позиция: {столбец:
+    исходное значение}} для строк, где разбор не удался. При сохранении
+    и правке разбирается только измененная строка.
+    """
+
+    def __init__(self, rows=()):
+        rows = list(rows)
+        self._size = 0
+        self._dates = np.empty(0, dtype=np.int32)
+        self._times = np.empty((0, len(TIME_COLUMNS)), dtype=np.int16)
+        self._temperatures = np.empty((0, len(TEMPERATURE_COLUMNS)), dtype=np.float64)
+        self.errors = {}
+        self.extend(rows)
+
+    def __len__(self):
+        return self._size
+
+    def _reserve(self, capacity):
+        # Массивы растут с запасом, чтобы добавление записи не копировало их каждый раз
+        current = self._dates.shape[0]
+        if current >= capacity:
+            return
+        capacity = max(capacity, current * 2, 16)
+        dates = np.full(capacity, MISSING_DATE, dtype=np.int32)
+        times = np.full((capacity, len(TIME_COLUMNS)), MISSING_TIME, dtype=np.int16)
+        temperatures = np.full((capacity, len(TEMPERATURE_COLUMNS)), np.nan, dtype=np.float64)
+        if self._size:
+            dates[:self._size] = self._dates[:self._size]
+            times[:self._size] = self._times[:self._size]
+            temperatures[:self._size] = self._temperatures[:self._size]
+        self._dates, self._times, self._temperatures = dates, times, temperatures
+
+    @property
+    def dates(self):
+        return self._dates[:self._size]
+
+    @property
+    def times(self):
+        return self._times[:self._size]
+
+    @property
+    def temperatures(self):
+        return self._temperatures[:self._size]
+
+    def extend(self, rows):
+        """Разбирает строки и добавляет их в конец одним присваиванием массивов"""
+        parsed = [parse_row(row) for row in rows]
+        if not parsed:
+            return
+        start, end = self._size, self._size + len(parsed)
+        self._reserve(end)
+        self._dates[start:end] = _filled([item[0] for item in parsed], MISSING_DATE, np.int32)
+        self._times[start:end] = _filled([item[1] for item in parsed], MISSING_TIME, np.int16)
+        self._temperatures[start:end] = np.array([item[2] for item in parsed], dtype=np.float64)
+        for position, (_, _, _, errors) in enumerate(parsed, start):
+            if errors:
+                self.errors[position] = errors
+        self._size = end
+
+    def set_row(self, position, row):
+        """Разбирает строку и записывает её значения в позицию (в конец - добавление)"""
+        if position > self._size:
+            raise IndexError(f"Позиция {position} за концом столбцов ({self._size})")
+        if position == self._size:
+            self._reserve(position + 1)
+            self._size += 1
+        ordinal, times, temperatures, errors = parse_row(row)
+        self._dates[position] = ordinal if ordinal is not None else MISSING_DATE
+        self._times[position] = [value if value is not None else MISSING_TIME for value in times]
+        self._temperatures[position] = [value if value is not None else np.nan for value in temperatures]
+        if errors:
+            self.errors[position] = errors
+        else:
+            self.errors.pop(position, None)
+
+    def copy(self):
+        """Копия столбцов, которую не затронут последующие записи"""
+        result = TypedRecords()
+        result._size = self._size
+        result._dates = self.dates.copy()
+        result._times = self.times.copy()
+        result._temperatures = self.temperatures.copy()
+        result.errors = {position: dict(errors) for position, errors in self.errors.items()}
+        return result
@@ -0,0 +1,1222 @@
+import os
+import io
+import sys
+import json
+import sqlite3
+import logging
+import argparse
+import threading
+from concurrent.futures import Future
+from time import monotonic
+from datetime import datetime, date, time
+from openpyxl import Workbook, load_workbook
+from openpyxl.utils import get_column_letter
+from openpyxl.packaging.custom import IntProperty
+import plavka_xlsx
+from plavka_schema import HEADERS, TypedRecords, parse_date
+
+# Файл с данными и журнал упреждающей записи рядом с ним
+EXCEL_FILENAME = 'plavka.xlsx'
+JOURNAL_SUFFIX = '.journal'
+# Свойство книги с номером последней перенесенной в неё операции журнала
+JOURNAL_SEQUENCE_PROPERTY = 'journal_sequence'
+COLUMN_WIDTHS_SUFFIX = '.widths.json'
+# Журнал изменений индексов после их последних снимков
+INDEX_LOG_SUFFIX = '.index.log'
+
+# Хранилище записей: 'excel' - plavka.xlsx с журналом, 'sqlite' - база plavka.db
+STORAGE_BACKEND = 'excel'
+DATABASE_FILENAME = 'plavka.db'
+
+# Групповая запись: окно ожидания, с и максимальный размер пачки
+WRITE_BATCH_WINDOW = 0.2
+WRITE_BATCH_SIZE = 20
+
+# Размер блока при поиске конца последней целой строки журнала
+JOURNAL_SCAN_CHUNK = 4096
+
+
+def sidecar_path(file_name, suffix):
+    """Путь к служебному файлу рядом с файлом данных"""
+    return os.path.splitext(file_name)[0] + suffix
+
+
+def normalize_value(value):
+    """Приводит даты и время из Excel к строкам формата формы"""
+    if isinstance(value, datetime):
+        return value.strftime("%d.%m.%Y")
+    if isinstance(value, date):
+        return value.strftime("%d.%m.%Y")
+    if isinstance(value, time):
+        return value.strftime("%H:%M")
+    return value
+
+
+def normalize_row(row, width=len(HEADERS)):
+    """Нормализует строку листа и дополняет её до полной ширины"""
+    values = [normalize_value(value) for value in row[:width]]
+    if len(values) < width:
+        values.extend([None] * (width - len(values)))
+    return values
+
+
+def file_signature(path):
+    """Время изменения и размер файла или None, если файла нет"""
+    try:
+        stat = os.stat(path)
+        return (stat.st_mtime_ns, stat.st_size)
+    except OSError:
+        return None
+
+
+def tuple_signature(signature):
+    """Отпечаток, прочитанный из JSON: списки снова становятся кортежами"""
+    if isinstance(signature, list):
+        return tuple(tuple_signature(item) for item in signature)
+    return signature
+
+
+def record_key(value):
+    """Ключ записи для сравнения ID"""
+    return str(value).strip() if value is not None else ''
+
+
+def date_ordinal(value):
+    """Порядковый номер дня для даты 'dd.MM.yyyy' или None"""
+    try:
+        return parse_date(value)
+    except ValueError:
+        return None
+
+
+def parse_error_summary(errors, rows, limit=5):
+    """Краткое описание ошибок разбора: ID записей и неразобранные поля"""
+    items = [f"{rows[position][0]} ({', '.join(fields)})"
+             for position, fields in sorted(errors.items())[:limit]]
+    if len(errors) > limit:
+        items.append(f"и еще {len(errors) - limit}")
+    return '; '.join(items)
+
+
+class RecordJournal:
+    """Журнал изменений в формате JSON Lines, дописываемый в конец файла"""
+
+    def __init__(self, path):
+        self.path = path
+
+    def append(self, operations):
+        """Дописывает операции в журнал и сбрасывает их на диск"""
+        payload = ''.join(
+            json.dumps(op, ensure_ascii=False, default=str) + '\n' for op in operations
+        ).encode('utf-8')
+        with open(self.path, 'a+b') as journal:
+            self._trim_torn_tail(journal)
+            journal.write(payload)
+            journal.flush()
+            os.fsync(journal.fileno())
+
+    def _trim_torn_tail(self, journal):
+        # Недописанную после сбоя строку отрезаем, иначе новая запись
+        # склеится с ней и будет пропущена при чтении как поврежденная
+        end = journal.seek(0, os.SEEK_END)
+        if not end:
+            return
+        journal.seek(end - 1)
+        if journal.read(1) == b'\n':
+            return
+        position = end
+        while position > 0:
+            start = max(0, position - JOURNAL_SCAN_CHUNK)
+            journal.seek(start)
+            newline = journal.read(position - start).rfind(b'\n')
+            if newline >= 0:
+                position = start + newline + 1
+                break
+            position = start
+        logging.warning(f"Отброшена недописанная строка журнала {self.path}: {end - position} байт")
+        journal.truncate(position)
+
+    def read(self):
+        """Возвращает операции журнала и число прочитанных байт"""
+        if not os.path.exists(self.path):
+            return [], 0
+
+        with open(self.path, 'rb') as journal:
+            data = journal.read()
+
+        operations = []
+        consumed = 0
+        for line in data.splitlines(keepends=True):
+            if not line.endswith(b'\n'):
+                # Недописанная строка после сбоя - пропускаем её
+                break
+            consumed += len(line)
+            if not line.strip():
+                continue
+            try:
+                operations.append(json.loads(line.decode('utf-8')))
+            except ValueError as e:
+                logging.error(f"Поврежденная запись в журнале {self.path}: {str(e)}")
+        return operations, consumed
+
+    def discard(self, consumed):
+        """Удаляет из журнала первые consumed байт, сохраняя хвост"""
+        if not os.path.exists(self.path):
+            return
+
+        with open(self.path, 'rb') as journal:
+            journal.seek(consumed)
+            tail = journal.read()
+
+        tmp_path = self.path + '.tmp'
+        with open(tmp_path, 'wb') as journal:
+            journal.write(tail)
+            journal.flush()
+            os.fsync(journal.fileno())
+        os.replace(tmp_path, self.path)
+
+    def size(self):
+        return os.path.getsize(self.path) if os.path.exists(self.path) else 0
+
+
+def operation_key(operation):
+    """ID записи, к которой относится операция журнала"""
+    if operation.get('op') == 'insert':
+        return record_key(operation['row'][0])
+    return record_key(operation.get('id'))
+
+
+def pending_operations(operations, sequence):
+    """Операции журнала, которых еще нет в книге.
+
+    sequence - номер последней операции, перенесенной в книгу при сжатии.
+    Операции с номером не больше него остаются в журнале, только если
+    сжатие прервалось между заменой книги и очисткой журнала.
+    """
+    return [operation for operation in operations
+            if operation.get('seq') is None or operation['seq'] > sequence]
+
+
+def apply_operation(rows, positions, operation):
+    """Применяет операцию журнала к списку строк и индексу ID -> позиция.
+
+    Возвращает False, если операция не применена: вставка записи с уже
+    существующим ID или правка несуществующей записи.
+    """
+    if operation.get('op') == 'insert':
+        row = normalize_row(operation['row'])
+        key = record_key(row[0])
+        if key in positions:
+            logging.warning(f"Запись {key} из журнала уже существует")
+            return False
+        positions[key] = len(rows)
+        rows.append(row)
+        return True
+    elif operation.get('op') == 'update':
+        key = record_key(operation['id'])
+        if key not in positions:
+            logging.warning(f"Запись {key} из журнала не найдена")
+            return False
+        row = rows[positions[key]]
+        for field, value in operation['values'].items():
+            row[HEADERS.index(field)] = value
+        return True
+    return False
+
+
+class ColumnWidths:
+    """Максимальная длина значений по столбцам для ширины столбцов листа.
+
+    Таблица хранится в файле и растет по мере записи новых значений;
+    полный пересчет по листу выполняется только при обслуживании.
+    """
+
+    def __init__(self, path=None):
+        self.path = path
+        self.lengths = None
+
+    def load(self):
+        if self.path is None or not os.path.exists(self.path):
+            return False
+        try:
+            with open(self.path, 'r', encoding='utf-8') as widths_file:
+                lengths = json.load(widths_file)
+            if len(lengths) != len(HEADERS):
+                return False
+            self.lengths = lengths
+            return True
+        except Exception as e:
+            logging.error(f"Ошибка при чтении ширины столбцов: {str(e)}")
+            return False
+
+    def save(self):
+        if self.path is None or self.lengths is None:
+            return
+        try:
+            with open(self.path, 'w', encoding='utf-8') as widths_file:
+                json.dump(self.lengths, widths_file)
+        except Exception as e:
+            logging.error(f"Ошибка при сохранении ширины столбцов: {str(e)}")
+
+    def update(self, values):
+        """Учитывает новые значения {номер столбца: значение}"""
+        if self.lengths is None:
+            return False
+        changed = False
+        for column, value in values.items():
+            if value is None:
+                continue
+            length = len(str(value))
+            if length > self.lengths[column]:
+                self.lengths[column] = length
+                changed = True
+        return changed
+
+    def update_row(self, row):
+        return self.update(dict(enumerate(row[:len(HEADERS)])))
+
+    def measure_rows(self, rows):
+        """Полный пересчет по заголовкам и всем строкам"""
+        self.lengths = [len(header) for header in HEADERS]
+        for row in rows:
+            self.update_row(row)
+
+    def measure_sheet(self, sheet):
+        """Полный пересчет по всем ячейкам листа"""
+        self.measure_rows(sheet.iter_rows(min_row=2, max_col=len(HEADERS), values_only=True))
+
+    def apply(self, sheet):
+        for column, length in enumerate(self.lengths, start=1):
+            sheet.column_dimensions[get_column_letter(column)].width = length + 2
+
+
+class RecordStore:
+    """Общий интерфейс хранилища записей плавки"""
+
+    def __init__(self):
+        # Вызываются как listener(before, after) после сжатия хранилища
+        self.compaction_listeners = []
+
+    def signature(self):
+        """Отпечаток файлов хранилища, меняется при любой записи"""
+        raise NotImplementedError
+
+    def load(self):
+        """Возвращает заголовки и все записи в порядке добавления"""
+        raise NotImplementedError
+
+    def insert(self, row):
+        """Добавляет запись, возвращает True при успехе.
+
+        Запись с уже существующим ID не добавляется - результат False.
+        """
+        raise NotImplementedError
+
+    def update(self, record_id, values):
+        """Изменяет поля записи по словарю {столбец: значение}"""
+        raise NotImplementedError
+
+    def get(self, record_id):
+        """Возвращает запись по ID или None"""
+        raise NotImplementedError
+
+    def apply_batch(self, operations):
+        """Применяет пачку операций журнального вида одной записью.
+
+        Возвращает список результатов (True/False) для каждой операции.
+        """
+        results = []
+        for operation in operations:
+            if operation['op'] == 'insert':
+                results.append(self.insert(operation['row']))
+            else:
+                results.append(self.update(operation['id'], operation['values']))
+        return results
+
+    def exists(self, record_id):
+        return self.get(record_id) is not None
+
+    def query_date_range(self, date_from, date_to):
+        """Записи с датой плавки в диапазоне [date_from, date_to]"""
+        first, last = date_from.toordinal(), date_to.toordinal()
+        _, rows = self.load()
+        result = []
+        for row in rows:
+            ordinal = date_ordinal(row[2])
+            if ordinal is not None and first <= ordinal <= last:
+                result.append(row)
+        return result
+
+    def compact(self, full=False):
+        """Обслуживание хранилища, вызывается периодически и при выходе.
+
+        full=True - полное обслуживание с пересчетом служебных данных.
+        """
+        return False
+
+    def export_excel(self, file_name):
+        """Выгружает все записи в книгу Excel"""
+        raise NotImplementedError
+
+    def close(self):
+        pass
+
+
+class ExcelRecordStore(RecordStore):
+    """Хранилище записей в plavka.xlsx с журналом упреждающей записи.
+
+    Новые записи и правки дописываются в журнал за O(1), а периодическое
+    сжатие переносит их в книгу Excel. Чтение объединяет книгу и журнал.
+    Операции журнала нумеруются; номер последней перенесенной операции
+    хранится в свойствах книги, поэтому после прерванного сжатия уже
+    перенесенные операции не применяются повторно.
+    """
+
+    def __init__(self, file_name=EXCEL_FILENAME):
+        super().__init__()
+        self.file_name = file_name
+        self.journal = RecordJournal(sidecar_path(file_name, JOURNAL_SUFFIX))
+        self.column_widths = ColumnWidths(sidecar_path(file_name, COLUMN_WIDTHS_SUFFIX))
+        self.column_widths.load()
+        # Функция ID -> номер строки листа (индекс строк), если подключена
+        self.row_locator = None
+        # ID записей и номер последней операции журнала для отпечатка _state_signature
+        self._keys = None
+        self._sequence = 0
+        self._state_signature = None
+        self._lock = threading.RLock()
+        self._compact_lock = threading.Lock()
+        self.compaction_listeners.append(self._on_compacted)
+
+    def _on_compacted(self, before, after):
+        if self._state_signature == before:
+            self._state_signature = after
+
+    def signature(self):
+        return (file_signature(self.file_name), file_signature(self.journal.path))
+
+    def _read_workbook_rows(self, data):
+        try:
+            return [normalize_row(row) for row in
+                    plavka_xlsx.read_rows(io.BytesIO(data), min_row=2, width=len(HEADERS))]
+        except Exception as e:
+            # Необычная книга - читаем её полностью через openpyxl
+            logging.error(f"Потоковое чтение {self.file_name} не удалось, используется openpyxl: {str(e)}")
+        wb = load_workbook(io.BytesIO(data), read_only=True)
+        ws = wb.active
+        rows = [normalize_row(row) for row in ws.iter_rows(min_row=2, values_only=True)]
+        wb.close()
+        return rows
+
+    def _read_files(self):
+        # Книга и журнал читаются вместе, чтобы сжатие не изменило их между чтениями
+        with self._lock:
+            data = None
+            if os.path.exists(self.file_name):
+                with open(self.file_name, 'rb') as workbook_file:
+                    data = workbook_file.read()
+            operations, _ = self.journal.read()
+            return data, operations, self.signature()
+
+    def _workbook_sequence(self, data):
+        """Номер последней операции журнала, перенесенной в книгу"""
+        try:
+            value = plavka_xlsx.read_custom_property(io.BytesIO(data), JOURNAL_SEQUENCE_PROPERTY)
+            return int(value) if value is not None else 0
+        except Exception as e:
+            logging.error(f"Ошибка при чтении номера операции журнала из {self.file_name}: {str(e)}")
+            return 0
+
+    def load(self):
+        """Возвращает заголовки и все записи с учетом журнала"""
+        data, operations, signature = self._read_files()
+        rows = self._read_workbook_rows(data) if data else []
+        sequence = self._workbook_sequence(data) if data else 0
+        positions = {}
+        for position, row in enumerate(rows):
+            positions.setdefault(record_key(row[0]), position)
+        for operation in pending_operations(operations, sequence):
+            apply_operation(rows, positions, operation)
+
+        sequence = max([sequence] + [operation.get('seq') or 0 for operation in operations])
+        with self._lock:
+            if self.signature() == signature:
+                self._keys = set(positions)
+                self._sequence = sequence
+                self._state_signature = signature
+        return list(HEADERS), rows
+
+    def _ensure_state(self):
+        # ID записей нужны для проверки вставок; после внешнего изменения файлов - перечитываем
+        if self._state_signature is None or self._state_signature != self.signature():
+            self.load()
+
+    def insert(self, row):
+        """Добавляет новую запись в журнал"""
+        return self.apply_batch([{'op': 'insert', 'row': list(row)}])[0]
+
+    def update(self, record_id, values):
+        """Записывает в журнал изменение полей существующей записи"""
+        return self.apply_batch([{'op': 'update', 'id': record_key(record_id), 'values': dict(values)}])[0]
+
+    def apply_batch(self, operations):
+        """Дописывает пачку операций в журнал одной записью на диск.
+
+        Вставки с существующим ID и правки несуществующих записей в журнал
+        не попадают, их результат - False, как в SQLiteRecordStore.
+        """
+        try:
+            with self._lock:
+                self._ensure_state()
+                keys = set(self._keys)
+                sequence = self._sequence
+                results, accepted = [], []
+                for operation in operations:
+                    key = operation_key(operation)
+                    if operation['op'] == 'insert':
+                        ok = key not in keys
+                        keys.add(key)
+                    else:
+                        ok = key in keys
+                    results.append(ok)
+                    if ok:
+                        sequence += 1
+                        accepted.append(dict(operation, seq=sequence))
+                if not accepted:
+                    return results
+
+                self.journal.append(accepted)
+                self._keys, self._sequence = keys, sequence
+                self._state_signature = self.signature()
+                changed = False
+                for operation in accepted:
+                    if operation['op'] == 'insert':
+                        changed |= self.column_widths.update_row(operation['row'])
+                    else:
+                        changed |= self.column_widths.update(
+                            {HEADERS.index(field): value for field, value in operation['values'].items()})
+                if changed:
+                    self.column_widths.save()
+            return results
+        except Exception as e:
+            logging.error(f"Ошибка при записи в журнал: {str(e)}")
+            return [False] * len(operations)
+
+    def _read_sheet_row(self, data, row_number):
+        try:
+            row = plavka_xlsx.read_row(io.BytesIO(data), row_number, width=len(HEADERS))
+            return normalize_row(row) if row is not None else None
+        except Exception as e:
+            logging.error(f"Потоковое чтение строки {row_number} не удалось, используется openpyxl: {str(e)}")
+        wb = load_workbook(io.BytesIO(data), read_only=True)
+        ws = wb.active
+        rows = list(ws.iter_rows(min_row=row_number, max_row=row_number, values_only=True))
+        wb.close()
+        return normalize_row(rows[0]) if rows else None
+
+    def get(self, record_id):
+        """Читает запись по индексу строк, без загрузки всего листа"""
+        key = record_key(record_id)
+        row_number = self.row_locator(key) if self.row_locator else None
+        if row_number is not None:
+            data, operations, _ = self._read_files()
+            row = self._read_sheet_row(data, row_number) if data else None
+            rows, positions = [], {}
+            if row is not None and record_key(row[0]) == key:
+                rows, positions = [row], {key: 0}
+            sequence = self._workbook_sequence(data) if data else 0
+            for operation in pending_operations(operations, sequence):
+                if operation_key(operation) == key:
+                    apply_operation(rows, positions, operation)
+            if rows:
+                return rows[0]
+
+        # Индекс строк не подключен или устарел - ищем по всем записям
+        _, rows = self.load()
+        for row in rows:
+            if record_key(row[0]) == key:
+                return row
+        return None
+
+    def compact(self, full=False):
+        """Переносит операции из журнала в plavka.xlsx.
+
+        При full=True книга перезаписывается даже без операций в журнале,
+        а ширина столбцов пересчитывается по всему листу.
+        """
+        if not self._compact_lock.acquire(blocking=False):
+            return False
+        try:
+            with self._lock:
+                operations, consumed = self.journal.read()
+            if not operations and not full:
+                return False
+
+            if os.path.exists(self.file_name):
+                workbook = load_workbook(self.file_name)
+                sheet = workbook.active
+            else:
+                workbook = Workbook()
+                sheet = workbook.active
+                sheet.title = "Records"
+                sheet.append(HEADERS)
+
+            properties = workbook.custom_doc_props
+            sequence = int(properties[JOURNAL_SEQUENCE_PROPERTY].value) \
+                if JOURNAL_SEQUENCE_PROPERTY in properties.names else 0
+            last_sequence = max([sequence] + [operation.get('seq') or 0 for operation in operations])
+            # Операции, перенесенные в книгу до прерванного сжатия, пропускаем
+            operations = pending_operations(operations, sequence)
+
+            row_numbers = self._locate_rows(sheet, operations)
+
+            for operation in operations:
+                if operation.get('op') == 'insert':
+                    row = operation['row']
+                    key = record_key(row[0])
+                    if key in row_numbers:
+                        logging.warning(f"Запись {key} из журнала уже существует")
+                        continue
+                    sheet.append(row)
+                    row_numbers[key] = sheet.max_row
+                elif operation.get('op') == 'update':
+                    key = record_key(operation['id'])
+                    if key not in row_numbers:
+                        logging.warning(f"Запись {key} из журнала не найдена")
+                        continue
+                    for field, value in operation['values'].items():
+                        sheet.cell(row=row_numbers[key], column=HEADERS.index(field) + 1).value = value
+
+            if JOURNAL_SEQUENCE_PROPERTY in properties.names:
+                properties[JOURNAL_SEQUENCE_PROPERTY].value = last_sequence
+            else:
+                properties.append(IntProperty(name=JOURNAL_SEQUENCE_PROPERTY, value=last_sequence))
+
+            with self._lock:
+                if full or self.column_widths.lengths is None:
+                    self.column_widths.measure_sheet(sheet)
+                    self.column_widths.save()
+                self.column_widths.apply(sheet)
+
+            tmp_name = self.file_name + '.tmp'
+            workbook.save(tmp_name)
+            with self._lock:
+                before = self.signature()
+                os.replace(tmp_name, self.file_name)
+                self.journal.discard(consumed)
+                after = self.signature()
+                for listener in self.compaction_listeners:
+                    listener(before, after)
+            logging.info(f"Журнал сжат: перенесено операций {len(operations)}")
+            return True
+        except Exception as e:
+            logging.error(f"Ошибка при сжатии журнала: {str(e)}")
+            return False
+        finally:
+            self._compact_lock.release()
+
+    def _locate_rows(self, sheet, operations):
+        """Номера строк листа для записей из журнала.
+
+        Номера берутся из индекса строк и проверяются по ячейке ID; столбец
+        ID просматривается целиком, только если индекс не подключен или
+        разошелся с листом.
+        """
+        if self.row_locator:
+            row_numbers = {}
+            for operation in operations:
+                key = operation_key(operation)
+                if key in row_numbers:
+                    continue
+                row_number = self.row_locator(key)
+                if row_number is None:
+                    break
+                if row_number > sheet.max_row:
+                    # Новая запись, которой еще нет в листе
+                    continue
+                if record_key(sheet.cell(row=row_number, column=1).value) != key:
+                    break
+                row_numbers[key] = row_number
+            else:
+                return row_numbers
+
+        row_numbers = {}
+        for row_number, (value,) in enumerate(
+                sheet.iter_rows(min_row=2, max_col=1, values_only=True), start=2):
+            row_numbers.setdefault(record_key(value), row_number)
+        return row_numbers
+
+    def export_excel(self, file_name):
+        """Выгружает книгу вместе с журналом, не дожидаясь сжатия"""
+        export_records_to_excel(self, file_name)
+
+
+class SQLiteRecordStore(RecordStore):
+    """Хранилище записей во встроенной базе SQLite с индексами"""
+
+    def __init__(self, db_name=DATABASE_FILENAME):
+        super().__init__()
+        self.file_name = db_name
+        self._lock = threading.RLock()
+        self._connection = sqlite3.connect(db_name, check_same_thread=False)
+        self._columns = ', '.join(f'"{header}"' for header in HEADERS)
+        self._create_schema()
+
+    def signature(self):
+        return file_signature(self.file_name)
+
+    def _create_schema(self):
+        with self._lock, self._connection:
+            columns = ',\n'.join(f'"{header}"' for header in HEADERS[1:])
+            self._connection.execute(f'''
+                CREATE TABLE IF NOT EXISTS records (
+                    pos INTEGER PRIMARY KEY AUTOINCREMENT,
+                    "ID" TEXT NOT NULL UNIQUE,
+                    {columns},
+                    date_ord INTEGER
+                )''')
+            self._connection.execute(
+                'CREATE INDEX IF NOT EXISTS idx_records_date ON records (date_ord)')
+            self._connection.execute(
+                'CREATE INDEX IF NOT EXISTS idx_records_casting ON records ("Наименование_отливки")')
+            self._connection.execute(
+                'CREATE INDEX IF NOT EXISTS idx_records_number ON records ("Номер_плавки")')
+
+    def _row_params(self, row):
+        row = normalize_row(row)
+        row[0] = record_key(row[0])
+        return row + [date_ordinal(row[2])]
+
+    def load(self):
+        with self._lock:
+            rows = self._connection.execute(
+                f'SELECT {self._columns} FROM records ORDER BY pos').fetchall()
+        return list(HEADERS), [list(row) for row in rows]
+
+    def insert(self, row):
+        return self.insert_many([row]) == 1
+
+    def insert_many(self, rows):
+        """Добавляет записи одной транзакцией, пропуская существующие ID"""
+        placeholders = ', '.join('?' * (len(HEADERS) + 1))
+        try:
+            with self._lock, self._connection:
+                before = self._connection.total_changes
+                self._connection.executemany(
+                    f'INSERT OR IGNORE INTO records ({self._columns}, date_ord) VALUES ({placeholders})',
+                    (self._row_params(row) for row in rows))
+                return self._connection.total_changes - before
+        except sqlite3.Error as e:
+            logging.error(f"Ошибка при записи в базу: {str(e)}")
+            return 0
+
+    def update(self, record_id, values):
+        return self.apply_batch([{'op': 'update', 'id': record_id, 'values': values}])[0]
+
+    def _execute_update(self, record_id, values):
+        fields = [field for field in values if field in HEADERS]
+        if not fields:
+            # Изменять нечего - как и в журнале, правка успешна, если запись есть
+            return self._connection.execute(
+                'SELECT 1 FROM records WHERE "ID" = ?', (record_key(record_id),)).fetchone() is not None
+        params = [values[field] for field in fields]
+        assignments = [f'"{field}" = ?' for field in fields]
+        if "Плавка_дата" in values:
+            assignments.append('date_ord = ?')
+            params.append(date_ordinal(values["Плавка_дата"]))
+        cursor = self._connection.execute(
+            f'UPDATE records SET {", ".join(assignments)} WHERE "ID" = ?',
+            params + [record_key(record_id)])
+        return cursor.rowcount > 0
+
+    def apply_batch(self, operations):
+        """Применяет пачку операций в одной транзакции"""
+        placeholders = ', '.join('?' * (len(HEADERS) + 1))
+        try:
+            with self._lock, self._connection:
+                results = []
+                for operation in operations:
+                    if operation['op'] == 'insert':
+                        cursor = self._connection.execute(
+                            f'INSERT OR IGNORE INTO records ({self._columns}, date_ord) VALUES ({placeholders})',
+                            self._row_params(operation['row']))
+                        results.append(cursor.rowcount > 0)
+                    else:
+                        results.append(self._execute_update(operation['id'], operation['values']))
+                return results
+        except sqlite3.Error as e:
+            logging.error(f"Ошибка при записи в базу: {str(e)}")
+            return [False] * len(operations)
+
+    def get(self, record_id):
+        with self._lock:
+            row = self._connection.execute(
+                f'SELECT {self._columns} FROM records WHERE "ID" = ?',
+                (record_key(record_id),)).fetchone()
+        return list(row) if row else None
+
+    def exists(self, record_id):
+        with self._lock:
+            row = self._connection.execute(
+                'SELECT 1 FROM records WHERE "ID" = ?', (record_key(record_id),)).fetchone()
+        return row is not None
+
+    def query_date_range(self, date_from, date_to):
+        with self._lock:
+            rows = self._connection.execute(
+                f'SELECT {self._columns} FROM records WHERE date_ord BETWEEN ? AND ? ORDER BY date_ord, pos',
+                (date_from.toordinal(), date_to.toordinal())).fetchall()
+        return [list(row) for row in rows]
+
+    def export_excel(self, file_name):
+        export_records_to_excel(self, file_name)
+
+    def close(self):
+        with self._lock:
+            self._connection.close()
+
+
+def migrate_excel_to_sqlite(file_name=EXCEL_FILENAME, db_name=DATABASE_FILENAME):
+    """Однократный перенос plavka.xlsx (вместе с журналом) в базу SQLite"""
+    _, rows = ExcelRecordStore(file_name).load()
+    store = SQLiteRecordStore(db_name)
+    try:
+        imported = store.insert_many(rows)
+    finally:
+        store.close()
+    logging.info(f"Перенесено в {db_name} записей: {imported} из {len(rows)}")
+    return imported
+
+
+def export_records_to_excel(store, file_name=EXCEL_FILENAME):
+    """Выгружает все записи хранилища в книгу Excel для просмотра в Excel"""
+    _, rows = store.load()
+    workbook = Workbook(write_only=True)
+    sheet = workbook.create_sheet("Records")
+    widths = ColumnWidths()
+    widths.measure_rows(rows)
+    widths.apply(sheet)
+    sheet.append(HEADERS)
+    for row in rows:
+        sheet.append(row)
+
+    tmp_name = file_name + '.tmp'
+    workbook.save(tmp_name)
+    os.replace(tmp_name, file_name)
+    logging.info(f"Выгружено в {file_name} записей: {len(rows)}")
+
+
+class RecordCache:
+    """Общий для процесса кэш записей поверх хранилища.
+
+    Записи читаются один раз и обновляются на месте при сохранении и
+    редактировании. Повторная загрузка происходит, только если файлы
+    хранилища изменились на диске (время изменения или размер). Рядом со
+    строками хранятся их типизированные столбцы typed: даты, времена и
+    температуры разбираются при загрузке и при записи строки.
+
+    Изменения индексов при записи дописываются в журнал индексов
+    index_log: строка на пачку с отпечатками до и после неё и событиями
+    [позиция, старая строка или None, новая строка]. Снимки индексов
+    пишутся целиком только в checkpoint, после чего журнал очищается;
+    там же вызываются checkpoint_listeners для других файлов рядом с данными.
+    """
+
+    def __init__(self, store):
+        self.store = store
+        self.index_log = RecordJournal(sidecar_path(store.file_name, INDEX_LOG_SUFFIX))
+        self.headers = list(HEADERS)
+        self.rows = []
+        self.positions = {}
+        self.typed = TypedRecords()
+        self.version = 0
+        self.indexes = []
+        self.checkpoint_listeners = []
+        self._signature = None
+        self._loaded = False
+        self._lock = threading.RLock()
+        # Журнал индексов дописывается и из потока сжатия, который держит блокировку хранилища
+        self._log_lock = threading.Lock()
+        store.compaction_listeners.append(self._on_compacted)
+
+    def _on_compacted(self, before, after):
+        # Сжатие не меняет содержимое: кэш и индексы, актуальные до сжатия, остаются актуальными
+        if self._signature == before:
+            self._signature = after
+        for index in self.indexes:
+            if index.signature == before:
+                index.signature = after
+        self._log_indexes(before, after, [])
+
+    def _log_indexes(self, before, after, events):
+        try:
+            with self._log_lock:
+                self.index_log.append([{'base': before, 'signature': after, 'events': events}])
+        except Exception as e:
+            logging.error(f"Ошибка при записи журнала индексов: {str(e)}")
+
+    def find_index(self, index_class):
+        with self._lock:
+            for index in self.indexes:
+                if type(index) is index_class:
+                    return index
+            return None
+
+    def add_index(self, index):
+        """Подключает индекс, который будет обновляться при записи"""
+        with self._lock:
+            # Индекс меняется под блокировкой кэша - под ней же его и читают
+            index.lock = self._lock
+            self.indexes.append(index)
+            return index
+
+    def ensure_index(self, index):
+        """Загружает индекс из снимка и журнала индексов или перестраивает его по записям"""
+        with self._lock:
+            signature = self.store.signature()
+            if index.signature == signature:
+                return index
+            if index.load() and self._replay_index_log(index) == signature:
+                return index
+            self.refresh()
+            index.rebuild(self.rows)
+            index.save(self._signature)
+            logging.info(f"Индекс {index.path} перестроен")
+            return index
+
+    def _replay_index_log(self, index):
+        """Доводит загруженный снимок индекса по журналу индексов, возвращает его отпечаток"""
+        with self._log_lock:
+            entries, _ = self.index_log.read()
+        # Записи связаны отпечатками; порядок строк в файле может нарушить сжатие из другого потока
+        following = {}
+        for entry in entries:
+            following[repr(tuple_signature(entry['base']))] = entry
+        visited = set()
+        while True:
+            key = repr(index.signature)
+            entry = following.get(key)
+            if entry is None or key in visited:
+                return index.signature
+            visited.add(key)
+            for position, old_row, new_row in entry['events']:
+                if old_row is None:
+                    index.on_insert(position, new_row)
+                else:
+                    index.on_update(position, old_row, new_row)
+            index.signature = tuple_signature(entry['signature'])
+
+    def checkpoint(self):
+        """Записывает снимки измененных индексов и очищает журнал индексов.
+
+        Состояние индексов копируется под блокировкой кэша, а файлы
+        пишутся уже без неё, чтобы не задерживать чтение и запись.
+        """
+        with self._lock:
+            with self._log_lock:
+                consumed = self.index_log.size()
+            snapshots = [(index, index.snapshot()) for index in self.indexes
+                         if index.signature == self._signature and index.saved_signature != index.signature]
+        written = True
+        for index, data in snapshots:
+            if index.write(data):
+                index.saved_signature = data['signature']
+            else:
+                written = False
+        if written and consumed:
+            # Индексы, не подключенные в этом процессе, потом будут перестроены
+            with self._log_lock:
+                self.index_log.discard(consumed)
+        if snapshots:
+            logging.info(f"Снимки индексов записаны: {len(snapshots)}")
+        for listener in self.checkpoint_listeners:
+            listener()
+        return written
+
+    def refresh(self):
+        """Перечитывает хранилище, если оно изменилось на диске"""
+        with self._lock:
+            signature = self.store.signature()
+            if self._loaded and signature == self._signature:
+                return False
+
+            headers, rows = self.store.load()
+            self.headers = headers
+            self.rows = rows
+            self.positions = {}
+            for position, row in enumerate(rows):
+                self.positions.setdefault(record_key(row[0]), position)
+            self.typed = TypedRecords(rows)
+            self._signature = signature
+            self._loaded = True
+            self.version += 1
+            logging.info(f"Кэш записей загружен: {len(rows)} записей")
+            if self.typed.errors:
+                logging.warning(f"Значения не разобраны в {len(self.typed.errors)} записях: "
+                                f"{parse_error_summary(self.typed.errors, rows)}")
+            return True
+
+    def load(self):
+        """Заголовки и снимок списка записей"""
+        with self._lock:
+            self.refresh()
+            return self.headers, list(self.rows)
+
+    def load_typed(self):
+        """Снимок списка записей и копия их типизированных столбцов"""
+        with self._lock:
+            self.refresh()
+            return list(self.rows), self.typed.copy()
+
+    def get(self, record_id):
+        with self._lock:
+            if not self._loaded:
+                # Пока кэш не загружен, читаем из хранилища одну запись
+                return self.store.get(record_id)
+            self.refresh()
+            position = self.positions.get(record_key(record_id))
+            return self.rows[position] if position is not None else None
+
+    def exists(self, record_id):
+        return self.get(record_id) is not None
+
+    def insert(self, row):
+        """Сохраняет запись в хранилище и добавляет её в кэш"""
+        return self.apply_batch([{'op': 'insert', 'row': list(row)}])[0]
+
+    def update(self, record_id, values):
+        """Сохраняет изменения записи в хранилище и в кэше"""
+        return self.apply_batch([{'op': 'update', 'id': record_key(record_id), 'values': dict(values)}])[0]
+
+    def apply_batch(self, operations):
+        """Записывает пачку операций в хранилище и применяет их к кэшу.
+
+        Индексы, актуальные до записи, обновляются инкрементально; их
+        изменения дописываются одной строкой в журнал индексов.
+        """
+        with self._lock:
+            self.refresh()
+            signature_before = self._signature
+
+            # Вставки существующих ID и правки несуществующих записей в хранилище не отправляем
+            known = set(self.positions)
+            accepted = []
+            for operation in operations:
+                key = operation_key(operation)
+                if operation['op'] == 'insert':
+                    accepted.append(key not in known)
+                    known.add(key)
+                else:
+                    accepted.append(key in known)
+            written = iter(self.store.apply_batch(
+                [operation for operation, ok in zip(operations, accepted) if ok]))
+            results = [next(written) if ok else False for ok in accepted]
+            if not any(results):
+                return results
+            self._signature = self.store.signature()
+
+            indexes = [index for index in self.indexes if index.signature == signature_before]
+            events = []
+            for operation, result in zip(operations, results):
+                if not result:
+                    continue
+                if operation['op'] == 'insert':
+                    event = self._apply_insert(operation['row'], indexes)
+                else:
+                    event = self._apply_update(operation['id'], operation['values'], indexes)
+                if event is not None:
+                    events.append(event)
+            for index in indexes:
+                index.signature = self._signature
+            self._log_indexes(signature_before, self._signature, events)
+            self.version += 1
+            return results
+
+    def _apply_insert(self, row, indexes):
+        row = normalize_row(row)
+        key = record_key(row[0])
+        if key in self.positions:
+            # Существующая запись вставкой не заменяется
+            logging.warning(f"Запись {key} уже существует")
+            return None
+        position = len(self.rows)
+        self.positions[key] = position
+        self.rows.append(row)
+        self.typed.set_row(position, row)
+        for index in indexes:
+            index.on_insert(position, row)
+        return [position, None, row]
+
+    def _apply_update(self, record_id, values, indexes):
+        position = self.positions.get(record_key(record_id))
+        if position is None:
+            return None
+        # Строка заменяется целиком, чтобы читатели не видели её наполовину измененной
+        old_row = self.rows[position]
+        row = list(old_row)
+        for field, value in values.items():
+            row[HEADERS.index(field)] = value
+        self.rows[position] = row
+        self.typed.set_row(position, row)
+        for index in indexes:
+            index.on_update(position, old_row, row)
+        return [position, old_row, row]
+
+
+class WriteCoalescer:
+    """Групповая запись: собирает вставки и правки и пишет их пачкой.
+
+    Пачка уходит в хранилище, когда с первой операции прошло
+    WRITE_BATCH_WINDOW секунд или набралось WRITE_BATCH_SIZE операций.
+    Каждый вызывающий получает свой Future с результатом операции.
+    """
+
+    def __init__(self, cache, window=WRITE_BATCH_WINDOW, max_batch=WRITE_BATCH_SIZE):
+        self.cache = cache
+        self.window = window
+        self.max_batch = max_batch
+        self._pending = []
+        self._busy = False
+        # Число ожидающих flush: пока они есть, пачка уходит без окна ожидания
+        self._flushing = 0
+        self._thread = None
+        self._condition = threading.Condition()
+
+    def submit_insert(self, row):
+        return self._submit({'op': 'insert', 'row': list(row)})
+
+    def submit_update(self, record_id, values):
+        return self._submit({'op': 'update', 'id': record_key(record_id), 'values': dict(values)})
+
+    def _submit(self, operation):
+        future = Future()
+        with self._condition:
+            self._pending.append((operation, future))
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run, name="WriteCoalescer", daemon=True)
+                self._thread.start()
+            self._condition.notify_all()
+        return future
+
+    def flush(self):
+        """Дожидается записи всех поставленных в очередь операций"""
+        with self._condition:
+            self._flushing += 1
+            try:
+                self._condition.notify_all()
+                while self._pending or self._busy:
+                    self._condition.wait(self.window)
+            finally:
+                self._flushing -= 1
+
+    def _run(self):
+        while True:
+            with self._condition:
+                while not self._pending:
+                    self._condition.wait()
+                deadline = monotonic() + self.window
+                while len(self._pending) < self.max_batch and not self._flushing:
+                    remaining = deadline - monotonic()
+                    if remaining <= 0:
+                        break
+                    self._condition.wait(remaining)
+                batch = self._pending[:self.max_batch]
+                del self._pending[:self.max_batch]
+                self._busy = True
+
+            try:
+                self._write(batch)
+            finally:
+                with self._condition:
+                    self._busy = False
+                    self._condition.notify_all()
+
+    def _write(self, batch):
+        try:
+            results = self.cache.apply_batch([operation for operation, _ in batch])
+        except Exception as e:
+            logging.error(f"Ошибка при групповой записи: {str(e)}")
+            results = [False] * len(batch)
+        logging.info(f"Групповая запись: операций {len(batch)}, успешно {sum(map(bool, results))}")
+        for (_, future), result in zip(batch, results):
+            future.set_result(result)
+
+
+_store = None
+_cache = None
+_coalescer = None
+_store_lock = threading.Lock()
+
+
+def get_store():
+    """Общее для процесса хранилище записей"""
+    global _store
+    with _store_lock:
+        if _store is None:
+            if STORAGE_BACKEND == 'sqlite':
+                if not os.path.exists(DATABASE_FILENAME) and os.path.exists(EXCEL_FILENAME):
+                    migrate_excel_to_sqlite(EXCEL_FILENAME, DATABASE_FILENAME)
+                _store = SQLiteRecordStore(DATABASE_FILENAME)
+            else:
+                _store = ExcelRecordStore(EXCEL_FILENAME)
+        return _store
+
+
+def get_record_cache():
+    """Общий для процесса кэш записей"""
+    global _cache
+    store = get_store()
+    with _store_lock:
+        if _cache is None:
+            _cache = RecordCache(store)
+        return _cache
+
+
+def get_write_coalescer():
+    """Общая для процесса очередь групповой записи"""
+    global _coalescer
+    cache = get_record_cache()
+    with _store_lock:
+        if _coalescer is None:
+            _coalescer = WriteCoalescer(cache)
+        return _coalescer
+
+
+def compact_storage(full=False):
+    """Сжатие хранилища и снимки индексов; вызывается периодически и при выходе"""
+    compacted = get_store().compact(full)
+    get_record_cache().checkpoint()
+    return compacted
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Обслуживание хранилища журнала плавки")
+    commands = parser.add_subparsers(dest='command', required=True)
+    migrate = commands.add_parser('migrate', help="Перенести plavka.xlsx в базу SQLite")
+    migrate.add_argument('--xlsx', default=EXCEL_FILENAME)
+    migrate.add_argument('--db', default=DATABASE_FILENAME)
+    export = commands.add_parser('export', help="Выгрузить базу SQLite в plavka.xlsx")
+    export.add_argument('--db', default=DATABASE_FILENAME)
+    export.add_argument('--xlsx', default=EXCEL_FILENAME)
+    maintain = commands.add_parser('maintain', help="Сжать журнал и пересчитать ширину столбцов plavka.xlsx")
+    maintain.add_argument('--xlsx', default=EXCEL_FILENAME)
+    args = parser.parse_args(argv)
+
+    if args.command == 'migrate':
+        imported = migrate_excel_to_sqlite(args.xlsx, args.db)
+        print(f"Перенесено записей: {imported}")
+    elif args.command == 'export':
+        store = SQLiteRecordStore(args.db)
+        try:
+            export_records_to_excel(store, args.xlsx)
+        finally:
+            store.close()
+        print(f"Записи выгружены в {args.xlsx}")
+    elif args.command == 'maintain':
+        ExcelRecordStore(args.xlsx).compact(full=True)
+        print(f"Обслуживание {args.xlsx} завершено")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,311 @@
+import re
+import zipfile
+import posixpath
+from datetime import datetime, timedelta
+from xml.etree.ElementTree import iterparse, fromstring
+
+# Потоковое чтение листа xlsx без объектов ячеек openpyxl.
+# Поддерживается только то, что встречается в plavka.xlsx: строки из
+# sharedStrings, встроенные строки, числа, логические значения и даты по
+# числовому формату. Формулы и прочие особенности вызывают
+# UnsupportedWorkbook - в этом случае читать нужно через openpyxl.
+
+MAIN_NS = '{http://schemas.openxmlformats.org/spreadsheetml/2006/main}'
+REL_NS = '{http://schemas.openxmlformats.org/officeDocument/2006/relationships}'
+PACKAGE_REL_NS = '{http://schemas.openxmlformats.org/package/2006/relationships}'
+
+ROW_TAG = MAIN_NS + 'row'
+CELL_TAG = MAIN_NS + 'c'
+VALUE_TAG = MAIN_NS + 'v'
+FORMULA_TAG = MAIN_NS + 'f'
+INLINE_STRING_TAG = MAIN_NS + 'is'
+TEXT_TAG = MAIN_NS + 't'
+PHONETIC_TAG = MAIN_NS + 'rPh'
+SHARED_STRING_TAG = MAIN_NS + 'si'
+
+# Встроенные числовые форматы дат и времени
+BUILTIN_DATE_FORMATS = set(range(14, 23)) | {45, 46, 47}
+
+WINDOWS_EPOCH = datetime(1899, 12, 30)
+MAC_EPOCH = datetime(1904, 1, 1)
+
+_COLUMN_RE = re.compile(r'([A-Z]+)(\d+)')
+
+
+class UnsupportedWorkbook(Exception):
+    """Книга использует возможности формата, которые читатель не поддерживает"""
+
+
+def column_index(letters):
+    """Номер столбца с нуля по буквам: A -> 0, AG -> 32"""
+    index = 0
+    for letter in letters:
+        index = index * 26 + ord(letter) - 64
+    return index - 1
+
+
+def _text(element):
+    # Текст строки без фонетических подсказок (rPh)
+    parts = []
+    for child in element.iter():
+        if child.tag == TEXT_TAG and child.text:
+            parts.append(child.text)
+        elif child.tag == PHONETIC_TAG:
+            raise UnsupportedWorkbook("Фонетические подсказки в строках")
+    return ''.join(parts)
+
+
+def _cast_number(text):
+    if '.' in text or 'E' in text or 'e' in text:
+        return float(text)
+    return int(text)
+
+
+def _is_date_format(code):
+    # Убираем строки в кавычках, экранирование и цвета/условия в скобках
+    code = re.sub(r'"[^"]*"|\\.|_.|\*.', '', code)
+    if re.search(r'\[(h|hh|m|mm|s|ss)\]', code, re.IGNORECASE):
+        raise UnsupportedWorkbook(f"Формат длительности {code}")
+    code = re.sub(r'\[[^\]]*\]', '', code)
+    return re.search(r'[dmyhs]', code, re.IGNORECASE) is not None
+
+
+class XlsxReader:
+    """Читатель первого листа книги xlsx"""
+
+    def __init__(self, source):
+        self.archive = zipfile.ZipFile(source)
+        self.epoch = WINDOWS_EPOCH
+        self.sheet_path, strings_path, styles_path = self._locate_parts()
+        self.date_styles = self._read_styles(styles_path)
+        self.strings_path = strings_path
+        self._shared_strings = None
+
+    def close(self):
+        self.archive.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def _locate_parts(self):
+        workbook = fromstring(self.archive.read('xl/workbook.xml'))
+        properties = workbook.find(MAIN_NS + 'workbookPr')
+        if properties is not None and properties.get('date1904') in ('1', 'true'):
+            self.epoch = MAC_EPOCH
+
+        sheet = workbook.find(f'{MAIN_NS}sheets/{MAIN_NS}sheet')
+        if sheet is None:
+            raise UnsupportedWorkbook("В книге нет листов")
+        sheet_id = sheet.get(REL_NS + 'id')
+
+        targets = {}
+        relations = fromstring(self.archive.read('xl/_rels/workbook.xml.rels'))
+        for relation in relations.iter(PACKAGE_REL_NS + 'Relationship'):
+            target = relation.get('Target')
+            if target.startswith('/'):
+                path = target.lstrip('/')
+            else:
+                path = posixpath.normpath(posixpath.join('xl', target))
+            targets[relation.get('Id')] = path
+            kind = relation.get('Type').rsplit('/', 1)[-1]
+            targets.setdefault(kind, path)
+
+        if sheet_id not in targets:
+            raise UnsupportedWorkbook("Не найден файл листа")
+        return targets[sheet_id], targets.get('sharedStrings'), targets.get('styles')
+
+    def _read_styles(self, styles_path):
+        date_styles = set()
+        if styles_path is None:
+            return date_styles
+
+        styles = fromstring(self.archive.read(styles_path))
+        custom = {}
+        formats = styles.find(MAIN_NS + 'numFmts')
+        if formats is not None:
+            for number_format in formats.iter(MAIN_NS + 'numFmt'):
+                custom[int(number_format.get('numFmtId'))] = number_format.get('formatCode', '')
+
+        cell_formats = styles.find(MAIN_NS + 'cellXfs')
+        if cell_formats is None:
+            return date_styles
+        for style_id, xf in enumerate(cell_formats.iter(MAIN_NS + 'xf')):
+            format_id = int(xf.get('numFmtId', 0))
+            if format_id in custom:
+                if _is_date_format(custom[format_id]):
+                    date_styles.add(style_id)
+            elif format_id in BUILTIN_DATE_FORMATS:
+                date_styles.add(style_id)
+        return date_styles
+
+    @property
+    def shared_strings(self):
+        if self._shared_strings is None:
+            self._shared_strings = self.read_shared_strings()
+        return self._shared_strings
+
+    def read_shared_strings(self, limit=None):
+        """Таблица общих строк; limit - прочитать только первые limit строк"""
+        strings = []
+        if self.strings_path is None:
+            return strings
+        with self.archive.open(self.strings_path) as source:
+            for _, element in iterparse(source):
+                if element.tag == SHARED_STRING_TAG:
+                    strings.append(_text(element))
+                    element.clear()
+                    if limit is not None and len(strings) >= limit:
+                        break
+        return strings
+
+    def _convert_date(self, value):
+        day, fraction = divmod(value, 1)
+        delta = timedelta(milliseconds=round(fraction * 86400000))
+        if 0 <= value < 1 and delta.days == 0:
+            return (datetime.min + delta).time()
+        if 0 < value < 60 and self.epoch == WINDOWS_EPOCH:
+            # В Excel 1900 год считается високосным
+            day += 1
+        return self.epoch + timedelta(days=day) + delta
+
+    def _cell_value(self, cell, strings):
+        kind = cell.get('t', 'n')
+        text = None
+        for child in cell:
+            if child.tag == VALUE_TAG:
+                text = child.text
+            elif child.tag == INLINE_STRING_TAG:
+                return _text(child)
+            elif child.tag == FORMULA_TAG:
+                raise UnsupportedWorkbook("Формулы в ячейках")
+
+        if not text:
+            return None
+        if kind == 's':
+            return strings[int(text)]
+        if kind == 'n':
+            value = _cast_number(text)
+            style_id = cell.get('s')
+            if style_id is not None and int(style_id) in self.date_styles:
+                return self._convert_date(value)
+            return value
+        if kind == 'str' or kind == 'e':
+            return text
+        if kind == 'b':
+            return bool(int(text))
+        raise UnsupportedWorkbook(f"Тип ячейки {kind}")
+
+    def _row_values(self, row, strings, width):
+        values = [None] * width if width else []
+        counter = -1
+        for cell in row:
+            if cell.tag != CELL_TAG:
+                continue
+            reference = cell.get('r')
+            if reference:
+                match = _COLUMN_RE.match(reference)
+                counter = column_index(match.group(1))
+            else:
+                counter += 1
+            value = self._cell_value(cell, strings)
+            if width:
+                if counter < width:
+                    values[counter] = value
+            else:
+                if counter >= len(values):
+                    values.extend([None] * (counter + 1 - len(values)))
+                values[counter] = value
+        return tuple(values)
+
+    def iter_rows(self, min_row=1, max_row=None, width=None):
+        """Строки листа кортежами значений, как iter_rows(values_only=True).
+
+        Пропущенные в файле строки возвращаются пустыми, чтобы номер строки
+        совпадал с номером в Excel. width - фиксированная ширина строки.
+        """
+        strings = self.shared_strings
+        expected = 1
+        with self.archive.open(self.sheet_path) as source:
+            for _, element in iterparse(source):
+                if element.tag != ROW_TAG:
+                    continue
+                number = int(element.get('r', expected))
+                if max_row is not None and number > max_row:
+                    element.clear()
+                    for missing in range(max(expected, min_row), max_row + 1):
+                        yield (None,) * (width or 0)
+                    return
+                for missing in range(max(expected, min_row), number):
+                    yield (None,) * (width or 0)
+                if number >= min_row:
+                    yield self._row_values(element, strings, width)
+                expected = number + 1
+                element.clear()
+
+    def read_row(self, row_number, width=None):
+        """Одна строка листа без разбора остальных строк"""
+        with self.archive.open(self.sheet_path) as source:
+            data = source.read()
+        match = re.search(rb'<(?:\w+:)?row\b[^>]*\br="%d"[^>]*?(/?)>' % row_number, data)
+        if match is None:
+            return None
+        if match.group(1):
+            # Пустая строка в виде <row .../>
+            return (None,) * (width or 0)
+        end = re.compile(rb'</(?:\w+:)?row>').search(data, match.end())
+        if end is None:
+            raise UnsupportedWorkbook(f"Не найден конец строки {row_number}")
+
+        # Фрагмент разбираем внутри открывающего тега корня, чтобы
+        # сохранить объявления пространств имен; объявление <?xml?> может отсутствовать
+        root = re.search(rb'<([\w:]+)\b[^>]*>', data)
+        fragment = data[match.start():end.end()]
+        row = fromstring(root.group(0) + fragment + b'</' + root.group(1) + b'>')[0]
+
+        strings = self._shared_strings
+        if strings is None:
+            needed = [int(cell.findtext(VALUE_TAG)) for cell in row.iter(CELL_TAG)
+                      if cell.get('t') == 's' and cell.findtext(VALUE_TAG)]
+            strings = self.read_shared_strings(limit=max(needed) + 1) if needed else []
+        return self._row_values(row, strings, width)
+
+
+def read_rows(source, min_row=1, width=None):
+    """Все строки первого листа начиная с min_row"""
+    with XlsxReader(source) as reader:
+        return list(reader.iter_rows(min_row=min_row, width=width))
+
+
+def read_columns(source, min_row=1, width=None):
+    """Значения листа по столбцам: список списков"""
+    rows = read_rows(source, min_row=min_row, width=width)
+    if not rows:
+        return [[] for _ in range(width or 0)]
+    count = width or max(len(row) for row in rows)
+    return [[row[column] if column < len(row) else None for row in rows]
+            for column in range(count)]
+
+
+def read_row(source, row_number, width=None):
+    """Одна строка первого листа или None"""
+    with XlsxReader(source) as reader:
+        return reader.read_row(row_number, width=width)
+
+
+CUSTOM_PROPERTIES_PATH = 'docProps/custom.xml'
+CUSTOM_PROPERTIES_NS = '{http://schemas.openxmlformats.org/officeDocument/2006/custom-properties}'
+
+
+def read_custom_property(source, name):
+    """Значение пользовательского свойства книги (docProps/custom.xml) или None"""
+    with zipfile.ZipFile(source) as archive:
+        if CUSTOM_PROPERTIES_PATH not in archive.namelist():
+            return None
+        properties = fromstring(archive.read(CUSTOM_PROPERTIES_PATH))
+    for item in properties.iter(CUSTOM_PROPERTIES_NS + 'property'):
+        if item.get('name') == name and len(item):
+            return item[0].text
+    return None
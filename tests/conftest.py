@@ -0,0 +1,36 @@
+import os
+import sys
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import plavka_storage
+import plavka_records
+import plavka_analytics
+from plavka_storage import HEADERS
+
+
+def make_row(record_id, day=1, number=None, **values):
+    """Строка листа с датой 'dd.01.2024' и номером плавки по порядку"""
+    row = [None] * len(HEADERS)
+    row[0] = record_id
+    row[2] = f"{day:02d}.01.2024"
+    row[3] = number or f"1-{record_id}"
+    for field, value in values.items():
+        row[HEADERS.index(field)] = value
+    return row
+
+
+@pytest.fixture
+def workdir(tmp_path, monkeypatch):
+    """Пустой рабочий каталог и сброшенное общее состояние модулей: хранилище,
+    кэш, очередь записи, таблица кодов, столбцы записей и кэш результатов"""
+    monkeypatch.chdir(tmp_path)
+    monkeypatch.setattr(plavka_storage, '_store', None)
+    monkeypatch.setattr(plavka_storage, '_cache', None)
+    monkeypatch.setattr(plavka_storage, '_coalescer', None)
+    monkeypatch.setattr(plavka_records, '_code_table', None)
+    monkeypatch.setattr(plavka_analytics, '_columns', None)
+    monkeypatch.setattr(plavka_analytics, '_columns_version', None)
+    monkeypatch.setattr(plavka_analytics, '_result_cache', plavka_analytics.ResultCache())
+    return tmp_path
@@ -0,0 +1,212 @@
+import os
+from datetime import date
+import threading
+import numpy as np
+import pytest
+from conftest import make_row
+from plavka_storage import ExcelRecordStore, RecordCache, EXCEL_FILENAME
+from plavka_index import PersistentIndex, ParticipantIndex, PlavkaNumberIndex, TrigramIndex
+from plavka_analytics import RunningAggregates, RecordColumns, compute_statistics
+from plavka_records import CodeTable
+from plavka_query import plan_query
+
+
+@pytest.fixture
+def cache(workdir):
+    cache = RecordCache(ExcelRecordStore(str(workdir / EXCEL_FILENAME)))
+    cache.insert(make_row('1', Старший_смены_плавки='Белков', Плавка_температура_заливки_A=1500))
+    cache.insert(make_row('2', Старший_смены_плавки='Левин', Плавка_температура_заливки_A=1520))
+    return cache
+
+
+def attach(cache, index_class):
+    return cache.ensure_index(cache.add_index(index_class(cache.store.file_name)))
+
+
+@pytest.mark.parametrize('index_class, read', [
+    (ParticipantIndex, lambda index: index.counts()),
+    (RunningAggregates, lambda index: index.statistics()),
+    (RunningAggregates, lambda index: index.rollup(('sector',))),
+    (PlavkaNumberIndex, lambda index: index.next_number(2024, 1)),
+])
+def test_index_reads_wait_for_writer(cache, index_class, read):
+    index = attach(cache, index_class)
+    assert index.lock is cache._lock
+
+    finished = threading.Event()
+    reader = threading.Thread(target=lambda: (read(index), finished.set()))
+    # Пока пишущий поток держит блокировку кэша, чтение индекса ждет
+    with cache._lock:
+        reader.start()
+        assert not finished.wait(0.1)
+    reader.join(1)
+    assert finished.is_set()
+
+
+def test_aggregates_follow_cache_writes(cache):
+    aggregates = attach(cache, RunningAggregates)
+    participants = attach(cache, ParticipantIndex)
+    cache.insert(make_row('3', Старший_смены_плавки='белков', Плавка_температура_заливки_A=1540))
+
+    assert aggregates.statistics()['sectors']['A']['count'] == 3
+    assert participants.counts() == {'Белков': 2, 'Левин': 1}
+
+
+def test_statistics_count_participants_like_participant_index(cache):
+    aggregates = attach(cache, RunningAggregates)
+    participants = attach(cache, ParticipantIndex)
+    cache.insert(make_row('3', Старший_смены_плавки='белков ', Первый_участник_смены_плавки='ЛЕВИН'))
+    rows, typed = cache.load_typed()
+    columns = RecordColumns(rows, typed=typed)
+
+    stats = compute_statistics(columns, np.ones(len(rows), dtype=bool))
+    assert stats['participant_count'] == len(participants.counts()) == 2
+    assert stats['participants'] == ['Белков', 'Левин']
+    assert aggregates.statistics()['participants'] == ['Белков', 'Левин']
+    assert aggregates.statistics()['participant_count'] == 2
+
+
+def test_aggregate_participant_counts_match_participant_index(cache):
+    aggregates = attach(cache, RunningAggregates)
+    participants = attach(cache, ParticipantIndex)
+    cache.insert(make_row('3', Старший_смены_плавки='Белков', Первый_участник_смены_плавки='белков'))
+    cache.update('2', {"Второй_участник_смены_плавки": 'Ермаков'})
+
+    assert aggregates.statistics()['participant_counts'] == participants.counts() == \
+        {'Белков': 2, 'Ермаков': 1, 'Левин': 1}
+
+
+def test_code_table_saved_on_checkpoint_not_on_read(cache):
+    table = CodeTable(str(cache.store.file_name) + '.codes.json')
+    cache.checkpoint_listeners.append(table.save)
+    RecordColumns(cache.load_typed()[0], code_table=table)
+    assert not os.path.exists(table.path)
+
+    cache.checkpoint()
+    reloaded = CodeTable(table.path)
+    assert reloaded.load()
+    assert reloaded.code('participants', ' БЕЛКОВ') == table.code('participants', 'Белков')
+
+
+def test_crew_intersects_and_unites_participant_bitmaps(cache):
+    participants = attach(cache, ParticipantIndex)
+    cache.insert(make_row('3', Старший_смены_плавки='Левин', Первый_участник_смены_плавки='белков'))
+
+    assert participants.crew(all_of=['Белков', 'ЛЕВИН']) == 0b100
+    assert participants.crew(any_of=['Белков', 'Левин']) == 0b111
+    assert participants.crew(all_of=['Левин'], within=0b011) == 0b010
+    assert participants.crew(all_of=['Ермаков']) == 0
+
+
+def test_crew_member_query_uses_participant_index(cache):
+    participants = attach(cache, ParticipantIndex)
+    rows, typed = cache.load_typed()
+    plan = plan_query('участник:белков|левин', RecordColumns(rows, typed=typed), participant_index=participants)
+
+    assert "индекс участников" in plan.explain()
+    assert plan.cursor().count() == [0, 1]
+
+
+def fresh_cache(cache):
+    """Кэш нового процесса поверх тех же файлов"""
+    return RecordCache(ExcelRecordStore(cache.store.file_name))
+
+
+def test_writes_log_index_changes_instead_of_snapshots(cache, monkeypatch):
+    trigrams = attach(cache, TrigramIndex)
+    aggregates = attach(cache, RunningAggregates)
+    snapshot_time = os.stat(trigrams.path).st_mtime_ns
+
+    cache.insert(make_row('3', Наименование_отливки='Ригель', Плавка_температура_заливки_A=1540))
+    cache.update('1', {"Наименование_отливки": 'Вороток'})
+    assert os.stat(trigrams.path).st_mtime_ns == snapshot_time
+    assert cache.index_log.size() > 0
+
+    # Другой процесс доводит снимки по журналу индексов, не перестраивая их
+    reopened = fresh_cache(cache)
+    monkeypatch.setattr(PersistentIndex, 'rebuild', lambda index, rows: pytest.fail("перестроение"))
+    loaded_trigrams = attach(reopened, TrigramIndex)
+    loaded_aggregates = attach(reopened, RunningAggregates)
+    assert loaded_trigrams.candidates('ригель') == trigrams.candidates('ригель') == {2}
+    assert loaded_trigrams.candidates('вороток') == {0}
+    assert loaded_aggregates.statistics() == aggregates.statistics()
+
+
+def test_checkpoint_writes_snapshots_and_clears_log(cache, monkeypatch):
+    trigrams = attach(cache, TrigramIndex)
+    cache.insert(make_row('3', Наименование_отливки='Ригель'))
+    assert cache.store.compact()
+    assert cache.checkpoint()
+    assert cache.index_log.size() == 0
+    assert trigrams.saved_signature == trigrams.signature == cache.store.signature()
+
+    reopened = fresh_cache(cache)
+    monkeypatch.setattr(PersistentIndex, 'rebuild', lambda index, rows: pytest.fail("перестроение"))
+    assert attach(reopened, TrigramIndex).candidates('ригель') == {2}
+
+
+def test_casting_filters_compare_like_participants(cache):
+    aggregates = attach(cache, RunningAggregates)
+    cache.update('1', {"Наименование_отливки": 'Вороток'})
+    cache.update('2', {"Наименование_отливки": ' ВОРОТОК'})
+    cache.insert(make_row('3', Наименование_отливки='Ригель'))
+    rows, typed = cache.load_typed()
+    columns = RecordColumns(rows, typed=typed)
+
+    assert columns.filter_mask(casting='вороток').tolist() == [True, True, False]
+    assert plan_query('отливка:вороток', columns).cursor().count() == [0, 1]
+    assert compute_statistics(columns, columns.filter_mask(casting='вороток'))['casting_types'] == {'Вороток': 2}
+    assert aggregates.statistics(casting='вороток')['casting_types'] == {'Вороток': 2}
+    assert aggregates.record_counts(('casting',)) == {('Вороток',): 2, ('Ригель',): 1}
+
+
+def assert_same_summary(actual, expected):
+    assert actual.keys() == expected.keys()
+    percentiles = expected.pop('percentiles', {})
+    assert actual.pop('percentiles', {}) == pytest.approx(percentiles)
+    assert actual == pytest.approx(expected)
+
+
+def test_aggregate_percentiles_match_numpy_after_updates(cache):
+    aggregates = attach(cache, RunningAggregates)
+    rng = np.random.default_rng(5)
+    for number in range(3, 40):
+        cache.insert(make_row(str(number), day=number % 28 + 1,
+                              Плавка_температура_заливки_A=int(rng.integers(1480, 1600)),
+                              Плавка_температура_заливки_C=float(rng.integers(1480, 1600))))
+    # Правка вычитает старые значения: повторы и удаленные замеры меняют процентили
+    cache.update('5', {"Плавка_температура_заливки_A": 1500})
+    cache.update('6', {"Плавка_температура_заливки_C": None})
+    rows, typed = cache.load_typed()
+    columns = RecordColumns(rows, typed=typed)
+
+    expected = compute_statistics(columns, np.ones(len(rows), dtype=bool))
+    actual = aggregates.statistics()
+    for sector in ('A', 'C', 'D'):
+        assert_same_summary(actual['sectors'][sector], expected['sectors'][sector])
+    assert_same_summary(actual['overall'], expected['overall'])
+    assert actual['sectors']['C']['count'] == 36
+
+
+def test_rollup_sums_cells_by_requested_dimensions(cache):
+    aggregates = attach(cache, RunningAggregates)
+    cache.update('1', {"Наименование_отливки": 'Вороток', "Плавка_температура_заливки_B": 1600})
+    cache.insert(make_row('3', Наименование_отливки='ригель', Плавка_дата='03.02.2024',
+                          Плавка_температура_заливки_A=1560))
+    cache.insert(make_row('4', Наименование_отливки='Ригель', Плавка_дата='10.02.2024',
+                          Плавка_температура_заливки_A=1580, Плавка_температура_заливки_B=1590))
+
+    assert aggregates.rollup() == {(): {'count': 6, 'sum': 9350.0, 'min': 1500, 'max': 1600,
+                                        'mean': pytest.approx(9350 / 6)}}
+    by_month = aggregates.rollup(('month', 'sector'))
+    assert {key: summary['count'] for key, summary in by_month.items()} == \
+        {('2024-01', 'A'): 2, ('2024-01', 'B'): 1, ('2024-02', 'A'): 2, ('2024-02', 'B'): 1}
+    assert by_month[('2024-02', 'A')]['mean'] == 1570
+
+    february = date(2024, 2, 1).toordinal()
+    assert aggregates.rollup(('casting',), date_from=february, sector='A') == \
+        {('ригель',): {'count': 2, 'sum': 3140.0, 'min': 1560, 'max': 1580, 'mean': 1570.0}}
+    assert aggregates.rollup(('sector',), casting='ВОРОТОК') == \
+        {('A',): {'count': 1, 'sum': 1500.0, 'min': 1500, 'max': 1500, 'mean': 1500.0},
+         ('B',): {'count': 1, 'sum': 1600.0, 'min': 1600, 'max': 1600, 'mean': 1600.0}}
+    assert aggregates.record_counts(('month',)) == {('2024-01',): 2, ('2024-02',): 2}
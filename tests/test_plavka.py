@@ -0,0 +1,197 @@
+import importlib
+import os
+import pytest
+from conftest import make_row
+
+os.environ.setdefault('QT_QPA_PLATFORM', 'offscreen')
+QtWidgets = pytest.importorskip('PySide6.QtWidgets')
+from PySide6.QtCore import Qt
+
+
+@pytest.fixture
+def plavka(workdir):
+    app = QtWidgets.QApplication.instance() or QtWidgets.QApplication([])
+    # Модуль импортируется в рабочем каталоге теста: он настраивает журнал plavka.log
+    module = importlib.import_module('plavka')
+    yield module
+    app.processEvents()
+
+
+def test_sort_keeps_empty_values_last(plavka):
+    model = plavka.SearchResultsModel()
+    model.append_rows([make_row('1', Номер_кластера='2'), make_row('2'), make_row('3', Номер_кластера='9')])
+    model.set_all_columns(True)
+    column = model.columns.index(plavka.HEADERS.index("Номер_кластера"))
+
+    model.sort(column, Qt.AscendingOrder)
+    assert [model.record_id(row) for row in range(3)] == ['1', '3', '2']
+    model.sort(column, Qt.DescendingOrder)
+    assert [model.record_id(row) for row in range(3)] == ['3', '1', '2']
+
+
+def test_export_writes_all_pages(plavka, workdir, monkeypatch):
+    from plavka_query import PAGE_SIZE
+    from plavka_storage import get_record_cache
+    total = PAGE_SIZE * 2 + 5
+    cache = get_record_cache()
+    assert all(cache.apply_batch([{'op': 'insert', 'row': make_row(str(number), day=number % 28 + 1)}
+                                  for number in range(total)]))
+
+    dialog = plavka.SearchDialog()
+    dialog.date_from.setDate(plavka.QDate(2024, 1, 1))
+    dialog.search_records()
+
+    target = workdir / 'export.csv'
+    monkeypatch.setattr(plavka.QFileDialog, 'getSaveFileName',
+                        lambda *args: (str(target), "CSV files (*.csv)"))
+    monkeypatch.setattr(plavka.QMessageBox, 'information', lambda *args: None)
+    dialog.export_results()
+
+    with open(target, encoding='utf-8') as exported:
+        assert len(exported.read().splitlines()) == total + 1
+    dialog.done(0)
+
+
+def test_edit_dialog_saves_real_row_unchanged(plavka, workdir, monkeypatch):
+    import shutil
+    from plavka_storage import get_record_cache
+    shutil.copy(os.path.join(os.path.dirname(os.path.dirname(__file__)), 'plavka.xlsx'), workdir)
+    _, rows = get_record_cache().load()
+    original = rows[0]
+
+    messages = []
+    for name in ('information', 'warning', 'critical'):
+        monkeypatch.setattr(plavka.QMessageBox, name,
+                            lambda parent, title, text, name=name: messages.append((name, text)))
+    dialog = plavka.EditRecordDialog(str(original[0]))
+    assert dialog.Плавка_время_прогрева_ковша_B.text() in ('', ':')
+    dialog.save_changes()
+
+    assert messages == [('information', "Изменения сохранены")]
+    saved = get_record_cache().get(original[0])
+    assert [plavka.field_text(value) for value in saved] == [plavka.field_text(value) for value in original]
+
+
+def test_backup_runs_in_background_with_journaled_records(plavka, workdir, monkeypatch):
+    from plavka_storage import ExcelRecordStore, get_store
+    store = get_store()
+    assert store.insert(make_row('1'))
+    assert store.insert(make_row('2'))
+
+    messages = []
+    monkeypatch.setattr(plavka.QMessageBox, 'information', lambda parent, title, text: messages.append(text))
+    dialog = plavka.SearchDialog()
+    dialog.create_backup()
+    assert not dialog.backup_button.isEnabled()
+    dialog.backup_pool.waitForDone()
+    QtWidgets.QApplication.processEvents()
+
+    assert dialog.backup_button.isEnabled()
+    backups = os.listdir(workdir / plavka.BACKUP_DIR)
+    _, rows = ExcelRecordStore(str(workdir / plavka.BACKUP_DIR / backups[0])).load()
+    assert [row[0] for row in rows] == ['1', '2'] and len(messages) == 1
+    dialog.done(0)
+
+
+def test_statistics_by_aggregates_skip_record_columns(plavka, monkeypatch):
+    from plavka_storage import get_record_cache
+    cache = get_record_cache()
+    cache.insert(make_row('1', Старший_смены_плавки='Белков', Первый_участник_смены_плавки='белков'))
+    cache.insert(make_row('2', Старший_смены_плавки='Левин', Плавка_температура_заливки_A=1500))
+
+    dialog = plavka.SearchDialog()
+    dialog.date_from.setDate(plavka.QDate(2024, 1, 1))
+    dialog.date_to.setDate(plavka.QDate(2024, 1, 31))
+    with monkeypatch.context() as patch:
+        patch.setattr(plavka, 'get_record_columns', lambda: pytest.fail("столбцы записей"))
+        dialog.update_statistics()
+    report = dialog.stats_text.toPlainText()
+    assert "Количество участников: 2" in report
+    assert report.endswith("=== Плавки по участникам смены ===\nБелков: 1\nЛевин: 1")
+
+    # Фильтр температуры - подсчет по столбцам записей
+    dialog.temp_from.setText("1400")
+    dialog.temp_to.setText("1600")
+    dialog.update_statistics()
+    report = dialog.stats_text.toPlainText()
+    assert "Количество участников: 1" in report
+    assert report.endswith("=== Плавки по участникам смены ===\nЛевин: 1")
+    dialog.done(0)
+
+
+def search_dialog(plavka, rows):
+    from plavka_storage import get_record_cache
+    assert all(get_record_cache().apply_batch([{'op': 'insert', 'row': row} for row in rows]))
+    dialog = plavka.SearchDialog()
+    dialog.date_from.setDate(plavka.QDate(2024, 1, 1))
+    return dialog
+
+
+def test_search_plans_and_streams_pages_off_the_gui_thread(plavka, monkeypatch):
+    import threading
+    from plavka_query import PAGE_SIZE
+    dialog = search_dialog(plavka, [make_row(str(number), Комментарий='трещина')
+                                    for number in range(PAGE_SIZE * 3)])
+    threads = []
+    plan_query = plavka.plan_query
+    monkeypatch.setattr(plavka, 'plan_query',
+                        lambda *args, **kwargs: threads.append(threading.current_thread()) or
+                        plan_query(*args, **kwargs))
+    pages = []
+    dialog.results_model.rowsInserted.connect(lambda parent, first, last: pages.append(last - first + 1))
+
+    dialog.search_input.setText("трещ")
+    dialog.search_records()
+    dialog.wait_search()
+    assert threads and threading.main_thread() not in threads
+    assert pages == [PAGE_SIZE, PAGE_SIZE * 2]
+    assert dialog.results_count.text() == f"Найдено: {PAGE_SIZE * 3}"
+    dialog.done(0)
+
+
+def test_new_query_cancels_previous_search(plavka):
+    dialog = search_dialog(plavka, [make_row('1', Комментарий='трещина'), make_row('2', Комментарий='скол')])
+    dialog.search_input.setText("трещина")
+    dialog.search_records()
+    first = dialog.search_worker
+    dialog.search_input.setText("скол")
+    dialog.search_records()
+    assert first.cancelled.is_set()
+
+    dialog.wait_search()
+    assert [dialog.results_model.record_id(row) for row in range(dialog.results_model.rowCount())] == ['2']
+    assert dialog.last_search['text'] == "скол"
+    dialog.done(0)
+
+
+def test_query_syntax_error_is_shown_without_dialog(plavka):
+    dialog = search_dialog(plavka, [make_row('1')])
+    dialog.search_input.setText("темп.A>абв")
+    dialog.search_records()
+    dialog.wait_search()
+    assert dialog.results_count.text().startswith("Ошибка в запросе")
+    dialog.done(0)
+
+
+def test_sorted_results_stay_sorted_while_pages_stream_in(plavka, monkeypatch):
+    from plavka_query import PAGE_SIZE
+    total = PAGE_SIZE * 3
+    dialog = search_dialog(plavka, [make_row(str(number), Номер_кластера=str(number * 7 % 50) if number % 5 else None)
+                                    for number in range(total)])
+    model = dialog.results_model
+    model.set_all_columns(True)
+    column = model.columns.index(plavka.HEADERS.index("Номер_кластера"))
+    computed = []
+    sort_key_function = plavka.sort_key_function
+    monkeypatch.setattr(plavka, 'sort_key_function', lambda sheet_column: (
+        lambda value, key=sort_key_function(sheet_column): computed.append(value) or key(value)))
+    dialog.results_table.sortByColumn(column, Qt.DescendingOrder)
+
+    dialog.search_records()
+    dialog.wait_search()
+    streamed = [model.record_id(row) for row in range(model.rowCount())]
+    assert len(streamed) == total and len(computed) == total
+
+    model.sort(column, Qt.DescendingOrder)
+    assert [model.record_id(row) for row in range(model.rowCount())] == streamed
+    dialog.done(0)
@@ -0,0 +1,147 @@
+from datetime import date
+import pytest
+from conftest import make_row
+from plavka_analytics import RecordColumns
+from plavka_index import TrigramIndex, ParticipantIndex
+from plavka_query import (QuerySyntaxError, DateRange, CategoryEquals, CrewMember, TemperatureRange,
+                          TextContains, parse_query, parse_date_bound, is_plain_text, plan_query,
+                          explain_query)
+
+
+def ordinal(year, month, day):
+    return date(year, month, day).toordinal()
+
+
+@pytest.fixture
+def rows():
+    return [
+        make_row('1', day=5, Наименование_отливки='Ригель', Старший_смены_плавки='Иванов',
+                 Плавка_температура_заливки_A=1560, Комментарий='трещина по краю'),
+        make_row('2', day=10, Наименование_отливки='Вороток', Старший_смены_плавки='Петров',
+                 Плавка_температура_заливки_A=1550, Плавка_температура_заливки_B=1600),
+        make_row('3', day=20, Наименование_отливки='Вороток', Первый_участник_смены_плавки='Иванов',
+                 Плавка_температура_заливки_B=1500, Комментарий='без замечаний'),
+    ]
+
+
+@pytest.fixture
+def columns(rows):
+    return RecordColumns(rows)
+
+
+@pytest.fixture
+def trigrams(rows, workdir):
+    index = TrigramIndex(str(workdir / 'plavka.xlsx'))
+    index.rebuild(rows)
+    return index
+
+
+def found(text, columns, trigrams=None, **kwargs):
+    return [columns.rows[position][0] for position in
+            plan_query(text, columns, trigrams, **kwargs).cursor().count()]
+
+
+def test_quoted_field_value_keeps_spaces():
+    predicate, = parse_query('коммент:"трещина по краю"')
+    assert isinstance(predicate, TextContains)
+    assert predicate.text == 'трещина по краю' and predicate.label == 'коммент'
+
+
+def test_quoted_words_and_unknown_fields_are_plain_text():
+    predicate, = parse_query('"по краю" 10:30')
+    assert isinstance(predicate, TextContains) and predicate.column is None
+    assert predicate.text == 'по краю 10:30'
+    assert is_plain_text('по краю 10:30')
+    assert not is_plain_text('отливка:Ригель')
+
+
+def test_empty_field_value_is_an_error():
+    with pytest.raises(QuerySyntaxError):
+        parse_query('отливка:')
+
+
+@pytest.mark.parametrize('text, end, expected', [
+    ('2025-02', True, ordinal(2025, 2, 28)),
+    ('2025-02', False, ordinal(2025, 2, 1)),
+    ('02.2024', True, ordinal(2024, 2, 29)),
+    ('2024', True, ordinal(2024, 12, 31)),
+    ('2025-12', True, ordinal(2025, 12, 31)),
+    ('15.03.2025', True, ordinal(2025, 3, 15)),
+    ('2025-03-15', False, ordinal(2025, 3, 15)),
+])
+def test_date_bounds_cover_whole_periods(text, end, expected):
+    assert parse_date_bound(text, end=end) == expected
+
+
+def test_date_ranges_in_query():
+    closed, = parse_query('дата:2025-01..2025-02')
+    assert (closed.date_from, closed.date_to) == (ordinal(2025, 1, 1), ordinal(2025, 2, 28))
+    open_start, = parse_query('дата:..2025-01')
+    assert (open_start.date_from, open_start.date_to) == (None, ordinal(2025, 1, 31))
+    single, = parse_query('дата:2024-01')
+    assert (single.date_from, single.date_to) == (ordinal(2024, 1, 1), ordinal(2024, 1, 31))
+    with pytest.raises(QuerySyntaxError):
+        parse_query('дата:31.31.2025')
+
+
+@pytest.mark.parametrize('text, expected', [
+    ('темп.A>1550', ['1']),
+    ('темп.A>=1550', ['1', '2']),
+    ('темп.A<1560', ['2']),
+    ('темп.A<=1560', ['1', '2']),
+    ('темп.A=1550', ['2']),
+    ('темп.А:1550..1560', ['1', '2']),
+    ('темп.B:..1550', ['3']),
+    ('темп>1590', ['2']),
+])
+def test_temperature_operators(columns, text, expected):
+    predicate, = parse_query(text)
+    assert isinstance(predicate, TemperatureRange)
+    assert found(text, columns) == expected
+
+
+@pytest.mark.parametrize('text', ['темп.Q>1500', 'темп.A>горячо'])
+def test_temperature_errors(text):
+    with pytest.raises(QuerySyntaxError):
+        parse_query(text)
+
+
+def test_fields_combine_with_and(columns, trigrams):
+    assert found('отливка:вороток участник:иванов', columns, trigrams) == ['3']
+    assert found('старший:иванов|петров темп.A>1555', columns, trigrams) == ['1']
+    assert found('коммент:трещина дата:2024-01-01..2024-01-09', columns, trigrams) == ['1']
+
+
+def test_planner_picks_most_selective_index(columns, trigrams):
+    plan = plan_query('отливка:вороток коммент:трещина', columns, trigrams)
+    assert isinstance(plan.access, TextContains)
+    assert plan.vector and isinstance(plan.vector[0], CategoryEquals)
+
+    plan = plan_query('отливка:ригель дата:2024-01', columns, trigrams)
+    assert isinstance(plan.access, CategoryEquals)
+    assert isinstance(plan.vector[0], DateRange)
+
+    # Без индекса триграмм текст проверяется после выбора по дате
+    plan = plan_query('коммент:трещина дата:2024-01-01..2024-01-09', columns)
+    assert isinstance(plan.access, DateRange) and isinstance(plan.checks[0], TextContains)
+
+
+def test_planner_prefers_smaller_previous_result(columns, trigrams):
+    plan = plan_query('вороток', columns, trigrams, base=[2])
+    assert plan.access is None
+    assert [columns.rows[position][0] for position in plan.cursor().count()] == ['3']
+
+
+def test_explain_reports_plan_rows_and_time(rows, columns, trigrams, workdir):
+    participants = ParticipantIndex(str(workdir / 'plavka.xlsx'))
+    participants.rebuild(rows)
+    text = explain_query('участник:иванов темп.B>1400', columns, trigrams, participant_index=participants)
+    lines = text.splitlines()
+    assert lines[0] == "Доступ: индекс участников по условию «участник = иванов»"
+    assert "  оценка «участник = иванов»: 2 строк (выбран)" in lines
+    assert "Векторные условия: темп.B > 1400" in lines
+    assert "Строк из пути доступа: 2" in lines
+    assert "После векторных условий: 1" in lines
+    assert "Найдено: 1" in lines
+    assert lines[-1].startswith("Время: ")
+    assert isinstance(parse_query('участник:иванов')[0], CrewMember)
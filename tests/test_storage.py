@@ -0,0 +1,164 @@
+import pytest
+from conftest import make_row
+from plavka_storage import (ExcelRecordStore, SQLiteRecordStore, RecordCache, RecordJournal, WriteCoalescer,
+                            EXCEL_FILENAME)
+
+
+def excel_store(workdir):
+    return ExcelRecordStore(str(workdir / EXCEL_FILENAME))
+
+
+def test_journal_is_replayed_on_load(workdir):
+    store = excel_store(workdir)
+    assert store.insert(make_row('1'))
+    assert store.insert(make_row('2'))
+    assert store.update('1', {"Номер_кластера": '7'})
+
+    _, rows = excel_store(workdir).load()
+    assert [row[0] for row in rows] == ['1', '2']
+    assert rows[0][4] == '7'
+
+
+def test_torn_journal_tail_is_ignored(workdir):
+    store = excel_store(workdir)
+    store.insert(make_row('1'))
+    with open(store.journal.path, 'ab') as journal:
+        journal.write(b'{"op": "insert", "row": ["2"')
+
+    _, rows = excel_store(workdir).load()
+    assert [row[0] for row in rows] == ['1']
+
+
+def test_append_after_torn_tail_keeps_new_record(workdir):
+    store = excel_store(workdir)
+    store.insert(make_row('1'))
+    with open(store.journal.path, 'ab') as journal:
+        journal.write(b'{"op": "insert", "row": ["2"')
+
+    store = excel_store(workdir)
+    assert store.insert(make_row('3'))
+    _, rows = excel_store(workdir).load()
+    assert [row[0] for row in rows] == ['1', '3']
+
+    assert store.compact()
+    _, rows = excel_store(workdir).load()
+    assert [row[0] for row in rows] == ['1', '3']
+
+
+def test_duplicate_insert_is_rejected_like_sqlite(workdir):
+    excel = excel_store(workdir)
+    sqlite = SQLiteRecordStore(str(workdir / 'plavka.db'))
+    try:
+        for store in (excel, sqlite):
+            assert store.insert(make_row('1', Номер_кластера='first'))
+            assert not store.insert(make_row('1', Номер_кластера='second'))
+            assert store.apply_batch([{'op': 'insert', 'row': make_row('2')},
+                                      {'op': 'insert', 'row': make_row('2')},
+                                      {'op': 'update', 'id': '3', 'values': {"Номер_кластера": 'x'}}]) == \
+                [True, False, False]
+            _, rows = store.load()
+            assert [row[0] for row in rows] == ['1', '2']
+            assert rows[0][4] == 'first'
+    finally:
+        sqlite.close()
+
+
+def test_cache_rejects_duplicate_insert(workdir):
+    cache = RecordCache(excel_store(workdir))
+    assert cache.insert(make_row('1', Номер_кластера='first'))
+    assert not cache.insert(make_row('1', Номер_кластера='second'))
+    assert cache.get('1')[4] == 'first'
+    _, rows = cache.load()
+    assert len(rows) == 1
+
+
+def test_compaction_moves_journal_into_workbook(workdir):
+    store = excel_store(workdir)
+    store.insert(make_row('1'))
+    store.insert(make_row('2'))
+    store.update('2', {"Номер_кластера": '5'})
+
+    assert store.compact()
+    assert store.journal.size() == 0
+    store.insert(make_row('3'))
+    assert store.compact()
+
+    _, rows = excel_store(workdir).load()
+    assert [row[0] for row in rows] == ['1', '2', '3']
+    assert rows[1][4] == '5'
+
+
+def test_get_reads_one_sheet_row_after_compaction(workdir, monkeypatch):
+    store = excel_store(workdir)
+    store.insert(make_row('1'))
+    store.insert(make_row('2'))
+    assert store.compact()
+    store.update('2', {"Номер_кластера": '5'})
+
+    # Строка ищется по номеру без загрузки листа
+    store.row_locator = {'1': 2, '2': 3}.get
+    monkeypatch.setattr(store, 'load', lambda: pytest.fail("загрузка всего листа"))
+    assert store.get('1') == make_row('1')
+    assert store.get('2')[4] == '5'
+
+
+def test_interrupted_compaction_is_not_applied_twice(workdir, monkeypatch):
+    store = excel_store(workdir)
+    store.insert(make_row('1'))
+    store.update('1', {"Номер_кластера": 'a'})
+
+    # Книга уже заменена, а журнал не очищен - как при сбое посреди сжатия
+    def crash(self, consumed):
+        raise OSError("сбой")
+    with monkeypatch.context() as patch:
+        patch.setattr(RecordJournal, 'discard', crash)
+        assert not store.compact()
+
+    reopened = excel_store(workdir)
+    assert reopened.journal.size() > 0
+    _, rows = reopened.load()
+    assert [row[0] for row in rows] == ['1']
+
+    # Новая правка после сбоя применяется поверх перенесенной
+    assert reopened.update('1', {"Номер_кластера": 'b'})
+    assert not reopened.insert(make_row('1'))
+    assert reopened.compact()
+
+    _, rows = excel_store(workdir).load()
+    assert [row[0] for row in rows] == ['1']
+    assert rows[0][4] == 'b'
+
+
+def test_sqlite_update_without_values(workdir):
+    store = SQLiteRecordStore(str(workdir / 'plavka.db'))
+    try:
+        store.insert(make_row('1'))
+        assert store.update('1', {})
+        assert not store.update('2', {})
+    finally:
+        store.close()
+
+
+def test_export_includes_journal_while_compaction_is_busy(workdir):
+    store = excel_store(workdir)
+    store.insert(make_row('1'))
+    store.compact()
+    store.insert(make_row('2'))
+
+    backup = str(workdir / 'backup.xlsx')
+    with store._compact_lock:
+        store.export_excel(backup)
+    _, rows = ExcelRecordStore(backup).load()
+    assert [row[0] for row in rows] == ['1', '2']
+
+
+def test_coalescer_flush_writes_queued_operations(workdir):
+    cache = RecordCache(excel_store(workdir))
+    coalescer = WriteCoalescer(cache, window=60)
+    futures = [coalescer.submit_insert(make_row('1')), coalescer.submit_update('1', {"Номер_кластера": '4'})]
+    assert not any(future.done() for future in futures)
+
+    coalescer.flush()
+    assert [future.result(0) for future in futures] == [True, True]
+    _, rows = excel_store(workdir).load()
+    assert rows[0][4] == '4'
@@ -0,0 +1,70 @@
+from datetime import datetime, time
+import pytest
+from openpyxl import Workbook, load_workbook
+from openpyxl.packaging.custom import IntProperty
+from plavka_xlsx import (UnsupportedWorkbook, column_index, read_rows, read_columns, read_row,
+                         read_custom_property)
+
+
+@pytest.fixture
+def workbook_path(tmp_path):
+    workbook = Workbook()
+    sheet = workbook.active
+    sheet.append(['ID', 'Дата', 'Время', 'Температура', 'Флаг', 'Комментарий'])
+    sheet.append(['1', datetime(2024, 1, 5), time(10, 30), 1550, True, 'трещина'])
+    sheet.append(['2', datetime(2024, 2, 29, 8, 15), None, 1562.5, False, None])
+    # Строка 4 пропущена, в строке 5 заполнены не все ячейки
+    sheet['A5'] = '3'
+    sheet['D5'] = -40
+    sheet['F5'] = 'по краю'
+    workbook.custom_doc_props.append(IntProperty(name='journal_sequence', value=7))
+    path = tmp_path / 'book.xlsx'
+    workbook.save(path)
+    return path
+
+
+def openpyxl_rows(path, width):
+    sheet = load_workbook(path).active
+    return [tuple(row) for row in sheet.iter_rows(max_col=width, values_only=True)]
+
+
+@pytest.mark.parametrize('letters, expected', [('A', 0), ('F', 5), ('Z', 25), ('AA', 26), ('AZ', 51)])
+def test_column_index(letters, expected):
+    assert column_index(letters) == expected
+
+
+def test_rows_match_openpyxl(workbook_path):
+    rows = read_rows(str(workbook_path), width=6)
+    assert rows == openpyxl_rows(workbook_path, 6)
+    assert rows[3] == (None,) * 6
+    assert rows[1][2] == time(10, 30) and rows[2][1] == datetime(2024, 2, 29, 8, 15)
+    assert read_rows(str(workbook_path), min_row=5, width=3) == [('3', None, None)]
+
+
+def test_rows_without_width_end_at_last_cell(workbook_path):
+    rows = read_rows(str(workbook_path))
+    assert rows[3] == () and len(rows[4]) == 6
+
+
+def test_columns_and_single_rows(workbook_path):
+    columns = read_columns(str(workbook_path), min_row=2, width=6)
+    assert columns[0] == ['1', '2', None, '3']
+    assert columns[3] == [1550, 1562.5, None, -40]
+    assert read_row(str(workbook_path), 3, width=6) == openpyxl_rows(workbook_path, 6)[2]
+    assert read_row(str(workbook_path), 4, width=6) is None
+    assert read_row(str(workbook_path), 5, width=6) == ('3', None, None, -40, None, 'по краю')
+
+
+def test_custom_property(workbook_path):
+    assert read_custom_property(str(workbook_path), 'journal_sequence') == '7'
+    assert read_custom_property(str(workbook_path), 'unknown') is None
+
+
+def test_formulas_are_not_supported(tmp_path):
+    workbook = Workbook()
+    workbook.active.append([1, 2, '=A1+B1'])
+    path = tmp_path / 'formula.xlsx'
+    workbook.save(path)
+    with pytest.raises(UnsupportedWorkbook):
+        read_rows(str(path))
+    assert read_custom_property(str(path), 'journal_sequence') is None